@@ -0,0 +1,81 @@
+"""
+bench_codec.py
+Wire encoding micro-benchmark
+Compares the size and encode time of every server packet type in JSON
+and in the binary encoding, with the binary packet both as sent
+(deflated or not, per or_codec.deflatePackets) and the other way round.
+
+Usage: python bench/bench_codec.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_codec
+import or_comms as orbComms
+from or_game import GameState, Team
+from or_sector import OrbitalsSector, newGameInfo
+from or_wheel import OrbitalsTimerWheel
+from or_words import OrbitalsWords
+
+
+def samplePackets():
+    """ one packet of every type the server sends, as seen mid-game """
+    words = OrbitalsWords(16)
+    words.shuffleDeck()
+    words.assignKeys()
+    gameInfo = newGameInfo()
+    gameInfo.state = GameState.GUESS_SUBMISSION
+    gameInfo.turn = Team.O
+    gameInfo.guesses = 2
+    gameInfo.orangeHub = gameInfo.blueHub = True
+    gameInfo.hintWord = 'planet'
+    state = orbComms._statePacket(gameInfo, Team.O, False, False, False)
+    state['name'] = 'player1'
+    players = [{'name': f'player{i}', 'team': 'OB'[i % 2], 'hub': i < 2,
+                'ready': i < 2} for i in range(8)]
+    wheel = OrbitalsTimerWheel()
+    sectors = [OrbitalsSector(16, 30, f'SECTOR-{i}', str(i), wheel).getSectorDetails()
+               for i in range(1, 3)]
+    return {'welcome': {'type': 'welcome', 'prompt': 'Enter your name'},
+            'response': {'type': 'response', 'msg': 'team-accepted', 'team': 'O'},
+            'state': state,
+            'players': {'type': 'players', 'players': players, 'enough': True},
+            'time': {'type': 'time', 'time': 27},
+            'words': {'type': 'words', 'words': words.getWords()},
+            'keys': {'type': 'keys', 'keywords': words.getKeywords()},
+            'guess': {'type': 'guess', 'word': 'comet', 'wordTeam': 'O',
+                      'guesser': 'player2', 'guesserTeam': 'O', 'guesses': 1},
+            'msg': {'type': 'msg', 'sender': 'player2', 'team': 'O',
+                    'msg': 'going for comet'},
+            'sectors-update': {'type': 'sectors-update', 'version': 12,
+                               'sectors': sectors, 'removed': []}}
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if not or_codec.msgpackCodec:
+        print("msgpack is not installed: only JSON is available")
+        return
+    jsonCodec = or_codec.jsonCodec
+    binCodec = or_codec.msgpackCodec
+    print(f"{'packet':<16}{'json B':>8}{'bin B':>8}{'other B':>9}"
+          f"{'json us':>10}{'bin us':>10}  deflated")
+    for packetType, packet in samplePackets().items():
+        deflated = or_codec.deflatePackets.get(packetType, False)
+        jsonSize = len(jsonCodec.encode(packet).encode())
+        binSize = len(binCodec.encode(packet))
+        # the same packet with the deflate setting flipped
+        or_codec.deflatePackets[packetType] = not deflated
+        otherSize = len(binCodec.encode(packet))
+        or_codec.deflatePackets[packetType] = deflated
+        jsonTime = timeit.timeit(lambda: jsonCodec.encode(packet), number=number)
+        binTime = timeit.timeit(lambda: binCodec.encode(packet), number=number)
+        print(f"{packetType:<16}{jsonSize:>8}{binSize:>8}{otherSize:>9}"
+              f"{jsonTime / number * 1e6:>10.2f}{binTime / number * 1e6:>10.2f}"
+              f"  {'yes' if deflated else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+bench_dispatch.py
+Inbound dispatch micro-benchmark
+Times decoding, validating and routing one message of every type the
+lobby and the sectors handle, to handlers that return straight away,
+and the cost of rejecting malformed messages.
+
+Usage: python bench/bench_dispatch.py [iterations]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_codec
+import or_comms as orbComms
+import or_dispatch
+from or_cluster import OrbitalsCluster
+from or_sector import sectorMessages
+
+
+class FakeSocket:
+    """ stands in for a websocket: swallows every frame """
+    async def send(self, msg):
+        pass
+
+
+class NullTarget:
+    """ has every handler a dispatcher may look up, none of them do anything """
+    def __getattr__(self, name):
+        async def handler(websocket, *values):
+            pass
+        setattr(self, name, handler)
+        return handler
+
+
+messages = [(sectorMessages, {'type': 'team-request', 'team': 'O'}),
+            (sectorMessages, {'type': 'hub-request'}),
+            (sectorMessages, {'type': 'ready'}),
+            (sectorMessages, {'type': 'message', 'message': 'going for comet'}),
+            (sectorMessages, {'type': 'hint', 'hint': 'planet', 'guesses': '2'}),
+            (sectorMessages, {'type': 'hint-response', 'response': True}),
+            (sectorMessages, {'type': 'guess', 'guess': 'comet'}),
+            (sectorMessages, {'type': 'replay'}),
+            (OrbitalsCluster.lobbyMessages, {'type': 'name-request', 'name': 'player1'}),
+            (OrbitalsCluster.lobbyMessages, {'type': 'join-sector', 'sector': 'SECTOR-1'}),
+            (OrbitalsCluster.lobbyMessages, {'type': 'options', 'batch': True}),
+            (OrbitalsCluster.memberMessages, {'type': 'leave-sector'}),
+            # rejected: a missing field, then a malformed one
+            (sectorMessages, {'type': 'guess'}),
+            (sectorMessages, {'type': 'hint', 'hint': 'planet', 'guesses': 'two'})]
+
+
+def runOnce(coroutine):
+    """ runs a coroutine that never suspends """
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        pass
+
+
+async def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    codec = or_codec.jsonCodec
+    websocket = FakeSocket()
+    target = NullTarget()
+    # rejections pile up for the socket until flushed: room for all of them
+    orbComms.setSendBudget(number * len(messages))
+    print(f"{'message':<16}{'fields':<22}{'decode us':>10}{'dispatch us':>13}")
+    for dispatcher, data in messages:
+        frame = codec.encode(data)
+        started = time.perf_counter()
+        for _ in range(number):
+            or_dispatch.decodeMessage(codec, frame)
+        decodeTime = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(number):
+            runOnce(dispatcher.dispatch(target, websocket, data))
+        dispatchTime = time.perf_counter() - started
+        # rejections are sent: let them go before the next type
+        await orbComms.flush()
+        fields = ','.join(key for key in data if key != 'type') or '-'
+        print(f"{data['type']:<16}{fields[:21]:<22}"
+              f"{decodeTime / number * 1e6:>10.2f}{dispatchTime / number * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+bench_players.py
+Roster micro-benchmark
+Times the OrbitalsPlayers queries and mutations used on every sector
+event, on rosters with a full set of players plus many spectators.
+
+Usage: python bench/bench_players.py [spectators ...]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from or_game import Team
+from or_players import OrbitalsPlayers
+
+
+class FakeSocket:
+    """ stands in for a websocket: only used as a dict key """
+
+
+def buildRoster(spectators):
+    """ 8 players in two teams with hubs, plus spectators """
+    players = OrbitalsPlayers()
+    sockets = []
+    for i in range(8 + spectators):
+        websocket = FakeSocket()
+        players.addPlayer(f'player{i}', websocket)
+        sockets.append(websocket)
+    for i, websocket in enumerate(sockets[:8]):
+        players.joinTeam(websocket, Team.O if i % 2 else Team.B)
+    players.requestHub(sockets[0])
+    players.requestHub(sockets[1])
+    return players, sockets
+
+
+def bench(label, statement, number):
+    seconds = timeit.timeit(statement, number=number)
+    print(f"  {label:<28}{seconds / number * 1e6:10.3f} us/op")
+
+
+def main():
+    spectatorCounts = [int(arg) for arg in sys.argv[1:]] or [0, 100, 1000, 10000]
+    for spectators in spectatorCounts:
+        players, sockets = buildRoster(spectators)
+        guesser = sockets[2]
+        spectator = sockets[-1]
+        print(f"{spectators} spectators:")
+        bench('enoughPlayers', players.enoughPlayers, 100000)
+        bench('hubAvailable', lambda: players.hubAvailable(Team.O), 100000)
+        bench('playerId', lambda: players.playerId(spectator), 100000)
+        bench('playerName', lambda: players.playerName(spectator), 100000)
+        bench('getTeam', lambda: players.getTeam(f'player{spectators + 7}'), 100000)
+        bench('joinTeam round trip',
+              lambda: (players.joinTeam(guesser, Team.O),
+                       players.joinTeam(guesser, Team.B)), 20000)
+        bench('requestHub round trip',
+              lambda: (players.requestHub(sockets[0]),
+                       players.requestHub(sockets[0])), 20000)
+
+
+if __name__ == "__main__":
+    main()
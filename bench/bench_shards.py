@@ -0,0 +1,90 @@
+"""
+bench_shards.py
+Sharding throughput benchmark
+Starts or_server.py with 1, 2, 4 ... worker processes and measures how
+many team-request round trips per second a fixed population of clients
+completes. Each team change is answered with a response, state, players
+and chat broadcast to the sector, so most of the work happens in the
+process that owns the sector.
+
+Usage: python bench/bench_shards.py [sectors] [seconds] [workers ...]
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+serverScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'or_server.py')
+playersPerSector = 4
+
+
+async def client(url, name, sector, deadline):
+    """ toggles teams as fast as the server answers, returns round trips """
+    roundTrips = 0
+    async with websockets.connect(url) as websocket:
+        await websocket.send(json.dumps({'type': 'name-request', 'name': name}))
+        await websocket.send(json.dumps({'type': 'join-sector', 'sector': sector}))
+        team = 'O'
+        await websocket.send(json.dumps({'type': 'team-request', 'team': team}))
+        while time.time() < deadline:
+            packet = json.loads(await websocket.recv())
+            if packet['type'] == 'response' and packet['msg'] in ('team-accepted', 'team-rejected'):
+                roundTrips += 1
+                team = 'B' if team == 'O' else 'O'
+                await websocket.send(json.dumps({'type': 'team-request', 'team': team}))
+    return roundTrips
+
+
+def clientProcess(url, sectors, seconds, results):
+    async def run():
+        deadline = time.time() + seconds
+        clients = [client(url, f'{sector}-{i}', sector, deadline)
+                   for sector in sectors for i in range(playersPerSector)]
+        return sum(await asyncio.gather(*clients))
+    results.put(asyncio.run(run()))
+
+
+def bench(workers, sectorCount, seconds, port):
+    server = subprocess.Popen([sys.executable, serverScript, '-p', str(port),
+                               '-w', str(workers), '--sectors', str(sectorCount)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(3)
+        url = f'ws://127.0.0.1:{port}'
+        sectors = [f'SECTOR-{i + 1}' for i in range(sectorCount)]
+        # spread the clients over a few processes so they are not the bottleneck
+        processCount = min(4, sectorCount)
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=clientProcess,
+                                           args=(url, sectors[i::processCount], seconds, results))
+                   for i in range(processCount)]
+        for process in clients:
+            process.start()
+        roundTrips = sum(results.get() for _ in clients)
+        for process in clients:
+            process.join()
+        return roundTrips / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    sectorCount = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workerCounts = [int(arg) for arg in sys.argv[3:]] or [1, 2, 4]
+    print(f"{sectorCount} sectors, {sectorCount * playersPerSector} clients, {seconds} s per run")
+    baseline = None
+    for i, workers in enumerate(workerCounts):
+        rate = bench(workers, sectorCount, seconds, 9301 + i)
+        baseline = baseline or rate
+        print(f"  {workers} worker(s): {rate:8.0f} team requests/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+bench_suite.py
+Micro-benchmark suite for the core game objects
+Times the pure-Python hot paths and measures the memory each call
+allocates, then compares the results with the stored baseline and
+flags the cases that got slower or allocate more. Runs without any
+network: sockets are in-memory fakes.
+
+Usage:
+    python bench/bench_suite.py             compare with bench/baseline.json
+    python bench/bench_suite.py --save      store the results as the new baseline
+    python bench/bench_suite.py words       only the cases whose name contains 'words'
+Exits with status 1 if any case regressed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_codec
+import or_comms as orbComms
+from or_cluster import OrbitalsCluster
+from or_directory import OrbitalsDirectory
+from or_game import GameState, Team
+from or_players import OrbitalsPlayers
+from or_pubsub import OrbitalsTopics
+from or_sector import OrbitalsSector, newGameInfo
+from or_session import OrbitalsSession
+from or_wheel import OrbitalsTimerWheel
+from or_words import OrbitalsWords
+
+baselineFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class FakeSocket:
+    """ stands in for a websocket: swallows every frame """
+    async def send(self, msg):
+        pass
+
+
+def wordsShuffleDeck():
+    words = OrbitalsWords(16)
+    return words.shuffleDeck
+
+
+def wordsAssignKeys():
+    words = OrbitalsWords(16)
+    words.shuffleDeck()
+    return words.assignKeys
+
+
+def wordsNewGuess():
+    """ guesses every word of a fresh board: one call opens one word """
+    boards = []
+    for _ in range(200):
+        words = OrbitalsWords(16)
+        words.shuffleDeck()
+        words.assignKeys()
+        boards.append(words)
+    guesses = [(words, word, team) for words in boards
+               for word, team in zip(list(words._orbWords), 'OB' * 8)]
+    guesses.reverse()
+
+    def guess():
+        words, word, team = guesses.pop()
+        words.newGuess(word, team)
+    return guess, len(guesses)
+
+
+def wordsGetWords():
+    words = OrbitalsWords(16)
+    words.shuffleDeck()
+    words.assignKeys()
+    return words.getWords
+
+
+def fullRoster():
+    """ 8 players in two teams, with both hubs taken """
+    players = OrbitalsPlayers()
+    sockets = [FakeSocket() for _ in range(8)]
+    for i, websocket in enumerate(sockets):
+        players.addPlayer(f'player{i}', websocket)
+        players.joinTeam(websocket, (Team.O, Team.B)[i % 2])
+    players.requestHub(sockets[0])
+    players.requestHub(sockets[1])
+    return players, sockets
+
+
+def playersJoinTeam():
+    players, sockets = fullRoster()
+    guesser = sockets[2]
+    # room in blue for the guesser to move to
+    players.removePlayer(sockets[3])
+
+    def switch():
+        players.joinTeam(guesser, Team.B)
+        players.joinTeam(guesser, Team.O)
+    return switch
+
+
+def playersRequestHub():
+    players, sockets = fullRoster()
+
+    def toggle():
+        players.requestHub(sockets[0])
+        players.requestHub(sockets[0])
+    return toggle
+
+
+def playersEnoughPlayers():
+    players, _ = fullRoster()
+    return players.enoughPlayers
+
+
+def fullSector():
+    sector = OrbitalsSector(16, 30, 'SECTOR-1', '1', OrbitalsTimerWheel())
+    players, _ = fullRoster()
+    sector._players = players
+    return sector
+
+
+def sectorGetSectorDetails():
+    return fullSector().getSectorDetails
+
+
+def clusterGetClusterStatus():
+    cluster = OrbitalsCluster(sectorCount=64)
+    return cluster.getClusterStatus
+
+
+def gameInProgress():
+    gameInfo = newGameInfo()
+    gameInfo.state = GameState.GUESS_SUBMISSION
+    gameInfo.turn = Team.O
+    gameInfo.guesses = 2
+    gameInfo.orangeHub = gameInfo.blueHub = True
+    gameInfo.hintWord = 'ORBIT'
+    players, _ = fullRoster()
+    return gameInfo, list(players.getPlayers())
+
+
+def commsPublishState():
+    """ 8 players, state cache warm: the steady state between changes """
+    gameInfo, players = gameInProgress()
+    cache = orbComms.OrbitalsStateCache()
+
+    def publish():
+        with orbComms.batched() as batch:
+            runOnce(orbComms.publishState(gameInfo, players, cache))
+            batch.close()
+    return publish
+
+
+def commsPublishStateCold():
+    """ 8 players, a new state cache on every call: right after a change """
+    gameInfo, players = gameInProgress()
+
+    def publish():
+        with orbComms.batched() as batch:
+            runOnce(orbComms.publishState(gameInfo, players, orbComms.OrbitalsStateCache()))
+            batch.close()
+    return publish
+
+
+def commsPublishStateDiffs():
+    """ 8 diffing players, every call a new state version: one diff each """
+    gameInfo, players = gameInProgress()
+    cache = orbComms.OrbitalsStateCache()
+    for player in players:
+        orbComms.setDiffing(player.getWebSocket(), True)
+
+    def publish():
+        gameInfo.guesses = 3 - gameInfo.guesses
+        with orbComms.batched() as batch:
+            runOnce(orbComms.publishState(gameInfo, players, cache))
+            batch.close()
+    return publish
+
+
+def commsWordsSnapshot():
+    """ the board frame a player joining a game in progress gets """
+    words = OrbitalsWords(16)
+    words.shuffleDeck()
+    words.assignKeys()
+    cache = orbComms.OrbitalsBoardCache()
+
+    def snapshot():
+        return cache.getWordsMessage(words).getFrame(or_codec.jsonCodec)
+    return snapshot
+
+
+def commsOutboxBacklog():
+    """ a client that fell behind: every tick replaces the one still queued """
+    outbox = orbComms.OrbitalsOutbox(FakeSocket())
+    outbox.add({'type': 'guess', 'word': 'ORBIT'}, 'guess', None, None)
+    tick = orbComms.OrbitalsPacket({'type': 'time', 'time': 30})
+
+    def queue():
+        outbox.add(tick, 'time', None, None)
+    return queue
+
+
+def memoryIdleConnection():
+    """ a named connection seated in a sector, with its session: kept alive """
+    directory = OrbitalsDirectory()
+    players = OrbitalsPlayers(directory)
+    kept = []
+
+    def connect():
+        websocket = FakeSocket()
+        name = f'player{len(kept)}'
+        directory.connect(websocket)
+        directory.claimName(websocket, name)
+        players.addPlayer(name, websocket)
+        kept.append(OrbitalsSession(websocket))
+    return connect
+
+
+def memoryIdleSector():
+    """ a hibernating sector, as the cluster keeps them between games: kept alive """
+    wheel = OrbitalsTimerWheel()
+    topics = OrbitalsTopics()
+    directory = OrbitalsDirectory()
+    kept = []
+
+    def newSector():
+        kept.append(OrbitalsSector(16, 30, f'SECTOR-{len(kept)}', '1', wheel,
+                                   topics=topics, directory=directory))
+    return newSector
+
+
+def runOnce(coroutine):
+    """ runs a coroutine that never suspends """
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        pass
+
+
+# name, setup returning the operation, calls per timing run
+cases = [('words.shuffleDeck', wordsShuffleDeck, 20000),
+         ('words.assignKeys', wordsAssignKeys, 20000),
+         ('words.newGuess', wordsNewGuess, None),
+         ('words.getWords', wordsGetWords, 20000),
+         ('players.joinTeam x2', playersJoinTeam, 20000),
+         ('players.requestHub x2', playersRequestHub, 20000),
+         ('players.enoughPlayers', playersEnoughPlayers, 100000),
+         ('sector.getSectorDetails', sectorGetSectorDetails, 50000),
+         ('cluster.getClusterStatus/64', clusterGetClusterStatus, 2000),
+         ('comms.publishState/8', commsPublishState, 5000),
+         ('comms.publishState/8 cold', commsPublishStateCold, 5000),
+         ('comms.publishState/8 diffs', commsPublishStateDiffs, 5000),
+         ('comms.wordsSnapshot', commsWordsSnapshot, 100000),
+         ('comms.outboxBacklog', commsOutboxBacklog, 100000),
+         ('memory.idleConnection', memoryIdleConnection, 20000),
+         ('memory.idleSector', memoryIdleSector, 20000)]
+
+
+def timeCase(setup, number, repeat=5):
+    """ Returns the best time per call in microseconds over repeat runs """
+    best = None
+    for _ in range(repeat):
+        operation = setup()
+        if isinstance(operation, tuple):
+            operation, number = operation
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        perCall = (time.perf_counter() - started) / number * 1e6
+        best = perCall if best is None else min(best, perCall)
+    return best
+
+
+def tracedBlocks():
+    """ Returns the number of memory blocks allocated and not freed yet """
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+
+
+def allocationsCase(setup, calls=200):
+    """
+    Returns the bytes and blocks allocated per call:
+    the peak traced while the calls run, and what is left allocated after
+    """
+    random.seed(1)
+    operation = setup()
+    if isinstance(operation, tuple):
+        operation = operation[0]
+    operation()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocksBefore = tracedBlocks()
+    tracemalloc.reset_peak()
+    for _ in range(calls):
+        operation()
+    _, peak = tracemalloc.get_traced_memory()
+    blocksAfter = tracedBlocks()
+    tracemalloc.stop()
+    return (peak - before) / calls, max(0, blocksAfter - blocksBefore) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filters", nargs='*', help="only run cases whose name contains one of these")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown or allocation growth flagged as a regression")
+    args = parser.parse_args()
+
+    baseline = dict()
+    if os.path.exists(baselineFileName):
+        with open(baselineFileName) as baselineFile:
+            baseline = json.load(baselineFile)
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    results = dict()
+    regressions = []
+    print(f"{'case':<30}{'us/call':>10}{'base':>10}{'B/call':>10}{'blocks':>8}")
+    for name, setup, number in cases:
+        if args.filters and not any(part in name for part in args.filters):
+            continue
+        perCall = timeCase(setup, number)
+        allocated, retained = allocationsCase(setup)
+        results[name] = {'us': round(perCall, 3), 'bytes': round(allocated),
+                         'blocks': round(retained, 2)}
+        previous = baseline.get(name)
+        flag = ''
+        if previous:
+            if perCall > previous['us'] * (1 + args.tolerance):
+                flag += ' SLOWER'
+            if allocated > previous['bytes'] * (1 + args.tolerance) + 64:
+                flag += ' MORE MEMORY'
+            if flag:
+                regressions.append(name)
+        base = f"{previous['us']:>10.3f}" if previous else f"{'-':>10}"
+        print(f"{name:<30}{perCall:>10.3f}{base}{allocated:>10.0f}{retained:>8.2f}{flag}")
+
+    if args.save:
+        baseline.update(results)
+        with open(baselineFileName, 'w') as baselineFile:
+            json.dump(baseline, baselineFile, indent=2, sort_keys=True)
+            baselineFile.write('\n')
+        print(f"baseline saved to {baselineFileName}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+bench_wheel.py
+Timer wheel benchmark
+Arms one repeating one-second deadline per simulated sector and reports
+the wheel's tick cost and drift, next to the drift of the equivalent
+per-sector asyncio.sleep(1) loops.
+
+Usage: python bench/bench_wheel.py [sectors] [seconds]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from or_wheel import OrbitalsTimerWheel
+
+
+class FakeSector:
+    """ re-arms a one second deadline, like a running turn timer """
+    def __init__(self, wheel):
+        self._wheel = wheel
+        # sectors start their turns at random points within a second
+        self._deadline = wheel.now() + 1 + random.random()
+
+    def start(self):
+        self._wheel.schedule(self, self._deadline, self.tick)
+
+    def tick(self):
+        self._deadline += 1
+        self._wheel.schedule(self, self._deadline, self.tick)
+
+
+async def benchWheel(sectors, seconds):
+    wheel = OrbitalsTimerWheel()
+    fakeSectors = [FakeSector(wheel) for _ in range(sectors)]
+    for sector in fakeSectors:
+        sector.start()
+    await asyncio.sleep(seconds)
+    for sector in fakeSectors:
+        wheel.cancel(sector)
+    return wheel.getStats()
+
+
+async def sleepLoop(drifts, seconds):
+    deadline = time.monotonic()
+    for _ in range(seconds):
+        deadline += 1
+        await asyncio.sleep(1)
+        drifts.append(time.monotonic() - deadline)
+
+
+async def benchSleepLoops(sectors, seconds):
+    drifts = []
+    await asyncio.gather(*[sleepLoop(drifts, seconds) for _ in range(sectors)])
+    return drifts
+
+
+def main():
+    sectors = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{sectors} sectors, {seconds} s")
+
+    stats = asyncio.run(benchWheel(sectors, seconds))
+    print("timer wheel:")
+    print(f"  deadlines fired: {stats['fired']}")
+    print(f"  tick cost:  mean {stats['meanTickTime'] * 1e3:.3f} ms, "
+          f"max {stats['maxTickTime'] * 1e3:.3f} ms")
+    print(f"  per deadline: {stats['tickTime'] / max(stats['fired'], 1) * 1e6:.2f} us")
+    print(f"  drift:      mean {stats['meanDrift'] * 1e3:.3f} ms, "
+          f"max {stats['maxDrift'] * 1e3:.3f} ms")
+
+    drifts = sorted(asyncio.run(benchSleepLoops(sectors, seconds)))
+    print("per-sector sleep loops:")
+    print(f"  drift:      mean {sum(drifts) / len(drifts) * 1e3:.3f} ms, "
+          f"max {drifts[-1] * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+loadgen.py
+Headless load generator
+Opens four bot clients per sector, an orange and a blue hub and an
+orange and a blue guesser, which play complete games: name, join, team
+and hub requests, ready, hints, hint responses, guesses and replays.
+Reports the messages per second the server handled and the latency from
+each bot action to the server's answer to it.
+
+With --find-capacity, the sector count doubles each round until games
+stop completing or the p99 latency goes over --max-p99, and the highest
+sector and connection count that held is reported.
+
+The server must keep at least as many sectors as are played: --spawn
+starts one with the right --sectors setting.
+
+Usage:
+    python bench/loadgen.py --spawn --sectors 8 --games 2
+    python bench/loadgen.py --url ws://host:9001 --sectors 8
+    python bench/loadgen.py --spawn --find-capacity --max-p99 0.25
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_codec
+
+serverScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'or_server.py')
+
+# team and hub flag of the bots in every sector
+seats = [('O', True), ('O', False), ('B', True), ('B', False)]
+
+# packet type answering each bot action
+replyTypes = {'team-request': 'response',
+              'hub-request': 'response',
+              'ready': 'response',
+              'hint': 'state',
+              'hint-response': 'state',
+              'guess': 'guess',
+              'replay': 'replay-ack'}
+
+# actions a sector rejects once another bot's changed the game first
+gameRequests = frozenset(('ready', 'hint', 'hint-response', 'guess', 'replay'))
+
+
+class Bot:
+    """ one client playing games in a sector """
+
+    def __init__(self, url, name, sector, team, hub, games, codec, options):
+        self.url = url
+        self.name = name
+        self.sector = sector
+        self.team = team
+        self.hub = hub
+        self.games = games
+        self.codec = codec
+        self.options = options
+        self.gamesPlayed = 0
+        self.received = 0
+        self.sent = 0
+        self.latencies = []
+        self.words = dict()
+        self.canGuess = False
+        self.pending = None
+        self.websocket = None
+
+    async def run(self):
+        """ plays until the bot has finished its games """
+        subprotocols = [self.codec.subprotocol] if self.codec is not or_codec.jsonCodec else None
+        async with websockets.connect(self.url, subprotocols=subprotocols) as websocket:
+            self.websocket = websocket
+            if any(self.options.values()):
+                await self.send(dict(self.options, type='options'))
+            await self.send({'type': 'name-request', 'name': self.name})
+            async for frame in websocket:
+                packet = self.codec.decode(frame)
+                packets = packet['packets'] if packet['type'] == 'batch' else [packet]
+                for packet in packets:
+                    self.received += 1
+                    if await self.onPacket(packet):
+                        return
+
+    async def send(self, packet):
+        if packet['type'] in replyTypes:
+            self.pending = (replyTypes[packet['type']], time.perf_counter())
+        self.sent += 1
+        await self.websocket.send(self.codec.encode(packet))
+
+    async def guess(self):
+        closed = [word for word, team in self.words.items() if team == '-']
+        if closed:
+            await self.send({'type': 'guess', 'guess': random.choice(closed)})
+
+    async def onPacket(self, packet):
+        """ answers a packet, Returns True once every game is played """
+        packetType = packet['type']
+        if self.pending and self.pending[0] == packetType:
+            self.latencies.append(time.perf_counter() - self.pending[1])
+            self.pending = None
+
+        if packetType == 'response':
+            msg = packet['msg']
+            if msg == 'name-accepted':
+                await self.send({'type': 'join-sector', 'sector': self.sector})
+            elif msg == 'joined-sector':
+                await self.send({'type': 'team-request', 'team': self.team})
+            elif msg == 'team-accepted' and self.hub:
+                await self.send({'type': 'hub-request'})
+            elif msg == 'rejected' and packet['request'] in gameRequests:
+                # lost a race with another bot's action: the server answered
+                self.pending = None
+            elif msg in ('name-not-accepted', 'rejected'):
+                raise RuntimeError(f"{self.name}: {packet}")
+        elif packetType == 'words':
+            self.words = {word['word']: word['team'] for word in packet['words']}
+        elif packetType == 'guess':
+            self.words[packet['word']] = packet['wordTeam']
+            if self.canGuess and packet['guesses'] > 0 and packet['wordTeam'] == self.team:
+                await self.guess()
+        elif packetType == 'state':
+            state = packet['state']
+            self.canGuess = bool(packet.get('enableGuesses')) and not self.hub
+            if state == 'waiting-start' and packet.get('entry') == 'ready-area' \
+                    and not packet.get('ready'):
+                await self.send({'type': 'ready'})
+            elif self.hub and packet.get('comms') == 'hint-submission':
+                await self.send({'type': 'hint', 'hint': 'ORBIT', 'guesses': 2})
+            elif self.hub and packet.get('comms') == 'hint-response':
+                await self.send({'type': 'hint-response', 'response': True})
+            elif self.canGuess:
+                await self.guess()
+            elif state == 'game-over' and packet.get('comms') == 'replay':
+                self.gamesPlayed += 1
+                if self.gamesPlayed >= self.games:
+                    return True
+                await self.send({'type': 'replay'})
+        return False
+
+
+def botProcess(url, sectors, games, encoding, options, timeout, results):
+    """ plays the games of a share of the sectors, puts its totals on results """
+    codec = or_codec.forSubprotocol(encoding)
+
+    async def run():
+        bots = [Bot(url, f'{sector}-{seat}', sector, team, hub, games, codec, options)
+                for sector in sectors for seat, (team, hub) in enumerate(seats)]
+        outcomes = await asyncio.wait_for(
+            asyncio.gather(*(bot.run() for bot in bots), return_exceptions=True), timeout)
+        failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        return bots, failures
+
+    try:
+        bots, failures = asyncio.run(run())
+    except asyncio.TimeoutError:
+        results.put({'failures': len(sectors) * len(seats), 'received': 0, 'sent': 0,
+                     'latencies': [], 'errors': ['timed out']})
+        return
+    results.put({'failures': len(failures),
+                 'received': sum(bot.received for bot in bots),
+                 'sent': sum(bot.sent for bot in bots),
+                 'latencies': [latency for bot in bots for latency in bot.latencies],
+                 'errors': [repr(failure) for failure in failures[:3]]})
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def playRound(url, sectorCount, args):
+    """ plays args.games games in each of sectorCount sectors, Returns the totals """
+    sectors = [f'SECTOR-{i + 1}' for i in range(sectorCount)]
+    processCount = max(1, min(args.processes, sectorCount))
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=botProcess,
+                                         args=(url, sectors[i::processCount], args.games,
+                                               args.encoding,
+                                               {'batch': args.batch, 'clock': args.clock},
+                                               args.timeout,
+                                               results))
+                 for i in range(processCount)]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    latencies = [latency for total in totals for latency in total['latencies']]
+    return {'sectors': sectorCount,
+            'connections': sectorCount * len(seats),
+            'elapsed': elapsed,
+            'received': sum(total['received'] for total in totals),
+            'sent': sum(total['sent'] for total in totals),
+            'failures': sum(total['failures'] for total in totals),
+            'errors': [error for total in totals for error in total['errors']],
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99)}
+
+
+def printRound(result):
+    rate = (result['received'] + result['sent']) / result['elapsed']
+    print(f"{result['sectors']:>8}{result['connections']:>7}{result['elapsed']:>9.1f}"
+          f"{result['received'] / result['elapsed']:>10.0f}{result['sent'] / result['elapsed']:>9.0f}"
+          f"{rate:>10.0f}{result['p50'] * 1000:>9.1f}{result['p99'] * 1000:>9.1f}"
+          f"{result['failures']:>6}")
+    for error in result['errors']:
+        print(f"    {error}")
+
+
+def startServer(port, sectorCount, workers):
+    server = subprocess.Popen([sys.executable, serverScript, '-p', str(port),
+                               '--sectors', str(sectorCount), '-w', str(workers)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2 if workers == 1 else 4)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://127.0.0.1:9001",
+                        help="server to load, ignored with --spawn")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a local or_server.py for every round")
+    parser.add_argument("--port", type=int, default=9101,
+                        help="port of the spawned server")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes of the spawned server")
+    parser.add_argument("--sectors", type=int, default=4,
+                        help="sectors to play in, the first round's with --find-capacity")
+    parser.add_argument("--games", type=int, default=1, help="games per sector")
+    parser.add_argument("--processes", type=int, default=4,
+                        help="bot processes, so the bots are not the bottleneck")
+    parser.add_argument("--encoding", choices=[or_codec.jsonSubprotocol,
+                                               or_codec.msgpackSubprotocol],
+                        default=or_codec.jsonSubprotocol)
+    parser.add_argument("--batch", action="store_true", help="ask for batch frames")
+    parser.add_argument("--clock", action="store_true",
+                        help="ask for turn deadlines instead of time packets")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="seconds a round may take")
+    parser.add_argument("--find-capacity", action="store_true",
+                        help="double the sectors until games fail or p99 is too slow")
+    parser.add_argument("--max-p99", type=float, default=0.25,
+                        help="p99 action latency in seconds a round must stay under")
+    parser.add_argument("--max-sectors", type=int, default=1024)
+    args = parser.parse_args()
+
+    print(f"{'sectors':>8}{'conns':>7}{'secs':>9}{'in/s':>10}{'out/s':>9}"
+          f"{'msgs/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'fail':>6}")
+    sectorCount = args.sectors
+    sustained = None
+    while True:
+        server = startServer(args.port, sectorCount, args.workers) if args.spawn else None
+        url = f'ws://127.0.0.1:{args.port}' if args.spawn else args.url
+        try:
+            result = playRound(url, sectorCount, args)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+        printRound(result)
+        held = not result['failures'] and result['p99'] <= args.max_p99
+        if not args.find_capacity:
+            break
+        if not held:
+            break
+        sustained = result
+        if sectorCount * 2 > args.max_sectors:
+            break
+        sectorCount *= 2
+
+    if args.find_capacity:
+        if sustained:
+            print(f"sustained: {sustained['sectors']} sectors, "
+                  f"{sustained['connections']} connections "
+                  f"(p99 {sustained['p99'] * 1000:.1f} ms)")
+        else:
+            print(f"no round held: p99 over {args.max_p99 * 1000:.0f} ms or games failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,45 +2,266 @@
 or_cluster.py
 Orbitals cluster module
 Tracks quadrants and routes player packets accordingly.
+The sector pool is elastic:
+- a new sector is created whenever every open sector is full
+- empty sectors hibernate, releasing their board and timer
+- sectors that stay empty for the idle grace period are reclaimed,
+  down to the minimum sector count
+With a journal, the sectors that were in play when the server stopped
+are recovered on startup and hold their players' seats for the idle
+grace period. A replacement started while the old server drains adopts
+the journal once the old server exits.
+Named users get a session with a resume token: a player whose
+connection drops keeps their place for the resume grace period and can
+pick up where they left off from a new connection.
+Lobby users get a full sector list when they enter the lobby, then
+versioned updates carrying only the sectors that changed; changes made
+within the status window are merged into a single update.
 """
-import json
-from pprint import pprint
-from or_sector import OrbitalsSector
+import asyncio
+import functools
+import random
+import threading
+import time
+import or_comms as orbComms
+import or_log
+import or_metrics
+from or_directory import OrbitalsDirectory
+from or_dispatch import (OrbitalsDispatcher, OrbitalsRejection,
+                         flag, integer, rejectMessage, text)
+from or_pubsub import OrbitalsTopics, lobbyTopic
+from or_sector import OrbitalsSector, sectorMessages
+from or_session import OrbitalsSession
+from or_wheel import OrbitalsTimerWheel
 
-sectorNames = ['ALPHA', 'BETA', 'GAMMA', 'DELTA',
-               'PHI', 'CHI', 'PSI', 'OMEGA']
-sectorSymbols = ['α', 'β', 'γ', 'δ',
-               'φ', 'χ', 'ψ', 'ω']
+log = or_log.getLogger('cluster')
+
+_connectionsOpened = or_metrics.counter('orbitals_connections_total',
+                                        'Websocket connections accepted')
+_sectorsReclaimed = or_metrics.counter('orbitals_sectors_reclaimed_total',
+                                       'Idle sectors reclaimed')
+_lobbyUpdates = or_metrics.counter('orbitals_lobby_updates_total',
+                                   'Lobby updates published')
+_sessionsHeld = or_metrics.counter('orbitals_sessions_held_total',
+                                   'Dropped connections held for resumption')
+_resumeRequests = or_metrics.counter('orbitals_resume_requests_total',
+                                     'Resume requests, by outcome', ('outcome',))
+_framesReplayed = or_metrics.counter('orbitals_frames_replayed_total',
+                                     'Frames replayed to resumed sessions')
 
 class OrbitalsCluster:
     """ Top level class """
+    # messages handled by the cluster itself, in the lobby and in a sector
+    lobbyMessages = OrbitalsDispatcher()
+    memberMessages = OrbitalsDispatcher()
 
-    def __init__(self, sectorCount = 4):
-        # initialize set of quadrants
-        self._sectors = set()
-        self._userSectors = dict()
+    def __init__(self, sectorCount = 4, idleGrace = 300,
+                 firstSectorId = 1, sectorIdStride = 1, statusWindow = 0.1,
+                 journal = None, resumeGrace = 30):
+        # sectors by name, in creation order
         self._sectorDict = dict()
-        self._userNames = dict()
-        self.populateSectors(sectorCount)
-        
+        self._openSectors = set()
+        # sector ids: firstSectorId, firstSectorId + stride, ...
+        # so clusters running side by side never hand out the same id
+        self._nextSectorId = firstSectorId
+        self._sectorIdStride = sectorIdStride
+        self._statusListeners = []
+        # lobby updates: version, pending changes and coalescing window
+        self._statusVersion = 0
+        self._dirtySectors = set()
+        self._removedSectors = []
+        self._statusWindow = statusWindow
+        self._minSectors = sectorCount
+        self._idleGrace = idleGrace
+        # player and sector of every connection, shared with the sectors
+        self._directory = OrbitalsDirectory()
+        # lobby, sector, team and hub audiences, shared with the sectors
+        self._topics = OrbitalsTopics()
+        # sessions by resume token, held for resumeGrace seconds after a drop
+        self._sessions = dict()
+        self._resumeGrace = resumeGrace
+        self._timerWheel = OrbitalsTimerWheel()
+        self._journal = None
+        self._draining = False
+        # the latest cluster of the process reports the cluster gauges
+        or_metrics.addCollector(self.collectMetrics, 'cluster')
+        if journal:
+            if journal.lock():
+                self._journal = journal
+                self.restoreSectors(journal.recover())
+                journal.start()
+            else:
+                log.info("Journal is held by another server, adopting it once that server exits")
+                waiter = threading.Thread(target=self.waitForJournal,
+                                          args=(journal, asyncio.get_event_loop()),
+                                          daemon=True)
+                waiter.start()
+        self.populateSectors(sectorCount - len(self._sectorDict))
+
     def populateSectors(self, count):
         # populate quadrant set
-        for i in range(count):
-            newSector = OrbitalsSector(wordCount=16,
-                                           turnTimeout=30,
-                                           name=sectorNames[i],
-                                           symbol=sectorSymbols[i])
-            self._sectors.add(newSector)
-            self._sectorDict[sectorNames[i]] = newSector
-    
+        for _ in range(count):
+            self.newSector()
+
+    def newSector(self, sectorId=None):
+        """ creates a hibernating sector with the next free id, or with sectorId """
+        if sectorId is None:
+            sectorId = self._nextSectorId
+        if sectorId >= self._nextSectorId:
+            # the first id past sectorId on this cluster's own sequence:
+            # recovered ids may come from a server with another stride
+            steps = (sectorId - self._nextSectorId) // self._sectorIdStride + 1
+            self._nextSectorId += steps * self._sectorIdStride
+        newSector = OrbitalsSector(wordCount=16,
+                                   turnTimeout=30,
+                                   name=f"SECTOR-{sectorId}",
+                                   symbol=str(sectorId),
+                                   timerWheel=self._timerWheel,
+                                   journal=self._journal,
+                                   topics=self._topics,
+                                   directory=self._directory)
+        self._sectorDict[newSector.getName()] = newSector
+        self.updateSector(newSector)
+        return newSector
+
+    def updateSector(self, sector):
+        """
+        tracks a sector's occupancy after it changes:
+        - opens a new sector if every other one is full
+        - hibernates the sector if it is empty and arms its reclaim deadline
+        """
+        if sector.isOpen():
+            self._openSectors.add(sector)
+        else:
+            self._openSectors.discard(sector)
+            if not self._openSectors:
+                self.newSector()
+
+        reclaimKey = (sector, 'reclaim')
+        if sector.isEmpty():
+            sector.hibernate()
+            if len(self._sectorDict) > self._minSectors:
+                self._timerWheel.schedule(reclaimKey,
+                                          self._timerWheel.now() + self._idleGrace,
+                                          functools.partial(self.reclaimSector, sector))
+        else:
+            self._timerWheel.cancel(reclaimKey)
+
+        if sector.isDirty():
+            self._dirtySectors.add(sector)
+            self.scheduleClusterStatus()
+
+    def restoreSectors(self, states):
+        """
+        recreates the sectors recovered from the journal, in id order,
+        and holds their players' seats for the idle grace period
+        New sectors are numbered past the highest id recovered
+        Returns the names of the sectors restored
+        """
+        restored = set()
+        sectorIds = sorted(int(name.rsplit('-', 1)[1]) for name in states)
+        for sectorId in sectorIds:
+            name = f"SECTOR-{sectorId}"
+            sector = self._sectorDict.get(name)
+            if sector is None:
+                sector = self.newSector(sectorId)
+            elif not sector.isEmpty():
+                log.warning("Sector is in use, dropping its recovered game",
+                            extra={'sector': name})
+                continue
+            sector.restore(states[name])
+            self.updateSector(sector)
+            self._timerWheel.schedule((sector, 'seats'),
+                                      self._timerWheel.now() + self._idleGrace,
+                                      functools.partial(self.releaseSeats, sector))
+            log.info("Recovered sector, holding %d seats", len(states[name]['players']),
+                     extra={'sector': name})
+            restored.add(name)
+        return restored
+
+    def waitForJournal(self, journal, loop):
+        """ runs in a thread: waits for the server holding the journal to exit """
+        journal.lock(blocking=True)
+        loop.call_soon_threadsafe(self.adoptJournal, journal)
+
+    def adoptJournal(self, journal):
+        """
+        takes over the journal of the server this one replaced:
+        its games come back in the sectors nobody has used here yet,
+        every other sector in play is recorded afresh
+        """
+        self._journal = journal
+        for sector in self._sectorDict.values():
+            sector.setJournal(journal)
+        restored = self.restoreSectors(journal.recover())
+        for sector in list(self._sectorDict.values()):
+            if sector.getName() not in restored and not sector.isHibernating():
+                sector.rejournal()
+        journal.start()
+        log.info("Adopted the journal, %d games recovered", len(restored))
+
+    async def releaseSeats(self, sector):
+        """ frees the seats of recovered players who did not come back in time """
+        sector.releaseSeats()
+        self.updateSector(sector)
+
+    async def reclaimSector(self, sector):
+        """ drops a sector that stayed empty for the whole idle grace period """
+        if not sector.isEmpty() or len(self._sectorDict) <= self._minSectors:
+            return
+        if self._openSectors == {sector}:
+            # keep the last open sector around for another grace period
+            self.updateSector(sector)
+            return
+        self._openSectors.discard(sector)
+        self._dirtySectors.discard(sector)
+        del self._sectorDict[sector.getName()]
+        self._removedSectors.append(sector.getName())
+        log.info("Reclaimed idle sector", extra={'sector': sector.getName()})
+        _sectorsReclaimed.inc()
+        self.scheduleClusterStatus()
+
+    def addStatusListener(self, listener):
+        """
+        listener(changedSectors, removedSectors) is called with every lobby
+        update: the details of the sectors that changed and the names of
+        the sectors that were reclaimed
+        """
+        self._statusListeners.append(listener)
+
+    def getConnectionCount(self):
+        return len(self._directory)
+
+    def getPlayingSectors(self):
+        """ Returns the names of the sectors with a game in progress """
+        return [name for name, sector in self._sectorDict.items() if sector.isPlaying()]
+
+    def getTimerWheel(self):
+        """ Returns the timer wheel driving every sector's turn timeouts """
+        return self._timerWheel
+
+    def collectMetrics(self):
+        """ Returns the cluster's gauges, read when the metrics are served """
+        lobbyUsers = self._directory.lobbyCount()
+        occupied = sum(1 for sector in self._sectorDict.values() if not sector.isEmpty())
+        return [('orbitals_connections', 'Open websocket connections',
+                 len(self._directory)),
+                ('orbitals_lobby_connections', 'Connections not in any sector',
+                 lobbyUsers),
+                ('orbitals_sectors', 'Sectors in the pool', len(self._sectorDict)),
+                ('orbitals_occupied_sectors', 'Sectors with at least one player',
+                 occupied),
+                ('orbitals_timer_deadlines', 'Live deadlines in the timer wheel',
+                 len(self._timerWheel))]
+
     def printSectors(self):
-        for sector in self._sectors:
+        for sector in self._sectorDict.values():
             print(f"{sector.getSectorDetails()}")
 
     def getClusterStatus(self):
-        # returns a dict with all the quadrants and their players
+        # returns a dict with all the quadrants and their players, oldest first
         clusterStatus = []
-        for s in self._sectors:
+        for s in self._sectorDict.values():
             clusterStatus.append(s.getSectorDetails())
         return clusterStatus
 
@@ -49,117 +270,325 @@ class OrbitalsCluster:
 
     async def newConnection(self, websocket):
         """ register player """
-        print("New user connected")
+        log.debug("New user connected")
+        _connectionsOpened.inc()
 
-        self._userSectors[websocket] = None
-        packet = {}
-        packet['type'] = 'welcome'
-        packet['prompt'] = 'Enter your name'
-        msg = json.dumps(packet)
-        await websocket.send(msg)
+        self._directory.connect(websocket)
+        orbComms.send(websocket, orbComms.welcomeMsg)
 
     async def deleteConnection(self, websocket):
+        """
+        connection has dropped: players in a sector with a session keep
+        their place until the resume grace period runs out, everyone
+        else is removed straight away
+        """
+        if websocket not in self._directory:
+            # the session was resumed on another connection
+            return
+        sector = self._directory.getSector(websocket)
+        session = orbComms.getSession(websocket)
+        if session and sector and not self._draining:
+            session.detach()
+            _sessionsHeld.inc()
+            self._timerWheel.schedule((session, 'resume'),
+                                      self._timerWheel.now() + self._resumeGrace,
+                                      functools.partial(self.expireSession, session))
+            log.info("Connection dropped, holding the player's place for %d seconds",
+                     self._resumeGrace,
+                     extra={'sector': sector.getName()})
+            return
+        await self.removeConnection(websocket)
+
+    async def expireSession(self, session):
+        """ removes a player who did not resume in time """
+        if not session.isAttached():
+            with orbComms.batched():
+                await self.removeConnection(session.getWebSocket())
+
+    async def releaseSession(self, session):
+        """ removes a held player straight away, without waiting for the grace period """
+        self._timerWheel.cancel((session, 'resume'))
+        await self.removeConnection(session.getWebSocket())
+
+    def heldSession(self, websocket):
+        """ Returns the session of a dropped connection held for a resume, None otherwise """
+        session = orbComms.getSession(websocket)
+        if session and not session.isAttached():
+            return session
+        return None
+
+    async def removeConnection(self, websocket):
         """player has left:
         1. find out which orbital they belonged to
         2. send the signal to the relevant orbital
         """
-        sector = self._userSectors[websocket]
+        session = orbComms.getSession(websocket)
+        if session:
+            self._sessions.pop(session.getToken(), None)
+        sector = self._directory.getSector(websocket)
         if sector:
-            print(f"User is leaving sector {sector.getSectorDetails()['name']}.")
+            log.info("User is leaving the sector", extra={'sector': sector.getName()})
             await sector.deleteConnection(websocket)
-            
+            self.updateSector(sector)
         else:
-            print("User did not belong to any sector.")
+            log.debug("User did not belong to any sector")
 
-        self._userSectors.pop(websocket, None)
-        self._userNames.pop(websocket, None)
-        await self.publishClusterStatus()
-        # pprint(f"User sectors: {self._userSectors}")
+        self._directory.disconnect(websocket)
+        self._topics.unsubscribeAll(websocket)
+        orbComms.forget(websocket)
+
+    async def relayFrame(self, websocket, frame):
+        """
+        Returns True if the frame was passed on undecoded, to the worker
+        process owning the sender's sector: sectors here decode their own
+        """
+        return False
 
     async def newMessage(self, websocket, data):
         """
         parse new message:
-        1. if message asks to join a sector, handle in this class
-        2. otherwise, find the sector the player belongs to and route accordingly
+        1. if the user is in the lobby, handle it in this class
+        2. otherwise, leaving is handled in this class and everything else
+           is routed to the sector the player belongs to
         """
-        playerSector = self._userSectors[websocket]
-        if playerSector is None:
+        sector = self._directory.getSector(websocket)
+        if sector is None:
             # player doesn't belong to a sector
-            if data['type'] == 'join-sector':
-                # get player to join the sector
-                requestedSector = data['sector']
-                sector = self._sectorDict[requestedSector]
-                if sector:
-                    await sector.newPlayer(self._userNames[websocket], websocket)
-                    self._userSectors[websocket] = sector
-                    print(f"Player has joined sector {requestedSector}")
-                else:
-                    print(f"{requestedSector} does not exist")
-            elif data['type'] == 'name-request':
-                name = data['name']
-                if not name:
-                    # name is blank
-                    response = 'Name is blank'
-                    packet = {'type': 'response',
-                              'msg': "name-not-accepted",
-                              'reason': response}
-                    msg = json.dumps(packet)
-                    await websocket.send(msg)
-                elif name in self._userNames.values():
-                    # name is taken
-                    response = 'Name exists'
-                    packet = {'type': 'response',
-                              'msg': "name-not-accepted",
-                              'reason': response}
-                    msg = json.dumps(packet)
-                    await websocket.send(msg)
+            if not await self.lobbyMessages.dispatch(self, websocket, data):
+                if sectorMessages.handlesType(data['type']):
+                    reason = 'choose a sector first'
                 else:
-                    # name is OK
-                    self._userNames[websocket] = name
-                    packet = {'type': 'response', 'msg': "name-accepted", 'name': name}
-                    packet['prompt'] = "Choose a sector"
-                    sectors = sorted(list(self.getClusterStatus()), key=lambda k:k['symbol'])
-                    packet['sectors'] = sectors
-                    msg = json.dumps(packet)
-                    await websocket.send(msg)
-                    
+                    reason = 'unknown message type'
+                rejectMessage(websocket, data['type'], reason)
+        elif not await self.memberMessages.dispatch(self, websocket, data):
+            # message gets a pass-through
+            await sector.newMessage(websocket, data)
+
+            if data['type'] == 'team-request' or data['type'] == 'hub-request':
+                self.updateSector(sector)
+
+    @lobbyMessages.handles('options', ('batch', flag, False), ('diffs', flag, False),
+                           ('clock', flag, False))
+    @memberMessages.handles('options', ('batch', flag, False), ('diffs', flag, False),
+                            ('clock', flag, False))
+    async def setOptions(self, websocket, batch, diffs, clock):
+        """ client capabilities, valid anywhere """
+        orbComms.setBatching(websocket, batch)
+        orbComms.setDiffing(websocket, diffs)
+        orbComms.setClock(websocket, clock)
+
+    @lobbyMessages.handles('name-request', ('name', text))
+    async def nameRequest(self, websocket, name):
+        """ gives the user a name, if it is not blank and not taken """
+        if not name:
+            # name is blank
+            response = 'Name is blank'
+            packet = {'type': 'response',
+                      'msg': "name-not-accepted",
+                      'reason': response}
+            orbComms.send(websocket, packet)
+        elif self._directory.nameTaken(name) and not await self.takeOverName(name):
+            # name is taken
+            response = 'Name exists'
+            packet = {'type': 'response',
+                      'msg': "name-not-accepted",
+                      'reason': response}
+            orbComms.send(websocket, packet)
         else:
-            # player already belongs to a sector
-            if data['type'] == 'leave-sector':
-                # only capture one type of message: user leaving the sector
-                print(f"User is leaving sector {playerSector.getSectorDetails()['name']}.")
-                
-                # notify the sector
-                await playerSector.deleteConnection(websocket)
-
-                # send message to user to notify they are sector-less
-                sectors = sorted(list(self.getClusterStatus()), key=lambda k:k['symbol'])
-                packet = {}
-                packet['type'] = 'response'
-                packet['msg'] = 'left-sector'
-                packet['sectors'] = sectors
-                packet['prompt'] = "Choose a sector"
-                msg = json.dumps(packet)
-                await websocket.send(msg)
-
-                # remove user from dictionary and publish cluster status
-                self._userSectors[websocket] = None
-                await self.publishClusterStatus()
-        
-            else:
-                # message gets a pass-through
-                sector = self._userSectors[websocket]
-                await sector.newMessage(websocket,data)
+            # name is OK
+            self._directory.claimName(websocket, name)
+            self._topics.subscribe(websocket, lobbyTopic)
+            packet = {'type': 'response', 'msg': "name-accepted", 'name': name}
+            if self._resumeGrace:
+                session = orbComms.getSession(websocket)
+                if session is None:
+                    session = OrbitalsSession(websocket)
+                    self._sessions[session.getToken()] = session
+                    orbComms.setSession(websocket, session)
+                packet['token'] = session.getToken()
+            packet['prompt'] = "Choose a sector"
+            sectors = self.getClusterStatus()
+            packet['sectors'] = sectors
+            packet['version'] = self._statusVersion
+            orbComms.send(websocket, packet)
 
-                if data['type'] == 'team-request' or data['type'] == 'hub-request':
-                    await self.publishClusterStatus()
+    async def takeOverName(self, name):
+        """
+        frees a name held by a dropped connection: a client that joins
+        again instead of resuming gets its name back, not its place
+        Returns False if a live connection holds the name
+        """
+        session = self.heldSession(self._directory.getConnection(name))
+        if session is None:
+            return False
+        log.info("Held session released, its name was requested again")
+        await self.releaseSession(session)
+        return True
+
+    @lobbyMessages.handles('resume', ('token', text), ('sequence', integer))
+    async def resumeSession(self, websocket, token, sequence):
+        """
+        moves a session over to the new connection it is resumed from and
+        replays the frames sent after frame number sequence
+        """
+        session = self._sessions.get(token)
+        oldWebsocket = session and session.getWebSocket()
+        missed = None
+        if self._directory.isNamed(websocket):
+            reason = 'already named'
+        elif session is None:
+            reason = 'unknown or expired session'
+        elif orbComms.getCodec(oldWebsocket) is not orbComms.getCodec(websocket):
+            reason = 'encoding changed'
+        else:
+            # frames still queued for the old connection are numbered
+            # now, so they are replayed instead of written to it
+            orbComms.settle(oldWebsocket)
+            missed = session.missedSince(sequence)
+            reason = None if missed is not None else 'missed frames no longer kept'
+        if reason:
+            _resumeRequests.inc('failed')
+            packet = {'type': 'response', 'msg': 'resume-failed', 'reason': reason}
+            orbComms.send(websocket, packet)
+            if session and not session.isAttached():
+                # the client joins again as usual: its held place is let go
+                await self.releaseSession(session)
+            return
+
+        self._timerWheel.cancel((session, 'resume'))
+        sector = self._directory.getSector(oldWebsocket)
+        self._directory.replace(oldWebsocket, websocket)
+        self._topics.replace(oldWebsocket, websocket)
+        if sector:
+            sector.replaceConnection(oldWebsocket, websocket)
+        orbComms.setBatching(websocket, orbComms.isBatching(oldWebsocket))
+        orbComms.setDiffing(websocket, orbComms.isDiffing(oldWebsocket))
+        orbComms.setClock(websocket, orbComms.isClock(oldWebsocket))
+        orbComms.forget(oldWebsocket)
+        session.attach(websocket)
+        orbComms.setSession(websocket, session)
+        if oldWebsocket.open:
+            # resumed before the old connection was seen to drop
+            asyncio.ensure_future(oldWebsocket.close(1000, 'session resumed'))
+
+        orbComms.replay(websocket, missed)
+        packet = {'type': 'response', 'msg': 'resumed', 'missed': len(missed)}
+        orbComms.send(websocket, packet)
+        _resumeRequests.inc('resumed')
+        _framesReplayed.add(len(missed))
+        log.info("Session resumed, %d frames replayed", len(missed),
+                 extra={'sector': sector.getName() if sector else '-'})
+
+    @lobbyMessages.handles('join-sector', ('sector', text))
+    async def joinSector(self, websocket, requestedSector):
+        """ get player to join the sector """
+        if not self._directory.isNamed(websocket):
+            raise OrbitalsRejection('choose a name first')
+        if self._draining:
+            raise OrbitalsRejection('server is restarting')
+        sector = self._sectorDict.get(requestedSector)
+        if sector is None:
+            # a sector the client saw may have been reclaimed since
+            raise OrbitalsRejection('no such sector')
+        self._topics.unsubscribe(websocket, lobbyTopic)
+        await sector.newPlayer(self._directory.getName(websocket), websocket)
+        self._directory.setSector(websocket, sector)
+        self.updateSector(sector)
+        log.info("Player has joined the sector", extra={'sector': requestedSector})
+
+    @memberMessages.handles('leave-sector')
+    async def leaveSector(self, websocket):
+        """ takes the user out of their sector and back to the lobby """
+        playerSector = self._directory.getSector(websocket)
+        log.info("User is leaving the sector", extra={'sector': playerSector.getName()})
+
+        # notify the sector
+        await playerSector.deleteConnection(websocket)
+        self._directory.setSector(websocket, None)
+        self._topics.subscribe(websocket, lobbyTopic)
+        self.updateSector(playerSector)
+
+        # send message to user to notify they are sector-less
+        sectors = self.getClusterStatus()
+        packet = {}
+        packet['type'] = 'response'
+        packet['msg'] = 'left-sector'
+        packet['sectors'] = sectors
+        packet['version'] = self._statusVersion
+        packet['prompt'] = "Choose a sector"
+        orbComms.send(websocket, packet)
+
+    def scheduleClusterStatus(self):
+        """ publishes the pending lobby changes once the status window closes """
+        if not self._timerWheel.pending('cluster-status'):
+            self._timerWheel.schedule('cluster-status',
+                                      self._timerWheel.now() + self._statusWindow,
+                                      self.publishClusterStatus)
 
     async def publishClusterStatus(self):
-        # publish update to all users with names and no sectors:
-        sectors = sorted(list(self.getClusterStatus()), key=lambda k:k['symbol'])
-        packet = {'type': 'sectors',
-                  'sectors': sectors}
-        msg = json.dumps(packet)
-        for user in self._userSectors.keys():
-            if self._userNames.get(user) and not self._userSectors[user]:
-                await user.send(msg)
\ No newline at end of file
+        """
+        publish the sectors that changed since the last update
+        to all users with names and no sectors
+        """
+        if not self._dirtySectors and not self._removedSectors:
+            return
+        self._statusVersion += 1
+        _lobbyUpdates.inc()
+        sectors = []
+        for sector in self._dirtySectors:
+            sectors.append(sector.getSectorDetails())
+            sector.clearDirty()
+        removed = self._removedSectors
+        self._dirtySectors = set()
+        self._removedSectors = []
+        for listener in self._statusListeners:
+            listener(sectors, removed)
+        packet = {'type': 'sectors-update',
+                  'version': self._statusVersion,
+                  'sectors': sectors,
+                  'removed': removed}
+        orbComms.broadcast(packet, self._topics.getSubscribers(lobbyTopic))
+
+    async def drain(self, timeout, reconnectSpread=10, hint=True):
+        """
+        winds the cluster down before the server exits:
+        - lobby users and players with no game in progress are told to
+          reconnect straight away
+        - players in a game are told once it ends, or when timeout runs out
+        - the journal is closed before the last hints go out, so a
+          replacement server recovers the games still in progress
+        Without hint, nobody is told: the shard router tells the players
+        of a worker's sectors
+        """
+        self._draining = True
+        deadline = time.monotonic() + timeout
+        hinted = set()
+        log.info("Draining %d connections", len(self._directory))
+        while True:
+            for websocket, sector in list(self._directory.items()):
+                if websocket not in hinted and (sector is None or not sector.isPlaying()):
+                    if hint:
+                        self.sendReconnect(websocket, reconnectSpread)
+                    hinted.add(websocket)
+            playing = [websocket for websocket, _ in self._directory.items()
+                       if websocket not in hinted]
+            if not playing or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(1)
+
+        if self._journal:
+            self._journal.close()
+        if playing:
+            log.info("Drain timed out, %d players still in a game", len(playing))
+        for websocket in playing if hint else ():
+            self.sendReconnect(websocket, reconnectSpread)
+        await orbComms.flush()
+
+    def sendReconnect(self, websocket, reconnectSpread):
+        """
+        tells a client to reconnect, to the server replacing this one:
+        delays are spread out so clients do not all come back at once
+        """
+        packet = {'type': 'reconnect',
+                  'delay': round(1 + random.uniform(0, reconnectSpread), 1)}
+        orbComms.send(websocket, packet)
@@ -0,0 +1,198 @@
+"""
+or_codec.py
+Orbitals wire encodings
+Clients pick an encoding through the WebSocket subprotocol:
+- no subprotocol, or 'orbitals.json': JSON text frames, as always
+- 'orbitals.msgpack': binary frames, if msgpack is installed
+Binary frames start with a kind byte:
+- 0: a MessagePack packet
+- 1: a MessagePack packet, raw-deflated
+- 2: a batch, a MessagePack array of binary frames
+In binary packets, message types, game states and teams are sent as
+the short integer codes below. Each packet type has its own deflate
+setting: boards and lists are deflated, ticks and short replies are not.
+"""
+import json
+import zlib
+from or_game import stateLabels, teamLabels
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+jsonSubprotocol = 'orbitals.json'
+msgpackSubprotocol = 'orbitals.msgpack'
+
+# integer codes: append only, clients depend on them
+packetTypes = ['welcome', 'response', 'state', 'players', 'time', 'words',
+               'keys', 'guess', 'msg', 'replay-ack', 'sectors-update', 'batch',
+               'options', 'name-request', 'join-sector', 'leave-sector',
+               'team-request', 'hub-request', 'ready', 'message', 'hint',
+               'hint-response', 'replay', 'reconnect', 'resume', 'sync',
+               'board-diff', 'state-diff', 'clock']
+# game states and teams are coded as their or_game codes,
+# '-' being the team of a word nobody opened yet
+gameStates = list(stateLabels)
+teams = list(teamLabels) + ['-']
+
+# packet fields holding one of the coded values
+_fieldValues = {'type': packetTypes,
+                'state': gameStates,
+                'team': teams,
+                'turn': teams,
+                'winner': teams,
+                'wordTeam': teams,
+                'guesserTeam': teams}
+_encodeFields = {field: {value: code for code, value in enumerate(values)}
+                 for field, values in _fieldValues.items()}
+_decodeFields = {field: dict(enumerate(values))
+                 for field, values in _fieldValues.items()}
+
+# per packet type deflate setting, packet types not listed are sent as they are
+deflatePackets = {'words': True,
+                  'keys': True,
+                  'players': True,
+                  'sectors-update': True}
+
+_rawKind = b'\x00'
+_deflatedKind = b'\x01'
+_batchKind = b'\x02'
+
+# what the type of each packet type looks like inside an encoded frame
+_jsonTypes = {msgType: json.dumps(msgType) for msgType in packetTypes}
+_msgpackTypes = {msgType: msgpack.packb('type') + msgpack.packb(code)
+                 for code, msgType in enumerate(packetTypes)} if msgpack else {}
+
+
+def _translate(value, fields):
+    """ swaps the values of coded fields, at any depth """
+    if isinstance(value, dict):
+        translated = {}
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                translated[key] = _translate(item, fields)
+            elif key in fields:
+                translated[key] = fields[key].get(item, item)
+            else:
+                translated[key] = item
+        return translated
+    if isinstance(value, list):
+        return [_translate(item, fields) for item in value]
+    return value
+
+
+class OrbitalsJsonCodec:
+    """ JSON text frames, the default encoding """
+    subprotocol = jsonSubprotocol
+
+    def encode(self, packet):
+        """ Returns the frame for a packet """
+        return json.dumps(packet)
+
+    def encodeTemplate(self, packet, placeholder):
+        """
+        Returns the frame for a packet split around the placeholder value,
+        so the value can be filled in per player without encoding it again
+        """
+        return tuple(json.dumps(packet).split(json.dumps(placeholder), 1))
+
+    def fillTemplate(self, parts, value):
+        """ Returns the frame for a template filled with value """
+        return parts[0] + json.dumps(value) + parts[1]
+
+    def batch(self, frames):
+        """ joins encoded frames into a single batch frame, without re-encoding them """
+        return '{"type": "batch", "packets": [' + ', '.join(frames) + ']}'
+
+    def mayHoldType(self, frame, msgTypes):
+        """
+        Returns False if the frame cannot be a packet of one of msgTypes,
+        without decoding it: True means only decoding it can tell
+        """
+        if not isinstance(frame, str):
+            return True
+        return any(_jsonTypes[msgType] in frame for msgType in msgTypes)
+
+    def decode(self, frame):
+        """ Returns the packet in a frame, raises ValueError if there is none """
+        return json.loads(frame)
+
+
+class OrbitalsMsgpackCodec:
+    """ compact binary frames """
+    subprotocol = msgpackSubprotocol
+
+    def encode(self, packet):
+        """ Returns the frame for a packet, deflated if its type is set to """
+        body = msgpack.packb(_translate(packet, _encodeFields))
+        if deflatePackets.get(packet.get('type')):
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            return _deflatedKind + compressor.compress(body) + compressor.flush()
+        return _rawKind + body
+
+    def encodeTemplate(self, packet, placeholder):
+        """
+        Returns the frame for a packet split around the placeholder value,
+        so the value can be filled in per player without encoding it again
+        Templates are never deflated.
+        """
+        body = msgpack.packb(_translate(packet, _encodeFields))
+        prefix, suffix = body.split(msgpack.packb(placeholder), 1)
+        return (_rawKind + prefix, suffix)
+
+    def fillTemplate(self, parts, value):
+        """ Returns the frame for a template filled with value """
+        return parts[0] + msgpack.packb(value) + parts[1]
+
+    def batch(self, frames):
+        """ wraps encoded frames into a single batch frame """
+        return _batchKind + msgpack.packb(frames)
+
+    def mayHoldType(self, frame, msgTypes):
+        """
+        Returns False if the frame cannot be a packet of one of msgTypes,
+        without decoding it: True means only decoding it can tell
+        Deflated and batch frames always need decoding.
+        """
+        if not isinstance(frame, bytes) or frame[:1] != _rawKind:
+            return True
+        return any(_msgpackTypes[msgType] in frame for msgType in msgTypes)
+
+    def decode(self, frame):
+        """
+        Returns the packet in a frame, raises ValueError if there is none
+        batch frames are returned as a 'batch' packet, like JSON ones
+        """
+        if not isinstance(frame, bytes):
+            raise ValueError('expected a binary frame')
+        kind = frame[:1]
+        try:
+            if kind == _batchKind:
+                return {'type': 'batch',
+                        'packets': [self.decode(part)
+                                    for part in msgpack.unpackb(frame[1:])]}
+            body = frame[1:]
+            if kind == _deflatedKind:
+                body = zlib.decompress(body, -15)
+            return _translate(msgpack.unpackb(body), _decodeFields)
+        except (msgpack.UnpackException, zlib.error, TypeError) as error:
+            raise ValueError(str(error)) from error
+
+
+jsonCodec = OrbitalsJsonCodec()
+msgpackCodec = OrbitalsMsgpackCodec() if msgpack else None
+
+
+def getSubprotocols():
+    """ Returns the subprotocols the server accepts, preferred first """
+    if msgpackCodec:
+        return [msgpackSubprotocol, jsonSubprotocol]
+    return [jsonSubprotocol]
+
+
+def forSubprotocol(subprotocol):
+    """ Returns the codec for a negotiated subprotocol, JSON if there was none """
+    if subprotocol == msgpackSubprotocol and msgpackCodec:
+        return msgpackCodec
+    return jsonCodec
@@ -1,12 +1,687 @@
 """
 or_comms.py
 Utility functions for Orbitals communications
+Clients that opt in to batching get every packet produced while one
+inbound event is handled in a single 'batch' frame:
+    {"type": "batch", "packets": [packet, packet, ...]}
+Everyone else keeps receiving one frame per packet.
+Packets are encoded with the codec each websocket negotiated, once per
+codec however many websockets they are sent to.
+Frames sent to a websocket with a session are recorded in it; while the
+session is held after a drop they are only recorded, for its replay.
+Boards and game states carry versions. Clients that opt in to diffs get
+state changes as 'state-diff' packets against the last state sent to
+them instead of whole state packets.
+Clients that opt in to the clock get a turn's deadline once, when the
+timer starts or stops, and no per-second time packets.
+Frames wait in a bounded outbox per websocket until they are written:
+packets superseded by a newer one of their type are dropped, chat goes
+out after game packets, and a client that stays too far behind is
+disconnected.
 """
 import asyncio
-import json
+import collections
+import contextlib
+import contextvars
+import itertools
+import time
+import or_codec
+import or_log
+import or_metrics
+from or_game import GameState, Team, stateLabels, teamLabels
 
+log = or_log.getLogger('comms')
 
-async def publishState(gameInfo, players):
+# fan-out bookkeeping: in-flight broadcasts and their latency
+_pendingFanOuts = set()
+_fanOutStats = {'broadcasts': 0,
+                'frames': 0,
+                'last': 0.0,
+                'max': 0.0,
+                'total': 0.0}
+
+
+_fanOutSeconds = or_metrics.histogram(
+    'orbitals_fanout_seconds', 'Time from scheduling a fan-out to its last frame being written')
+_framesSent = or_metrics.counter('orbitals_frames_sent_total', 'Frames written to websockets')
+_batchesSent = or_metrics.counter('orbitals_batch_frames_total',
+                                  'Batch frames written, each merging several packets')
+_framesCoalesced = or_metrics.counter('orbitals_frames_coalesced_total',
+                                      'Queued frames replaced by a newer packet of their type')
+_slowClosed = or_metrics.counter('orbitals_slow_connections_closed_total',
+                                 'Connections closed for staying over their send budget')
+
+# batching: opted-in websockets and the batch of the event being handled
+_batchingSockets = set()
+_currentBatch = contextvars.ContextVar('currentBatch', default=None)
+
+# websockets that take state diffs
+_diffingSockets = set()
+
+# websockets that count turns down from a deadline themselves
+_clockSockets = set()
+
+# codec of every websocket that did not settle for JSON
+_codecs = dict()
+
+# session of every websocket that has one
+_sessions = dict()
+
+# outbox of every websocket with frames waiting to be written
+_outboxes = dict()
+
+# packet types whose latest value replaces any older one still queued,
+# and types sent only once no game packet is waiting
+coalescedTypes = frozenset(('time', 'clock', 'state', 'players', 'sectors-update'))
+chatTypes = frozenset(('msg',))
+
+# frames a websocket may have queued, and the seconds it may stay over
+# that before it is disconnected: at twice the budget it is straight away
+_sendBudget = 256
+_sendGrace = 5.0
+
+# keys of the queued frames that are not coalesced
+_frameKeys = itertools.count()
+
+
+class OrbitalsPacket:
+    """ A packet to send, encoded once per codec on first use """
+    def __init__(self, packet):
+        self._packet = packet
+        self._frames = dict()
+
+    def getFrame(self, codec):
+        """ Returns the packet encoded with codec """
+        frame = self._frames.get(codec)
+        if frame is None:
+            frame = codec.encode(self._packet)
+            self._frames[codec] = frame
+        return frame
+
+    def getPacket(self):
+        return self._packet
+
+    def getType(self):
+        return self._packet['type']
+
+
+def setCodec(websocket, codec):
+    """ sets the codec used for everything sent to and read from a websocket """
+    if codec is or_codec.jsonCodec:
+        _codecs.pop(websocket, None)
+    else:
+        _codecs[websocket] = codec
+
+
+def getCodec(websocket):
+    """ Returns the codec of a websocket """
+    return _codecs.get(websocket, or_codec.jsonCodec)
+
+
+def setSession(websocket, session):
+    """ numbers and records every frame sent to the websocket in session """
+    _sessions[websocket] = session
+
+
+def getSession(websocket):
+    """ Returns the session of a websocket, None if it has none """
+    return _sessions.get(websocket)
+
+
+def setSendBudget(frames, grace=5.0):
+    """ sets the frames a websocket may have queued, and for how many seconds """
+    global _sendBudget, _sendGrace
+    _sendBudget = frames
+    _sendGrace = grace
+
+
+def forget(websocket):
+    """ drops the codec, options and session of a websocket that went away """
+    _codecs.pop(websocket, None)
+    _batchingSockets.discard(websocket)
+    _diffingSockets.discard(websocket)
+    _clockSockets.discard(websocket)
+    _sessions.pop(websocket, None)
+
+
+def packetType(msg):
+    """ Returns the type of a packet, None for an already encoded frame """
+    if isinstance(msg, OrbitalsPacket):
+        return msg.getType()
+    if isinstance(msg, dict):
+        return msg['type']
+    return None
+
+
+def encodeFrame(websocket, msg):
+    """
+    Returns the frame to send to a websocket:
+    packets are encoded with its codec, frames are sent as they are
+    """
+    if isinstance(msg, OrbitalsPacket):
+        return msg.getFrame(getCodec(websocket))
+    if isinstance(msg, dict):
+        return getCodec(websocket).encode(msg)
+    return msg
+
+
+class OrbitalsBatch:
+    """
+    Frames sent while one inbound event is handled, per websocket
+    Frames added after the batch is closed are sent straight away:
+    tasks started during the event may outlive it.
+    """
+    def __init__(self):
+        self._frames = dict()
+        self._open = True
+
+    def isOpen(self):
+        return self._open
+
+    def add(self, websocket, msg, kind=None):
+        self._frames.setdefault(websocket, []).append((msg, kind))
+
+    def close(self):
+        """
+        closes the batch and Returns its (websocket, msg, kind) frames:
+        one batch frame per opted-in websocket, single frames otherwise
+        """
+        self._open = False
+        frames = []
+        for websocket, msgs in self._frames.items():
+            if len(msgs) > 1:
+                msgs = _dropSuperseded(msgs)
+            if len(msgs) > 1 and websocket in _batchingSockets:
+                batchFrames = [encodeFrame(websocket, msg) for msg, _ in msgs]
+                frames.append((websocket, getCodec(websocket).batch(batchFrames), None))
+                _batchesSent.inc()
+            else:
+                frames.extend((websocket, msg, kind) for msg, kind in msgs)
+        self._frames.clear()
+        return frames
+
+
+def _dropSuperseded(msgs):
+    """
+    Returns the (msg, kind) pairs of one event without the packets a
+    later one of their coalesced type replaces: lobby updates are
+    deltas, they are left for the outbox to merge
+    """
+    latest = dict()
+    for index, (msg, kind) in enumerate(msgs):
+        kind = kind or packetType(msg)
+        if kind in coalescedTypes and kind != 'sectors-update':
+            latest[kind] = index
+    if not latest:
+        return msgs
+    return [(msg, kind) for index, (msg, kind) in enumerate(msgs)
+            if latest.get(kind or packetType(msg), index) == index]
+
+
+class OrbitalsFanOut:
+    """ Frames of one fan-out still to be written, for its latency """
+    __slots__ = ('_started', '_frames', '_remaining')
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._frames = 0
+        self._remaining = 0
+
+    def getFrames(self):
+        return self._frames
+
+    def add(self):
+        self._frames += 1
+        self._remaining += 1
+
+    def done(self):
+        """ one frame was written, or dropped for a newer one """
+        self._remaining -= 1
+        if not self._remaining:
+            _fanOutDone(self, self._started, self._frames)
+
+
+class OrbitalsOutbox:
+    """
+    Frames waiting to be written to one websocket, drained by a writer
+    task that ends once none are left:
+    - a packet of a coalesced type replaces the one of its type still
+      queued and takes its place at the back of the queue
+    - other game packets go out in the order they were queued
+    - chat goes out once no game packet is waiting
+    Frames are recorded in the websocket's session as they are written,
+    so a replaced one never takes a frame number.
+    """
+    __slots__ = ('_websocket', '_frames', '_latest', '_chat', '_queued', '_writer',
+                 '_closed', '_overSince')
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        # [msg, session, tracker] entries: msg is None once written or replaced
+        self._frames = collections.deque()
+        # the latest entry of every coalesced type, and chat: made when first needed
+        self._latest = None
+        self._chat = None
+        self._queued = 0
+        self._writer = None
+        self._closed = False
+        self._overSince = None
+
+    def __len__(self):
+        return self._queued
+
+    def start(self):
+        """ starts the writer task """
+        self._writer = asyncio.ensure_future(self.write())
+
+    def getWriter(self):
+        return self._writer
+
+    def add(self, msg, kind, session, tracker):
+        """ queues a frame, numbered in session once written """
+        entry = [msg, session, tracker]
+        if kind in chatTypes:
+            if self._chat is None:
+                self._chat = collections.deque()
+            self._chat.append(entry)
+        else:
+            if kind in coalescedTypes:
+                if self._latest is None:
+                    self._latest = dict()
+                older = self._latest.get(kind)
+                if older is not None and older[0] is not None:
+                    _framesCoalesced.inc()
+                    if kind == 'sectors-update':
+                        # lobby updates are deltas: the older one's sectors still count
+                        entry[0] = mergeSectorUpdates(older[0], msg)
+                    older[0] = None
+                    self._queued -= 1
+                    if older[2] is not None:
+                        older[2].done()
+                    if len(self._frames) > 2 * self._queued + 16:
+                        # a stalled writer: drop the replaced entries
+                        self._frames = collections.deque(
+                            queued for queued in self._frames if queued[0] is not None)
+                self._latest[kind] = entry
+            self._frames.append(entry)
+        self._queued += 1
+        if self._queued > _sendBudget:
+            self.checkBudget(self._queued)
+
+    def checkBudget(self, queued):
+        """ disconnects a websocket that stayed over its budget or went far over it """
+        now = time.monotonic()
+        if self._overSince is None:
+            self._overSince = now
+        if not self._closed and (queued > 2 * _sendBudget or now - self._overSince > _sendGrace):
+            self._closed = True
+            _slowClosed.inc()
+            log.warning("Closing a connection %d frames behind", queued)
+            asyncio.ensure_future(self._websocket.close(1008, 'too far behind'))
+
+    def next(self):
+        """ Returns the next (msg, session, tracker) to write, None once there are none """
+        frames = self._frames
+        while frames:
+            entry = frames.popleft()
+            if entry[0] is not None:
+                break
+        else:
+            if not self._chat:
+                return None
+            entry = self._chat.popleft()
+        msg = entry[0]
+        entry[0] = None
+        self._queued -= 1
+        if self._overSince is not None and self._queued <= _sendBudget:
+            self._overSince = None
+        return msg, entry[1], entry[2]
+
+    def settle(self):
+        """
+        records every frame still queued in its session without writing it,
+        for a connection being replaced: the replay to the new one carries them
+        """
+        self._closed = True
+        while True:
+            entry = self.next()
+            if entry is None:
+                break
+            msg, session, tracker = entry
+            if session is not None:
+                session.record(msg)
+            if tracker is not None:
+                tracker.done()
+
+    async def write(self):
+        """
+        writes the queued frames until there are none left:
+        once the connection is closed, frames are only recorded in the
+        session, for its replay
+        """
+        websocket = self._websocket
+        while True:
+            entry = self.next()
+            if entry is None:
+                break
+            msg, session, tracker = entry
+            if session is not None:
+                session.record(msg)
+            if not self._closed and (session is None or session.isAttached()):
+                try:
+                    await websocket.send(encodeFrame(websocket, msg))
+                except Exception:
+                    # whatever went wrong, the peer is not reading any more
+                    self._closed = True
+            if tracker is not None:
+                tracker.done()
+        if _outboxes.get(websocket) is self:
+            del _outboxes[websocket]
+
+
+def mergeSectorUpdates(older, newer):
+    """ Returns one sectors-update packet with the changes of both """
+    older = older.getPacket() if isinstance(older, OrbitalsPacket) else older
+    newer = newer.getPacket() if isinstance(newer, OrbitalsPacket) else newer
+    updated = {sector['name'] for sector in newer['sectors']}
+    removed = set(newer['removed'])
+    sectors = [sector for sector in older['sectors']
+               if sector['name'] not in updated and sector['name'] not in removed]
+    packet = {'type': 'sectors-update',
+              'version': newer['version'],
+              'sectors': sectors + newer['sectors'],
+              'removed': [name for name in older['removed'] if name not in updated]
+              + newer['removed']}
+    return OrbitalsPacket(packet)
+
+
+def setBatching(websocket, enabled):
+    """ opts a websocket in or out of batch frames """
+    if enabled:
+        _batchingSockets.add(websocket)
+    else:
+        _batchingSockets.discard(websocket)
+
+
+def isBatching(websocket):
+    """ Returns True if the websocket takes batch frames """
+    return websocket in _batchingSockets
+
+
+def setDiffing(websocket, enabled):
+    """ opts a websocket in or out of state diffs """
+    if enabled:
+        _diffingSockets.add(websocket)
+    else:
+        _diffingSockets.discard(websocket)
+
+
+def isDiffing(websocket):
+    """ Returns True if the websocket takes state diffs """
+    return websocket in _diffingSockets
+
+
+def setClock(websocket, enabled):
+    """ opts a websocket in or out of turn deadlines instead of time packets """
+    if enabled:
+        _clockSockets.add(websocket)
+    else:
+        _clockSockets.discard(websocket)
+
+
+def isClock(websocket):
+    """ Returns True if the websocket counts turns down itself """
+    return websocket in _clockSockets
+
+
+@contextlib.contextmanager
+def batched():
+    """
+    holds back every frame sent inside the block and sends them
+    once it exits, merged into one batch frame per opted-in websocket
+    Nested blocks join the outer batch.
+    """
+    batch = _currentBatch.get()
+    if batch is not None and batch.isOpen():
+        yield batch
+        return
+    batch = OrbitalsBatch()
+    token = _currentBatch.set(batch)
+    try:
+        yield batch
+    finally:
+        _currentBatch.reset(token)
+        _deliver(batch.close())
+
+
+def fanOut(frames, kind=None):
+    """
+    queues every (websocket, msg) pair in its websocket's outbox:
+    - no peer is awaited here, each outbox has a writer task of its own
+    - frames for the same websocket go out in the order given, except
+      that newer packets of a coalesced type replace older ones and
+      chat waits for game packets
+    - a failing peer never interrupts delivery to the others
+    - inside a batched() block, frames are held back until it exits
+    msg is a packet dict, an OrbitalsPacket or an already encoded frame,
+    kind the packet type of encoded frames that can be coalesced
+    """
+    batch = _currentBatch.get()
+    if batch is not None and batch.isOpen():
+        for websocket, msg in frames:
+            batch.add(websocket, msg, kind)
+        return
+    _deliver((websocket, msg, kind) for websocket, msg in frames)
+
+
+def _deliver(frames):
+    """ queues (websocket, msg, kind) frames, tracked as one fan-out """
+    tracker = OrbitalsFanOut()
+    for websocket, msg, kind in frames:
+        _queue(websocket, msg, kind or packetType(msg), _sessions.get(websocket), tracker)
+    if tracker.getFrames():
+        _pendingFanOuts.add(tracker)
+
+
+def _queue(websocket, msg, kind, session, tracker):
+    """ adds a frame to the websocket's outbox, starting its writer if idle """
+    outbox = _outboxes.get(websocket)
+    if outbox is None:
+        if session is not None and not session.isAttached():
+            # the connection dropped: kept for the session's replay
+            session.record(msg)
+            return
+        outbox = OrbitalsOutbox(websocket)
+        _outboxes[websocket] = outbox
+        outbox.start()
+    tracker.add()
+    outbox.add(msg, kind, session, tracker)
+
+
+def settle(websocket):
+    """
+    numbers the frames still queued for a websocket being replaced in
+    its session and stops writing to it, so a resume replays them
+    """
+    outbox = _outboxes.get(websocket)
+    if outbox is not None:
+        outbox.settle()
+
+
+def replay(websocket, msgs):
+    """
+    resends the frames a resumed session missed, ahead of anything sent
+    after them and without numbering them again
+    """
+    tracker = OrbitalsFanOut()
+    for msg in msgs:
+        _queue(websocket, msg, None, None, tracker)
+    if tracker.getFrames():
+        _pendingFanOuts.add(tracker)
+
+
+def _fanOutDone(tracker, started, frameCount):
+    """ records the latency of a completed fan-out """
+    _pendingFanOuts.discard(tracker)
+    latency = time.perf_counter() - started
+    _fanOutStats['broadcasts'] += 1
+    _fanOutStats['frames'] += frameCount
+    _fanOutStats['last'] = latency
+    _fanOutStats['total'] += latency
+    if latency > _fanOutStats['max']:
+        _fanOutStats['max'] = latency
+    _fanOutSeconds.observe(latency)
+    _framesSent.add(frameCount)
+
+
+def broadcast(msg, websockets):
+    """ sends a packet or an already encoded frame to every websocket """
+    if isinstance(msg, dict):
+        msg = OrbitalsPacket(msg)
+    fanOut([(websocket, msg) for websocket in websockets])
+
+
+def send(websocket, msg):
+    """ sends a packet or an already encoded frame to a single websocket """
+    fanOut([(websocket, msg)])
+
+
+def collectMetrics():
+    """ Returns the fan-out gauges, read when the metrics are served """
+    return [('orbitals_pending_fanouts', 'Fan-outs with frames still being written',
+             len(_pendingFanOuts)),
+            ('orbitals_batching_connections', 'Connections taking batch frames',
+             len(_batchingSockets)),
+            ('orbitals_queued_frames', 'Frames waiting in outboxes to be written',
+             sum(len(outbox) for outbox in _outboxes.values()))]
+
+
+or_metrics.addCollector(collectMetrics)
+
+
+def getFanOutStats():
+    """ Returns broadcast count, frame count and latency figures """
+    stats = dict(_fanOutStats)
+    stats['pending'] = len(_pendingFanOuts)
+    if stats['broadcasts']:
+        stats['mean'] = stats['total'] / stats['broadcasts']
+    else:
+        stats['mean'] = 0.0
+    return stats
+
+
+async def flush():
+    """ waits for every queued frame to be written """
+    while _outboxes:
+        await asyncio.gather(*(outbox.getWriter() for outbox in list(_outboxes.values())))
+
+
+# packets that never vary, encoded once at startup
+welcomeMsg = OrbitalsPacket({'type': 'welcome', 'prompt': 'Enter your name'})
+replayAckMsg = OrbitalsPacket({'type': 'replay-ack'})
+startAcceptedMsg = OrbitalsPacket({'type': 'response', 'msg': 'start-accepted'})
+
+_namePlaceholder = '\x00name\x00'
+
+
+class OrbitalsStateCache:
+    """
+    Pre-serialized state packets for one sector:
+    - keyed on the inputs a state packet depends on: team, hub flag,
+      ready flag and replay flag for the game info the cache was built on,
+      and the codec it is encoded with
+    - only the player name is spliced in per player
+    - rebuilt whenever the game info changes, which bumps the state version
+    The packets of the previous version are kept to diff against, along
+    with the version and inputs last sent to every diffing websocket.
+    """
+    def __init__(self):
+        self._gameInfoKey = None
+        self._version = 0
+        self._messages = dict()
+        self._packets = dict()
+        self._previousPackets = dict()
+        self._diffs = dict()
+        self._sent = dict()
+
+    def forget(self, websocket):
+        """ drops what was sent to a websocket that left the sector """
+        self._sent.pop(websocket, None)
+
+    def getVersion(self):
+        """ Returns the state version """
+        return self._version
+
+    def checkGameInfo(self, gameInfo):
+        """ starts a new state version if the game info has changed """
+        gameInfoKey = gameInfo.getKey()
+        if gameInfoKey != self._gameInfoKey:
+            self._version += 1
+            self._previousPackets = self._packets
+            self._packets = dict()
+            self._messages.clear()
+            self._diffs.clear()
+            self._gameInfoKey = gameInfoKey
+
+    def getPacket(self, gameInfo, key):
+        """ Returns the state packet for the team, hub, ready and replay in key """
+        packet = self._packets.get(key)
+        if packet is None:
+            packet = _statePacket(gameInfo, *key)
+            packet['version'] = self._version
+            self._packets[key] = packet
+        return packet
+
+    def getMessage(self, gameInfo, name, team, hub, ready, replay,
+                   codec=or_codec.jsonCodec):
+        """ Returns the encoded state packet for a player """
+        key = (codec, team, hub, ready, replay)
+        parts = self._messages.get(key)
+        if parts is None:
+            packet = self.getPacket(gameInfo, key[1:])
+            parts = codec.encodeTemplate(packet, _namePlaceholder)
+            self._messages[key] = parts
+        return codec.fillTemplate(parts, name)
+
+    def getUpdate(self, gameInfo, websocket, name, team, hub, ready, replay,
+                  codec=or_codec.jsonCodec):
+        """
+        Returns what brings a diffing player up to date: a state-diff from
+        the state last sent to them, the whole state packet if that one is
+        no longer kept, None if nothing changed for them
+        """
+        key = (team, hub, ready, replay)
+        sent = self._sent.get(websocket)
+        self._sent[websocket] = (self._version, key)
+        if sent == (self._version, key):
+            return None
+        if sent is None:
+            oldPackets = None
+        elif sent[0] == self._version:
+            oldPackets = self._packets
+        elif sent[0] == self._version - 1:
+            oldPackets = self._previousPackets
+        else:
+            oldPackets = None
+        old = oldPackets.get(sent[1]) if oldPackets is not None else None
+        if old is None:
+            return self.getMessage(gameInfo, name, team, hub, ready, replay, codec)
+
+        diffKey = (codec, sent, key)
+        frame = self._diffs.get(diffKey)
+        if frame is None:
+            new = self.getPacket(gameInfo, key)
+            # the name placeholder is the same in both: never part of a diff
+            changed = {field: value for field, value in new.items()
+                       if old.get(field) != value}
+            removed = [field for field in old if field not in new]
+            frame = codec.encode({'type': 'state-diff', 'from': sent[0],
+                                  'changed': changed, 'removed': removed})
+            self._diffs[diffKey] = frame
+        return frame
+
+
+async def publishState(gameInfo, players, cache=None):
     """
     publishes the game state and current turn to all players:
     - adds the hint and remaining guesses if state is 'waiting guess'
@@ -19,105 +694,134 @@ async def publishState(gameInfo, players):
         - team request
         - role request
         - start request
+    - players taking diffs only get what changed since their last state
+    """
+    if cache is None:
+        cache = OrbitalsStateCache()
+    cache.checkGameInfo(gameInfo)
+
+    # send a custom state array to all connected players: whole states
+    # supersede older ones still queued, diffs build on them
+    frames = []
+    diffs = []
+    for player in players:
+        websocket = player.getWebSocket()
+        if websocket in _diffingSockets:
+            msg = cache.getUpdate(gameInfo, websocket, player.getName(), player.getTeam(),
+                                  player.isHub(), player.isReady(),
+                                  player.wantsReplay(), getCodec(websocket))
+            if msg is None:
+                continue
+            diffs.append((websocket, msg))
+        else:
+            msg = cache.getMessage(gameInfo, player.getName(), player.getTeam(),
+                                   player.isHub(), player.isReady(),
+                                   player.wantsReplay(), getCodec(websocket))
+            frames.append((websocket, msg))
+    fanOut(frames, 'state')
+    if diffs:
+        fanOut(diffs)
+
+
+def _statePacket(gameInfo, team, hub, ready, replay):
+    """
+    builds the state packet seen by one role:
+    the player name is left as a placeholder for OrbitalsStateCache
     """
+    state = gameInfo.state
+    turn = gameInfo.turn
     packet = {}
-    state = gameInfo['state']
-    turn = gameInfo['turn']
     packet['type'] = 'state'
-    packet['state'] = state
+    packet['state'] = stateLabels[state]
     packet['showTurn'] = False
-    packet['turn'] = turn
+    packet['turn'] = teamLabels[turn]
     packet['entry'] = 'view-only'
-
-    # send a custom state array to all connected players
-    for player in players:
-        packet['name'] = player.getName()
-        packet['showHint'] = False
-        packet['updateComms'] = False
-        packet['enableGuesses'] = False
-        if state == 'waiting-players':
-            # If we are waiting for players:
-            # - everyone should have a name by now
-            # - asking for a team should be the default
-            # - if the player has a team and that team doesn't have a hub,
-            #   allow them to request the hub role
-            packet['entry'] = 'team-selection'
-            packet['prompt'] = 'Waiting for players'
-            if player.isHub():
+    packet['name'] = _namePlaceholder
+    packet['showHint'] = False
+    packet['updateComms'] = False
+    packet['enableGuesses'] = False
+    if state == GameState.WAITING_PLAYERS:
+        # If we are waiting for players:
+        # - everyone should have a name by now
+        # - asking for a team should be the default
+        # - if the player has a team and that team doesn't have a hub,
+        #   allow them to request the hub role
+        packet['entry'] = 'team-selection'
+        packet['prompt'] = 'Waiting for players'
+        if hub:
+            packet['entry'] = 'role-selection'
+            packet['hub'] = True
+        else:
+            packet['hub'] = False
+            # print(f"gameInfo: {gameInfo}")
+            if team == Team.B and not gameInfo.blueHub:
                 packet['entry'] = 'role-selection'
-                packet['hub'] = True
-            else:
-                packet['hub'] = False
-                # print(f"gameInfo: {gameInfo}")
-                if player.getTeam() == 'B' and not gameInfo['blue-hub']:
-                    packet['entry'] = 'role-selection'
-                if player.getTeam() == 'O' and not gameInfo['orange-hub']:
-                    packet['entry'] = 'role-selection'
-
-        elif state == 'waiting-start':
-            packet['entry'] = 'team-selection'
-            packet['prompt'] = 'Waiting for game start'
-            if player.isHub():
-                packet['entry'] = 'ready-area'
-                packet['ready'] = player.isReady()
-        elif state == 'game-start':
-            packet['prompt'] = 'Study the words'
-            packet['showTurn'] = True
-            if player.isHub():
-                packet['updateComms'] = True
-                packet['comms'] = ''
-        elif state == 'hint-submission':
-            packet['showTurn'] = True
-            packet['prompt'] = 'Waiting for hint'
-            if player.isHub():
-                packet['updateComms'] = True
-                packet['comms'] = ''
-                if player.getTeam() == turn:
-                    packet['prompt'] = 'Submit a hint'
-                    packet['comms'] = 'hint-submission'
-        elif state == 'hint-response':
-            packet['showTurn'] = True
-            packet['prompt'] = 'Waiting for hint response'
-            if player.isHub():
-                packet['updateComms'] = True
-                packet['comms'] = ''
-                if player.getTeam() != turn:
-                    packet['prompt'] = 'Respond to hint'
-                    packet['showHint'] = True
-                    packet['hint'] = gameInfo['hint']['hintWord']
-                    packet['guesses'] = gameInfo['guesses']
-                    packet['comms'] = 'hint-response'
-        elif state == 'guess-submission':
-            packet['showTurn'] = True
-            packet['prompt'] = 'Waiting for guesses'
-            packet['showHint'] = True
-            packet['hint'] = gameInfo['hint']['hintWord']
-            packet['guesses'] = gameInfo['guesses']
-            if player.getTeam() == turn and not player.isHub():
-                packet['prompt'] = 'Guess a related word'
-                packet['enableGuesses'] = True
-            if player.isHub():
+            if team == Team.O and not gameInfo.orangeHub:
+                packet['entry'] = 'role-selection'
+
+    elif state == GameState.WAITING_START:
+        packet['entry'] = 'team-selection'
+        packet['prompt'] = 'Waiting for game start'
+        if hub:
+            packet['entry'] = 'ready-area'
+            packet['ready'] = ready
+    elif state == GameState.GAME_START:
+        packet['prompt'] = 'Study the words'
+        packet['showTurn'] = True
+        if hub:
+            packet['updateComms'] = True
+            packet['comms'] = ''
+    elif state == GameState.HINT_SUBMISSION:
+        packet['showTurn'] = True
+        packet['prompt'] = 'Waiting for hint'
+        if hub:
+            packet['updateComms'] = True
+            packet['comms'] = ''
+            if team == turn:
+                packet['prompt'] = 'Submit a hint'
+                packet['comms'] = 'hint-submission'
+    elif state == GameState.HINT_RESPONSE:
+        packet['showTurn'] = True
+        packet['prompt'] = 'Waiting for hint response'
+        if hub:
+            packet['updateComms'] = True
+            packet['comms'] = ''
+            if team != turn:
+                packet['prompt'] = 'Respond to hint'
+                packet['showHint'] = True
+                packet['hint'] = gameInfo.hintWord
+                packet['guesses'] = gameInfo.guesses
+                packet['comms'] = 'hint-response'
+    elif state == GameState.GUESS_SUBMISSION:
+        packet['showTurn'] = True
+        packet['prompt'] = 'Waiting for guesses'
+        packet['showHint'] = True
+        packet['hint'] = gameInfo.hintWord
+        packet['guesses'] = gameInfo.guesses
+        if team == turn and not hub:
+            packet['prompt'] = 'Guess a related word'
+            packet['enableGuesses'] = True
+        if hub:
+            packet['updateComms'] = True
+            packet['comms'] = ''
+    elif state == GameState.GAME_OVER:
+        if gameInfo.winner == Team.O:
+            winner = 'Orange'
+        elif gameInfo.winner == Team.B:
+            winner = 'Blue'
+        packet['prompt'] = 'Team ' + winner + ' wins!'
+        if team == Team.B or team == Team.O:
+            if not replay:
                 packet['updateComms'] = True
-                packet['comms'] = ''
-        elif state == 'game-over':
-            if gameInfo['winner'] == 'O':
-                winner = 'Orange'
-            elif gameInfo['winner'] == 'B':
-                winner = 'Blue'
-            packet['prompt'] = 'Team ' + winner + ' wins!'
-            if player.getTeam() == 'B' or player.getTeam() == 'O':
-                if not player.wantsReplay():
-                    packet['updateComms'] = True
-                    packet['comms'] = 'replay'
-                else:
-                    packet['updateComms'] = True
-                    packet['comms'] = 'message'
+                packet['comms'] = 'replay'
             else:
-                packet['entry'] = 'team-selection'
+                packet['updateComms'] = True
+                packet['comms'] = 'message'
+        else:
+            packet['entry'] = 'team-selection'
+
+    return packet
 
-        # print(f"Packet: {packet}")
-        msg = json.dumps(packet)
-        await player.getWebSocket().send(msg)
 
 async def publishPlayers(playerData, enough, users):
     """
@@ -128,33 +832,71 @@ async def publishPlayers(playerData, enough, users):
     if users:
         packet = {'type': 'players', 'players': playerData,
                   'enough': enough}
-        msg = json.dumps(packet)
         # print(f"Sending message: {str(packet)}")
-        await asyncio.wait([user.send(msg) for user in users])
+        broadcast(packet, users)
 
 
-async def publishTime(seconds, players):
-    """ sends remaining time in turn to all players """
-    packet = {'type': 'time', 'time': seconds}
-    msg = json.dumps(packet)
-    for player in players:
-        await player.getWebSocket().send(msg)
+async def publishTime(seconds, websockets):
+    """ sends remaining time in turn to the players without the clock """
+    if _clockSockets:
+        websockets = [websocket for websocket in websockets
+                      if websocket not in _clockSockets]
+    if websockets:
+        packet = {'type': 'time', 'time': seconds}
+        broadcast(packet, websockets)
 
 
-async def publishWords(words, keywords, players):
-    """ publish all public words to all players """
-    # print(f"Words: {str(words)}")
-    # print(f"Key: {str(keywords)}")
-    packet = {'type': 'words', 'words': words}
-    keyPacket = {'type': 'keys', 'keywords': keywords}
-    msg = json.dumps(packet)
-    keyMsg = json.dumps(keyPacket)
-    for player in players:
-        await player.getWebSocket().send(msg)
-        if player.isHub():
-            await player.getWebSocket().send(keyMsg)
+def publishClock(deadline, seconds, websockets):
+    """
+    sends the turn deadline to the players with the clock, with the
+    server time to measure it against: no deadline once the timer stops
+    """
+    websockets = [websocket for websocket in websockets if websocket in _clockSockets]
+    if websockets:
+        packet = {'type': 'clock', 'deadline': deadline, 'time': seconds,
+                  'now': round(time.time(), 3)}
+        broadcast(packet, websockets)
 
-async def publishGuess(guess, players):
+
+class OrbitalsBoardCache:
+    """
+    Board packets for one sector, built once per board version and
+    encoded once per codec: players joining or catching up share them
+    """
+    def __init__(self):
+        self._wordsVersion = None
+        self._wordsMsg = None
+        self._keysVersion = None
+        self._keysMsg = None
+
+    def getWordsMessage(self, words):
+        """ Returns the public words packet of the board's current version """
+        version = words.getVersion()
+        if version != self._wordsVersion:
+            # copied: the board's own list changes as words are opened
+            packet = {'type': 'words', 'version': version,
+                      'words': [dict(entry) for entry in words.getWords()]}
+            self._wordsMsg = OrbitalsPacket(packet)
+            self._wordsVersion = version
+        return self._wordsMsg
+
+    def getKeysMessage(self, words):
+        """ Returns the keywords packet of the current board """
+        version = words.getBoardVersion()
+        if version != self._keysVersion:
+            packet = {'type': 'keys', 'keywords': words.getKeywords()}
+            self._keysMsg = OrbitalsPacket(packet)
+            self._keysVersion = version
+        return self._keysMsg
+
+
+async def publishWords(msg, keyMsg, websockets, hubs):
+    """ publish all public words to all players, and the keywords to hubs """
+    frames = [(websocket, msg) for websocket in websockets]
+    frames.extend((websocket, keyMsg) for websocket in hubs)
+    fanOut(frames)
+
+async def publishGuess(guess, websockets):
     """
     publish a single word, its sender, its team, to all players
     """
@@ -167,15 +909,11 @@ async def publishGuess(guess, players):
     #       f"guesser: {guesser}, guesserTeam: {guesserTeam}")
     packet = {'type': 'guess', 'word': word, 'wordTeam': wordTeam,
               'guesser': guesser, 'guesserTeam': guesserTeam,
-              'guesses': int(guess['guessesLeft'])}
-    msg = json.dumps(packet)
-    for player in players:
-        await player.getWebSocket().send(msg)
+              'guesses': int(guess['guessesLeft']), 'version': guess['version']}
+    broadcast(packet, websockets)
 
-async def publishMessage(message, players):
+async def publishMessage(message, websockets):
     """ publishes chat message from non-hub player """
     packet = {'type': 'msg', 'sender': message['msgSender'],
               'team': message['msgTeam'], 'msg': message['msg']}
-    msg = json.dumps(packet)
-    for player in players:
-        await player.getWebSocket().send(msg)
+    broadcast(packet, websockets)
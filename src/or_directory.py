@@ -0,0 +1,113 @@
+"""
+or_directory.py
+Orbitals player directory
+One record per connection, shared by the cluster and its sectors:
+- the player, once the connection has a name
+- the sector the player is in, None in the lobby
+Names are unique across the cluster regardless of case: each one is
+indexed by its case-folded form, so checking a name, finding who holds
+it and finding a connection's player and sector are all dict lookups.
+"""
+from or_player import OrbitalsPlayer
+
+
+def normalName(name):
+    """ Returns the form names are compared in """
+    folded = name.casefold()
+    # names already folded are indexed as they are, without a copy
+    return name if folded == name else folded
+
+
+class OrbitalsDirectory:
+    """ Players and sectors by connection, and connections by name """
+    __slots__ = ('_players', '_sectors', '_names')
+
+    def __init__(self):
+        # player by connection, None until the connection has a name
+        self._players = dict()
+        # sector by connection, None in the lobby
+        self._sectors = dict()
+        # connection by normalized name
+        self._names = dict()
+
+    def __len__(self):
+        return len(self._sectors)
+
+    def __contains__(self, websocket):
+        return websocket in self._sectors
+
+    def connect(self, websocket):
+        """ registers a new connection in the lobby, without a name """
+        self._players[websocket] = None
+        self._sectors[websocket] = None
+
+    def disconnect(self, websocket):
+        """ drops a connection, freeing its name """
+        player = self._players.pop(websocket, None)
+        self._sectors.pop(websocket, None)
+        if player:
+            self._names.pop(normalName(player.getName()), None)
+
+    def nameTaken(self, name):
+        """ Returns True if any connection holds the name, in any case """
+        return normalName(name) in self._names
+
+    def claimName(self, websocket, name):
+        """
+        Gives the connection the name, registering the connection if needed
+        Returns the connection's player, None if another connection holds the name
+        """
+        key = normalName(name)
+        holder = self._names.get(key)
+        if holder is not None and holder is not websocket:
+            return None
+        player = self._players.get(websocket)
+        if player is None:
+            player = OrbitalsPlayer(name)
+            player.setWebSocket(websocket)
+            self._players[websocket] = player
+            self._sectors.setdefault(websocket, None)
+        elif player.getName() != name:
+            # a new name frees the one the connection held
+            self._names.pop(normalName(player.getName()), None)
+            player.setName(name)
+        self._names[key] = websocket
+        return player
+
+    def isNamed(self, websocket):
+        return self._players.get(websocket) is not None
+
+    def getPlayer(self, websocket):
+        """ Returns the connection's player, None if it has no name """
+        return self._players.get(websocket)
+
+    def getName(self, websocket):
+        player = self._players.get(websocket)
+        return player.getName() if player else None
+
+    def getConnection(self, name):
+        """ Returns the connection holding the name, in any case """
+        return self._names.get(normalName(name))
+
+    def getSector(self, websocket):
+        return self._sectors.get(websocket)
+
+    def setSector(self, websocket, sector):
+        self._sectors[websocket] = sector
+
+    def items(self):
+        """ Returns the (connection, sector) pairs, not to be changed while iterated """
+        return self._sectors.items()
+
+    def lobbyCount(self):
+        """ Returns the number of connections not in any sector """
+        return sum(1 for sector in self._sectors.values() if sector is None)
+
+    def replace(self, oldWebsocket, websocket):
+        """ moves a resumed connection's record over to its new connection """
+        player = self._players.pop(oldWebsocket, None)
+        self._players[websocket] = player
+        self._sectors[websocket] = self._sectors.pop(oldWebsocket, None)
+        if player:
+            player.setWebSocket(websocket)
+            self._names[normalName(player.getName())] = websocket
@@ -0,0 +1,151 @@
+"""
+or_dispatch.py
+Orbitals inbound message dispatch
+Every message type a class handles is registered once, with the fields
+it needs and a validator per field:
+    messages = OrbitalsDispatcher()
+
+    class OrbitalsSector:
+        @messages.handles('guess', ('guess', text))
+        async def processGuess(self, websocket, guess):
+Messages with missing or malformed fields are answered with a
+'rejected' response instead of reaching the handler.
+"""
+import time
+import or_comms as orbComms
+import or_metrics
+
+_messagesHandled = or_metrics.counter('orbitals_messages_total',
+                                      'Inbound messages handled, by type', ('type',))
+_handlerSeconds = or_metrics.histogram('orbitals_handler_seconds',
+                                       'Time spent handling an inbound message, by type',
+                                       ('type',))
+_messagesRejected = or_metrics.counter('orbitals_rejected_messages_total',
+                                       'Inbound messages rejected')
+
+
+class OrbitalsRejection(Exception):
+    """ raised by validators, and by handlers, to reject a message """
+
+
+def text(value):
+    """ a string """
+    if not isinstance(value, str):
+        raise OrbitalsRejection('expected text')
+    return value
+
+
+def integer(value):
+    """ an integer, or a string holding one """
+    if isinstance(value, bool):
+        raise OrbitalsRejection('expected a number')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise OrbitalsRejection('expected a number') from None
+
+
+def positive(value):
+    """ an integer of at least 1 """
+    value = integer(value)
+    if value < 1:
+        raise OrbitalsRejection('expected a count of at least 1')
+    return value
+
+
+def flag(value):
+    """ a boolean """
+    if not isinstance(value, (bool, int)):
+        raise OrbitalsRejection('expected true or false')
+    return bool(value)
+
+
+def decodeMessage(codec, frame):
+    """ Returns the message in a frame, raises OrbitalsRejection if there is none """
+    try:
+        data = codec.decode(frame)
+    except ValueError:
+        raise OrbitalsRejection('malformed message') from None
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        raise OrbitalsRejection('malformed message')
+    return data
+
+
+def rejectMessage(websocket, msgType, reason):
+    """ tells the sender their message was dropped, and why """
+    packet = {'type': 'response',
+              'msg': 'rejected',
+              'request': msgType,
+              'reason': reason}
+    orbComms.send(websocket, packet)
+    _messagesRejected.inc()
+
+
+class OrbitalsDispatcher:
+    """
+    Maps message types to a handler method and its field validators
+    Handlers are looked up by name on the target, so subclasses can
+    override them.
+    """
+    def __init__(self):
+        self._routes = dict()
+
+    def handles(self, msgType, *fields):
+        """
+        registers the decorated method for msgType
+        fields are (name, validator) or (name, validator, default) pairs,
+        their values are passed to the handler after the websocket
+        """
+        required = tuple(field[:2] for field in fields if len(field) == 2)
+        optional = tuple(field for field in fields if len(field) == 3)
+        names = tuple(field[0] for field in fields)
+
+        def register(handler):
+            self._routes[msgType] = (handler.__name__, required, optional, names)
+            return handler
+        return register
+
+    def copy(self):
+        """ Returns a dispatcher with the same routes, for subclasses to extend """
+        dispatcher = OrbitalsDispatcher()
+        dispatcher._routes = dict(self._routes)
+        return dispatcher
+
+    def handlesType(self, msgType):
+        """ Returns True if msgType has a handler """
+        return msgType in self._routes
+
+    def getTypes(self):
+        """ Returns the message types with a handler """
+        return tuple(self._routes)
+
+    async def dispatch(self, target, websocket, data):
+        """
+        validates a message and calls its handler on target
+        Returns False if the message type has no handler here,
+        True once it has been handled or rejected
+        """
+        route = self._routes.get(data.get('type'))
+        if route is None:
+            return False
+        handlerName, required, optional, names = route
+        values = dict()
+        try:
+            for name, validator in required:
+                if name not in data:
+                    raise OrbitalsRejection(f"missing '{name}'")
+                values[name] = validator(data[name])
+            for name, validator, default in optional:
+                values[name] = validator(data[name]) if name in data else default
+        except OrbitalsRejection as rejection:
+            rejectMessage(websocket, data['type'], str(rejection))
+            return True
+        handler = getattr(target, handlerName)
+        started = time.perf_counter()
+        try:
+            await handler(websocket, *(values[name] for name in names))
+        except OrbitalsRejection as rejection:
+            rejectMessage(websocket, data['type'], str(rejection))
+        _handlerSeconds.observe(time.perf_counter() - started, data['type'])
+        _messagesHandled.inc(data['type'])
+        return True
@@ -0,0 +1,135 @@
+"""
+or_game.py
+Orbitals game info
+Teams and game states are small integer codes, player flags are bits,
+and the game info of a sector is a slotted object: comparisons are on
+ints and an idle sector or player carries no per-instance dict.
+Packets and journal records still carry the string labels.
+The codes are plain int class attributes rather than enum members,
+which cost several times more to look up and combine.
+"""
+import operator
+
+
+class Team:
+    """ Team of a player, a turn or a win: N for none """
+    N = 0
+    O = 1
+    B = 2
+
+
+# labels sent to clients, indexed by code
+teamLabels = ('N', 'O', 'B')
+_teamsByLabel = {label: team for team, label in enumerate(teamLabels)}
+
+
+def teamFromLabel(label):
+    """ Returns the team for a label, N for anything that is not a team """
+    return _teamsByLabel.get(label, Team.N)
+
+
+class GameState:
+    """ Sector game states, in the order their codes are sent in """
+    WAITING_PLAYERS = 0
+    WAITING_START = 1
+    GAME_START = 2
+    HINT_SUBMISSION = 3
+    HINT_RESPONSE = 4
+    GUESS_SUBMISSION = 5
+    GAME_OVER = 6
+
+
+stateLabels = ('waiting-players', 'waiting-start', 'game-start',
+               'hint-submission', 'hint-response', 'guess-submission',
+               'game-over')
+_statesByLabel = {label: state for state, label in enumerate(stateLabels)}
+
+# states of a game in progress
+playingStates = frozenset((GameState.GAME_START, GameState.HINT_SUBMISSION,
+                           GameState.HINT_RESPONSE, GameState.GUESS_SUBMISSION))
+
+
+def stateFromLabel(label):
+    return _statesByLabel[label]
+
+
+class PlayerFlag:
+    """ Role and readiness bits of a player """
+    HUB = 1
+    READY = 2
+    REPLAY = 4
+
+
+class OrbitalsGameInfo:
+    """ Turn, hint and state of the game played in a sector """
+    __slots__ = ('state', 'turn', 'guesses', 'winner', 'orangeHub', 'blueHub',
+                 'hintWord', 'hintCount', 'hintSender', 'hintTeam')
+
+    def __init__(self):
+        self.state = GameState.WAITING_PLAYERS
+        self.turn = Team.N
+        self.guesses = 0
+        self.winner = Team.N
+        self.orangeHub = False
+        self.blueHub = False
+        self.clearHint()
+
+    def clearHint(self):
+        self.hintWord = ''
+        self.hintCount = 0
+        self.hintSender = ''
+        self.hintTeam = Team.N
+
+    def snapshot(self):
+        """ Returns the value of every field, for changedSince """
+        return _fieldValues(self)
+
+    def changedSince(self, snapshot):
+        """ Returns the names of the fields that changed since snapshot was taken """
+        return {field for field, old, new in zip(self.__slots__, snapshot, _fieldValues(self))
+                if old != new}
+
+    def isPlaying(self):
+        """ Returns True if a game is in progress """
+        return self.state in playingStates
+
+    def getKey(self):
+        """ Returns the fields state packets depend on """
+        return (self.state, self.turn, self.hintWord, self.guesses,
+                self.winner, self.orangeHub, self.blueHub)
+
+    def toDict(self):
+        """ Returns the game info as a journal record holds it """
+        return {'state': stateLabels[self.state],
+                'hint': {'hintWord': self.hintWord,
+                         'count': self.hintCount,
+                         'sender': self.hintSender,
+                         'team': teamLabels[self.hintTeam] if self.hintTeam else ''},
+                'turn': teamLabels[self.turn],
+                'guesses': self.guesses,
+                'winner': teamLabels[self.winner] if self.winner else '',
+                'orange-hub': self.orangeHub,
+                'blue-hub': self.blueHub}
+
+    @classmethod
+    def fromDict(cls, game):
+        """ Returns the game info of a journal record """
+        gameInfo = cls()
+        gameInfo.state = stateFromLabel(game['state'])
+        gameInfo.turn = teamFromLabel(game['turn'])
+        gameInfo.guesses = game['guesses']
+        gameInfo.winner = teamFromLabel(game['winner'])
+        gameInfo.orangeHub = game['orange-hub']
+        gameInfo.blueHub = game['blue-hub']
+        hint = game['hint']
+        gameInfo.hintWord = hint['hintWord']
+        gameInfo.hintCount = hint['count']
+        gameInfo.hintSender = hint['sender']
+        gameInfo.hintTeam = teamFromLabel(hint['team'])
+        return gameInfo
+
+    def __repr__(self):
+        return f"OrbitalsGameInfo({self.toDict()})"
+
+
+_fieldValues = operator.attrgetter(*OrbitalsGameInfo.__slots__)
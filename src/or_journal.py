@@ -0,0 +1,240 @@
+"""
+or_journal.py
+Orbitals event journal
+Sectors append their state changes to a write-ahead journal:
+- records are queued on the event loop and written by a background
+  thread, which fsyncs once for everything queued since its last write
+- every snapshotEvery records, the writer stores a snapshot of all the
+  sectors' state and starts a fresh journal
+- on startup, the sectors are rebuilt from the snapshot plus the records
+  written after it
+Records carry resulting state, not player actions, so replaying one is a
+dict update and recovery takes time proportional to the journal tail.
+A server holds the journal directory's lock until it exits: a replacement
+started alongside it waits for the lock before it recovers the journal.
+"""
+import copy
+import json
+import os
+import queue
+import threading
+import time
+import or_log
+import or_metrics
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks: one server per journal directory
+    fcntl = None
+
+log = or_log.getLogger('journal')
+
+journalFileName = 'journal.log'
+snapshotFileName = 'snapshot.json'
+lockFileName = 'lock'
+
+_recordsWritten = or_metrics.counter('orbitals_journal_records_total',
+                                     'Records written to the journal')
+_fsyncSeconds = or_metrics.histogram('orbitals_journal_fsync_seconds',
+                                     'Time spent writing and syncing one batch of records')
+_snapshots = or_metrics.counter('orbitals_journal_snapshots_total',
+                                'Snapshots written')
+
+
+def newSectorState():
+    """ Returns the recovered state of a sector nothing was recorded for yet """
+    return {'game': None,
+            'players': [],
+            'keys': [],
+            'first': '',
+            'opened': []}
+
+
+def applyRecord(sectors, record):
+    """
+    Applies one journal record to the sectors' state:
+    - game: the sector's game info
+    - players: the roster, name, team, hub and ready per player
+    - board: a new board, the team of every word and the first turn
+    - open: a word was guessed
+    - reset: the sector hibernated, its game is over
+    """
+    name = record['sector']
+    event = record['event']
+    if event == 'reset':
+        sectors.pop(name, None)
+        return
+    state = sectors.setdefault(name, newSectorState())
+    if event == 'game':
+        state['game'] = record['game']
+    elif event == 'players':
+        state['players'] = record['players']
+    elif event == 'board':
+        state['keys'] = record['keys']
+        state['first'] = record['first']
+        state['opened'] = []
+    elif event == 'open':
+        state['opened'].append(record['word'])
+
+
+class OrbitalsJournal:
+    """ Write-ahead journal and snapshots of every sector in a cluster """
+
+    def __init__(self, directory, snapshotEvery=1000):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._journalFileName = os.path.join(directory, journalFileName)
+        self._snapshotFileName = os.path.join(directory, snapshotFileName)
+        self._snapshotEvery = snapshotEvery
+        self._records = queue.SimpleQueue()
+        # state as of the last record written: owned by the writer thread
+        self._sectors = dict()
+        self._sequence = 0
+        self._sinceSnapshot = 0
+        self._file = None
+        self._writer = None
+        self._lockFile = None
+
+    def lock(self, blocking=False):
+        """
+        Takes the journal directory's lock, held until the journal is closed
+        Returns False if another server holds it and blocking is not set
+        """
+        if fcntl is None:
+            return True
+        if self._lockFile is None:
+            self._lockFile = open(os.path.join(self._directory, lockFileName), 'w')
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._lockFile, flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    def recover(self):
+        """
+        Returns the state of every sector that was in play, rebuilt from
+        the latest snapshot and the journal records written after it
+        """
+        started = time.perf_counter()
+        snapshotSequence = 0
+        if os.path.exists(self._snapshotFileName):
+            with open(self._snapshotFileName) as snapshotFile:
+                snapshot = json.load(snapshotFile)
+            self._sectors = snapshot['sectors']
+            snapshotSequence = snapshot['sequence']
+        self._sequence = snapshotSequence
+
+        tail = 0
+        if os.path.exists(self._journalFileName):
+            validLength = 0
+            with open(self._journalFileName, 'rb') as journalFile:
+                for line in journalFile:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('no line end')
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write: the process died halfway through a line
+                        log.warning("Journal ends in a partial record, dropping it")
+                        break
+                    validLength += len(line)
+                    if record['sequence'] <= snapshotSequence:
+                        # written before the snapshot was taken
+                        continue
+                    applyRecord(self._sectors, record)
+                    self._sequence = record['sequence']
+                    tail += 1
+            # new records must not be appended to a partial one
+            os.truncate(self._journalFileName, validLength)
+        self._sinceSnapshot = tail
+        log.info("Recovered %d sectors from the snapshot and %d journal records in %.3f s",
+                 len(self._sectors), tail, time.perf_counter() - started)
+        return copy.deepcopy(self._sectors)
+
+    def start(self):
+        """ opens the journal for appending and starts the writer thread """
+        self._file = open(self._journalFileName, 'a')
+        self._writer = threading.Thread(target=self.write, name='journal-writer',
+                                        daemon=True)
+        self._writer.start()
+
+    def record(self, sector, event, **fields):
+        """
+        Queues a record for the writer thread, never blocks:
+        fields must not be changed after they are handed over
+        """
+        self._records.put((sector, event, fields))
+
+    def close(self):
+        """
+        writes out the records still queued, stops the writer thread and
+        releases the lock: records made after this are dropped
+        """
+        if self._writer is not None:
+            self._records.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._lockFile is not None:
+            self._lockFile.close()
+            self._lockFile = None
+
+    def write(self):
+        """
+        runs in the writer thread: takes every record queued since the
+        last batch, writes them and syncs the journal once per batch
+        """
+        running = True
+        while running:
+            batch = [self._records.get()]
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                sector, event, fields = item
+                self._sequence += 1
+                record = dict(fields, sequence=self._sequence, sector=sector, event=event)
+                lines.append(json.dumps(record) + '\n')
+                applyRecord(self._sectors, record)
+            if lines:
+                started = time.perf_counter()
+                self._file.write(''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                _fsyncSeconds.observe(time.perf_counter() - started)
+                _recordsWritten.add(len(lines))
+                self._sinceSnapshot += len(lines)
+                if self._sinceSnapshot >= self._snapshotEvery:
+                    self.writeSnapshot()
+        self._file.close()
+
+    def writeSnapshot(self):
+        """
+        runs in the writer thread: replaces the snapshot with the current
+        state, then truncates the journal it covers
+        """
+        partFileName = self._snapshotFileName + '.part'
+        with open(partFileName, 'w') as snapshotFile:
+            json.dump({'sequence': self._sequence, 'sectors': self._sectors}, snapshotFile)
+            snapshotFile.flush()
+            os.fsync(snapshotFile.fileno())
+        os.replace(partFileName, self._snapshotFileName)
+        directory = os.open(self._directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        # records up to the snapshot are skipped on recovery until the
+        # truncation below reaches the disk
+        self._file.close()
+        self._file = open(self._journalFileName, 'w')
+        self._sinceSnapshot = 0
+        _snapshots.inc()
+        log.debug("Snapshot of %d sectors at record %d", len(self._sectors), self._sequence)
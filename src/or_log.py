@@ -0,0 +1,53 @@
+"""
+or_log.py
+Orbitals logging
+Every module logs through the 'orbitals' logger hierarchy. Records are
+handed to a queue on the event loop and written out by a background
+thread, so a slow terminal or log pipe never blocks the game.
+Sector loggers add the sector name to every record.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+
+logFormat = ('%(asctime)s %(levelname)s %(processName)s %(name)s '
+             'sector=%(sector)s %(message)s')
+
+
+class OrbitalsContextFilter(logging.Filter):
+    """ fills in the context fields of records logged without them """
+    def filter(self, record):
+        if not hasattr(record, 'sector'):
+            record.sector = '-'
+        return True
+
+
+def getLogger(name):
+    """ Returns a logger under the 'orbitals' hierarchy """
+    return logging.getLogger(f'orbitals.{name}')
+
+
+def getSectorLogger(name, sector):
+    """ Returns a logger that tags every record with the sector name """
+    return logging.LoggerAdapter(getLogger(name), {'sector': sector})
+
+
+def setupLogging(verbose=False, stream=None):
+    """
+    routes the 'orbitals' loggers through a queue to a writer thread
+    debug records are only built when verbose is set
+    Returns the queue listener, stop it to flush the remaining records
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(logFormat))
+    handler.addFilter(OrbitalsContextFilter())
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    logger = logging.getLogger('orbitals')
+    logger.handlers = [logging.handlers.QueueHandler(records)]
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
@@ -0,0 +1,155 @@
+"""
+or_metrics.py
+Orbitals metrics
+Counters and latency histograms recorded by the cluster, the sectors,
+the dispatcher, the timer wheel and or_comms, served in the Prometheus
+text format from the websocket port:
+    curl http://localhost:9001/metrics
+Recording a value is a dict update, or a bisect and two dict updates
+for histograms, so metrics stay on in production.
+Gauges are read through collector callbacks when the page is served.
+"""
+import bisect
+import http
+
+metricsPath = '/metrics'
+
+# latency buckets in seconds, from 50 us to 5 s
+latencyBuckets = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                  0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics = dict()
+# gauge collectors, by the key they were added under
+_collectors = dict()
+
+
+class OrbitalsCounter:
+    """ a monotonically increasing count, per set of label values """
+    kind = 'counter'
+
+    def __init__(self, name, helpText, labelNames=()):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = labelNames
+        self._values = dict()
+
+    def inc(self, *labelValues):
+        self._values[labelValues] = self._values.get(labelValues, 0) + 1
+
+    def add(self, amount, *labelValues):
+        self._values[labelValues] = self._values.get(labelValues, 0) + amount
+
+    def getValue(self, *labelValues):
+        return self._values.get(labelValues, 0)
+
+    def render(self):
+        """ Returns the sample lines """
+        return [f"{self.name}{_labels(self.labelNames, labelValues)} {value}"
+                for labelValues, value in self._values.items()]
+
+
+class OrbitalsHistogram:
+    """ a distribution of values in fixed buckets, per set of label values """
+    kind = 'histogram'
+
+    def __init__(self, name, helpText, labelNames=(), buckets=latencyBuckets):
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = labelNames
+        self._buckets = buckets
+        self._counts = dict()
+        self._sums = dict()
+
+    def observe(self, value, *labelValues):
+        counts = self._counts.get(labelValues)
+        if counts is None:
+            counts = [0] * (len(self._buckets) + 1)
+            self._counts[labelValues] = counts
+            self._sums[labelValues] = 0.0
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sums[labelValues] += value
+
+    def getCount(self, *labelValues):
+        return sum(self._counts.get(labelValues, ()))
+
+    def render(self):
+        """ Returns the sample lines: cumulative buckets, sum and count """
+        lines = []
+        for labelValues, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _labels(self.labelNames + ('le',), labelValues + (le,))
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _labels(self.labelNames, labelValues)
+            lines.append(f"{self.name}_sum{labels} {self._sums[labelValues]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def counter(name, helpText, labelNames=()):
+    """ Returns the counter called name, registering it on first use """
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = OrbitalsCounter(name, helpText, labelNames)
+        _metrics[name] = metric
+    return metric
+
+
+def histogram(name, helpText, labelNames=(), buckets=latencyBuckets):
+    """ Returns the histogram called name, registering it on first use """
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = OrbitalsHistogram(name, helpText, labelNames, buckets)
+        _metrics[name] = metric
+    return metric
+
+
+def addCollector(collector, key=None):
+    """
+    collector() is called whenever the metrics are served and Returns
+    (name, helpText, value) gauges read from live state
+    A collector added under the key of another replaces it, so objects
+    created more than once in a process report their gauges once
+    """
+    _collectors[collector if key is None else key] = collector
+
+
+def render():
+    """ Returns every metric in the Prometheus text format """
+    lines = []
+    for collector in _collectors.values():
+        for name, helpText, value in collector():
+            lines.append(f"# HELP {name} {helpText}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    for metric in _metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.helpText}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def processRequest(path, requestHeaders):
+    """
+    websockets process_request hook: answers plain HTTP requests for the
+    metrics path, lets every other request through to the handshake
+    """
+    if path != metricsPath:
+        return None
+    body = render().encode()
+    headers = [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+               ('Content-Length', str(len(body)))]
+    return http.HTTPStatus.OK, headers, body
@@ -8,16 +8,19 @@ Tracks:
 - readiness
 - replay status
 - websocket
+Role, readiness and replay status are bits of a single flags field.
 """
+from or_game import PlayerFlag, Team
+
 
 class OrbitalsPlayer:
     """ Handles player properties """
+    __slots__ = ('_name', '_team', '_flags', '_websocket')
+
     def __init__(self, name):
         self._name = name
-        self._team = 'N'
-        self._hub = False
-        self._ready = False
-        self._replay = False
+        self._team = Team.N
+        self._flags = 0
         self._websocket = None
 
     def setWebSocket(self, websocket):
@@ -33,28 +36,46 @@ class OrbitalsPlayer:
         return self._name
 
     def setTeam(self, newTeam):
-        if newTeam == 'O' or newTeam == 'B':
+        if newTeam == Team.O or newTeam == Team.B:
             self._team = newTeam
         else:
-            self._team = 'N'
+            self._team = Team.N
 
     def getTeam(self):
         return self._team
 
+    def reset(self):
+        """ clears team, role and flags, for a player taking a seat in a sector """
+        self._team = Team.N
+        self._flags = 0
+
+    def getFlags(self):
+        """ Returns the PlayerFlag bits of the player """
+        return self._flags
+
     def setHub(self, role = True):
-        self._hub = role
+        if role:
+            self._flags |= PlayerFlag.HUB
+        else:
+            self._flags &= ~PlayerFlag.HUB
 
     def isHub(self):
-        return self._hub
+        return bool(self._flags & PlayerFlag.HUB)
 
     def setReady(self, ready):
-        self._ready = ready
+        if ready:
+            self._flags |= PlayerFlag.READY
+        else:
+            self._flags &= ~PlayerFlag.READY
 
     def isReady(self):
-        return self._ready
+        return bool(self._flags & PlayerFlag.READY)
 
     def setReplay(self, replay):
-        self._replay = replay
-        
+        if replay:
+            self._flags |= PlayerFlag.REPLAY
+        else:
+            self._flags &= ~PlayerFlag.REPLAY
+
     def wantsReplay(self):
-        return self._replay
\ No newline at end of file
+        return bool(self._flags & PlayerFlag.REPLAY)
@@ -1,66 +1,77 @@
 """
 or_players.py
 Handles all players at the table
+The roster is indexed by websocket, names are looked up in the player
+directory the players come from, and the team, hub, readiness and
+replay counters are updated on every change, so none of the queries
+below need to walk the roster.
 """
-from or_player import OrbitalsPlayer
+from or_directory import OrbitalsDirectory
+from or_game import PlayerFlag, Team, teamLabels
 
 class OrbitalsPlayers:
     """ Top level class """
-    def __init__(self):
-        self._players = set()
-        self._enoughPlayers = False
-        self._blueHub = False
-        self._orangeHub = False
-        self._blueTeam = 0
-        self._orangeTeam = 0
+    __slots__ = ('_players', '_directory', '_private', '_teamCount', '_hubs',
+                 '_readyHubs', '_replayCount')
+
+    def __init__(self, directory=None):
+        self._players = dict()
+        # a roster without a directory keeps the names of its own players
+        self._private = directory is None
+        self._directory = OrbitalsDirectory() if directory is None else directory
+        # indexed by team code: N, O, B
+        self._teamCount = [0, 0, 0]
+        self._hubs = [None, None, None]
+        self._readyHubs = 0
+        self._replayCount = 0
 
     def getPlayers(self):
-        """ Returns set of or_player objects """
-        return self._players
+        """ Returns the or_player objects """
+        return self._players.values()
 
     def getPlayerData(self):
         """
         Returns list of player data dicts: name, team, hub, and ready
         """
         playerData = []
-        for player in self._players:
+        for player in self._players.values():
             playerData.append({'name': player.getName(),
-                               'team': player.getTeam(),
+                               'team': teamLabels[player.getTeam()],
                                'hub': player.isHub(),
                                'ready': player.isReady()})
         return playerData
 
     def getPlayersNames(self):
         """ Returns a set of player names """
-        return {player.getName() for player in self._players}
+        return {player.getName() for player in self._players.values()}
 
     def getOrangeTeamCount(self):
-        return self._orangeTeam
+        return self._teamCount[Team.O]
 
     def getBlueTeamCount(self):
-        return self._blueTeam
+        return self._teamCount[Team.B]
 
     def nameExists(self, name):
-        """ Returns True if name is already taken, False if it isn't """
-        names = {player.getName() for player in self._players}
-        return name in names
+        """ Returns True if a player at the table has the name, in any case """
+        return self._directory.getConnection(name) in self._players
 
     def addPlayer(self, name, websocket):
         """
         If the requested name isn't taken yet:
-            - Adds new or_player to _players list
+            - Seats the directory's player for websocket, as a spectator
             - Returns True
         if the name is already taken: returns False
         """
         if not name:
             return False, 'Name is blank'
 
-        if not self.nameExists(name):
-            newPlayer = OrbitalsPlayer(name)
-            newPlayer.setWebSocket(websocket)
-            self._players.add(newPlayer)
-            return True, 'added'
-        return False, 'Name exists'
+        newPlayer = self._directory.claimName(websocket, name)
+        if newPlayer is None or websocket in self._players:
+            return False, 'Name exists'
+        newPlayer.reset()
+        self._players[websocket] = newPlayer
+        self._count(newPlayer)
+        return True, 'added'
 
     def removePlayer(self, websocket):
         """
@@ -71,18 +82,16 @@ class OrbitalsPlayers:
         - return False
         Otherwise return True
         """
-        # print(f"player {self.playerName(websocket)} has left.")
-        retiredPlayer = None
-        for player in self.getPlayers():
-            if player.getWebSocket() == websocket:
-                retiredPlayer = player
-                break
+        retiredPlayer = self._players.pop(websocket, None)
         if retiredPlayer:
-            self._players.remove(retiredPlayer)
+            self._uncount(retiredPlayer)
+            if self._private:
+                self._directory.disconnect(websocket)
 
         if not self.enoughPlayers():
-            for player in self.getPlayers():
+            for player in self._players.values():
                 player.setReady(False)
+            self._readyHubs = 0
             return False
         return True
 
@@ -91,51 +100,32 @@ class OrbitalsPlayers:
         Returns true if there is at least one hub and one player per team,
         false otherwise
         """
-        self._blueHub = False
-        self._orangeHub = False
-        self._blueTeam = 0
-        self._orangeTeam = 0
-        oPlayers = bPlayers = oHub = bHub = False
-        for player in self._players:
-            if player.getTeam() == 'B':
-                self._blueTeam += 1
-                if player.isHub():
-                    bHub = True
-                    self._blueHub = True
-                else:
-                    bPlayers = True
-            elif player.getTeam() == 'O':
-                self._orangeTeam += 1
-                if player.isHub():
-                    oHub = True
-                    self._orangeHub = True
-                else:
-                    oPlayers = True
-        requiredList = [oPlayers, bPlayers, oHub, bHub]
-        self._enoughPlayers = all(requiredList)
-        return self._enoughPlayers
+        _, oCount, bCount = self._teamCount
+        _, oHub, bHub = self._hubs
+        oHub = oHub is not None
+        bHub = bHub is not None
+        oPlayers = oCount > oHub
+        bPlayers = bCount > bHub
+        return oPlayers and bPlayers and oHub and bHub
 
     def playerName(self, websocket):
         """
         Returns the name if a player object matches the websocket object
         """
-        for player in self._players:
-            if player.getWebSocket() == websocket:
-                return player.getName()
+        player = self._players.get(websocket)
+        if player:
+            return player.getName()
         return None
 
     def haveBlueHub(self):
-        return self._blueHub
+        return self._hubs[Team.B] is not None
 
     def haveOrangeHub(self):
-        return self._orangeHub
+        return self._hubs[Team.O] is not None
 
     def playerId(self, websocket):
         """ Returns player object """
-        for player in self._players:
-            if player.getWebSocket() == websocket:
-                return player
-        return None
+        return self._players.get(websocket)
 
     def joinTeam(self, websocket, team):
         """
@@ -145,30 +135,33 @@ class OrbitalsPlayers:
         Otherwise return False
         """
         player = self.playerId(websocket)
-        # print(f"{player.getName()} has requested team {team}")
-        
-        player.setHub(role = False)
-        player.setReady(False)
-        if team == 'O':
-            if self._orangeTeam < 4:
-                player.setTeam(team)
-            else:
-                return False, 'Orange team is full'
-    
-        elif team == 'B':
-            if self._blueTeam < 4:
-                player.setTeam(team)
-            else:
-                return False, 'Blue team is full'
-        
-        self.enoughPlayers()
+
+        # a full team leaves the player as they were
+        if team == Team.O and self._teamCount[Team.O] >= 4:
+            return False, 'Orange team is full'
+        if team == Team.B and self._teamCount[Team.B] >= 4:
+            return False, 'Blue team is full'
+
+        self._update(player, player.setHub, False)
+        self._update(player, player.setReady, False)
+        if team == Team.O or team == Team.B:
+            self._update(player, player.setTeam, team)
+
         return True, 'team-accepted'
-        
+
+    def replaceWebSocket(self, oldWebsocket, websocket):
+        """ moves a player over to a new connection, keeping the roster order """
+        player = self._players.get(oldWebsocket)
+        if player:
+            player.setWebSocket(websocket)
+            self._players = {(websocket if key is oldWebsocket else key): value
+                             for key, value in self._players.items()}
+
     def getTeam(self, name):
         """ Returns the team the player belongs to """
-        for player in self._players:
-            if player.getName() == name:
-                return player.getTeam()
+        player = self._players.get(self._directory.getConnection(name))
+        if player:
+            return player.getTeam()
         return False
 
     def requestHub(self, websocket):
@@ -179,17 +172,14 @@ class OrbitalsPlayers:
         If there are enough players, returns True
         Otherwise returns False
         """
-        # print(f"{self.playerName(websocket)} has requested hub role toggle")
         player = self.playerId(websocket)
         # is player hub already?
         if player.isHub():
-            player.setHub(role=False)
-            self.enoughPlayers()
+            self._update(player, player.setHub, False)
             return True, 'hub-off'
         # player is not hub:
         elif self.hubAvailable(player.getTeam()):
-            player.setHub()
-            self.enoughPlayers()
+            self._update(player, player.setHub, True)
             return True, 'hub-on'
         return False, 'Hub role not available'
 
@@ -197,28 +187,20 @@ class OrbitalsPlayers:
         """
         Returns True if hub role is available for specified team
         """
-        for player in self._players:
-            if player.getTeam() == team and player.isHub():
-                return False
-        return True
+        return self._hubs[team] is None
 
     def requestStart(self, websocket):
         """
         Returns True if if both teams are ready to start
         Returns False otherwise
         """
-        # print(f"{self.playerName(websocket)} is ready to start")
         if self.enoughPlayers():
-            if self.playerId(websocket).isHub():
-                self.playerId(websocket).setReady(True)
+            player = self.playerId(websocket)
+            if player.isHub():
+                self._update(player, player.setReady, True)
 
             # are both players ready?
-            readyCount = 0
-            for player in self._players:
-                if player.isHub() and player.isReady():
-                    readyCount += 1
-            # print(f"Ready count: {readyCount}")
-            if readyCount == 2:
+            if self._readyHubs == 2:
                 return True
         return False
 
@@ -229,20 +211,47 @@ class OrbitalsPlayers:
         Returns False otherwise
         """
         readyPlayer = self.playerId(websocket)
-        readyPlayer.setReplay(True)
-        replayNow = True
-
-        for player in self._players:
-            team = player.getTeam()
-            if (team == 'B' or team == 'O') and not player.wantsReplay():
-                replayNow = False
-                break
+        self._update(readyPlayer, readyPlayer.setReplay, True)
 
-        if replayNow:
+        # has every player in a team asked for a replay?
+        if self._replayCount == self._teamCount[Team.O] + self._teamCount[Team.B]:
             # set status of all non-hub players to non-ready
-            for player in self._players:
+            for player in self._players.values():
                 player.setReplay(False)
                 player.setReady(False)
+            self._readyHubs = 0
+            self._replayCount = 0
             return True
 
         return False
+
+    def _update(self, player, setter, value):
+        """ applies a player setter, keeping the roster counters current """
+        self._uncount(player)
+        setter(value)
+        self._count(player)
+
+    def _count(self, player):
+        """ adds a player's team, role and flags to the counters """
+        team = player.getTeam()
+        flags = player.getFlags()
+        self._teamCount[team] += 1
+        if flags & PlayerFlag.HUB:
+            self._hubs[team] = player
+            if flags & PlayerFlag.READY:
+                self._readyHubs += 1
+        if team != Team.N and flags & PlayerFlag.REPLAY:
+            self._replayCount += 1
+
+    def _uncount(self, player):
+        """ removes a player's team, role and flags from the counters """
+        team = player.getTeam()
+        flags = player.getFlags()
+        self._teamCount[team] -= 1
+        if flags & PlayerFlag.HUB:
+            if self._hubs[team] is player:
+                self._hubs[team] = None
+            if flags & PlayerFlag.READY:
+                self._readyHubs -= 1
+        if team != Team.N and flags & PlayerFlag.REPLAY:
+            self._replayCount -= 1
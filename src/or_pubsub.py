@@ -0,0 +1,84 @@
+"""
+or_pubsub.py
+Orbitals audiences
+Every packet that goes to more than one connection goes to a topic:
+- the lobby: named users not in a sector
+- a sector: everyone in it
+- a sector's hubs: the players holding the hub role
+Subscriptions change as users join and leave, and take or give up the
+hub role (a team change gives it up). Each topic keeps its subscribers
+as a ready-made recipient list between changes, so publishing never
+scans the users or checks their roles. State packets differ per player
+and are still built for each one.
+"""
+lobbyTopic = 'lobby'
+
+
+def sectorTopic(sector):
+    return ('sector', sector)
+
+
+def hubsTopic(sector):
+    return ('hubs', sector)
+
+
+class OrbitalsTopics:
+    """ Subscribers of every topic, and the topics of every subscriber """
+    __slots__ = ('_subscribers', '_recipients', '_topics')
+
+    def __init__(self):
+        # websockets by topic, in the order they subscribed
+        self._subscribers = dict()
+        # the recipient list of a topic, dropped whenever its subscribers change
+        self._recipients = dict()
+        self._topics = dict()
+
+    def subscribe(self, websocket, topic):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None:
+            subscribers = self._subscribers[topic] = dict()
+        elif websocket in subscribers:
+            return
+        subscribers[websocket] = None
+        self._recipients.pop(topic, None)
+        self._topics.setdefault(websocket, set()).add(topic)
+
+    def unsubscribe(self, websocket, topic):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None or websocket not in subscribers:
+            return
+        del subscribers[websocket]
+        if not subscribers:
+            # topics of sectors that were reclaimed don't linger
+            del self._subscribers[topic]
+        self._recipients.pop(topic, None)
+        topics = self._topics[websocket]
+        topics.discard(topic)
+        if not topics:
+            del self._topics[websocket]
+
+    def unsubscribeAll(self, websocket):
+        """ drops every subscription of a websocket that went away """
+        for topic in list(self._topics.get(websocket, ())):
+            self.unsubscribe(websocket, topic)
+
+    def replace(self, oldWebsocket, websocket):
+        """ moves every subscription of a resumed session over to its new connection """
+        for topic in list(self._topics.get(oldWebsocket, ())):
+            self.unsubscribe(oldWebsocket, topic)
+            self.subscribe(websocket, topic)
+
+    def isSubscribed(self, websocket, topic):
+        return topic in self._topics.get(websocket, ())
+
+    def count(self, topic):
+        """ Returns the number of subscribers of a topic """
+        return len(self._subscribers.get(topic, ()))
+
+    def getSubscribers(self, topic):
+        """ Returns the recipient list of a topic, not to be changed """
+        recipients = self._recipients.get(topic)
+        if recipients is None:
+            recipients = tuple(self._subscribers.get(topic, ()))
+            self._recipients[topic] = recipients
+        return recipients
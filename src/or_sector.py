@@ -8,76 +8,302 @@ Tracks:
 - board
 - turns
 """
-import asyncio
-import json
+import logging
+import time
 import or_comms as orbComms
+import or_log
+import or_metrics
+from or_dispatch import (OrbitalsDispatcher, OrbitalsRejection,
+                         flag, integer, positive, rejectMessage, text)
+from or_game import GameState, OrbitalsGameInfo, Team, stateLabels, teamFromLabel, teamLabels
 from or_words import OrbitalsWords
 from or_players import OrbitalsPlayers
+from or_pubsub import OrbitalsTopics, hubsTopic, sectorTopic
 from or_timer import OrbitalsTimer
 
+
+def newGameInfo():
+    """ Returns the game info of a sector nobody has played in yet """
+    return OrbitalsGameInfo()
+
+
+# messages handled by a sector, once the player has joined it
+sectorMessages = OrbitalsDispatcher()
+
+# events each game state allows: event -> (guard, transition), the names
+# of the OrbitalsSector methods that take the event's arguments.
+# A guard returns None if the event can go ahead, or why it can't:
+# events not listed for a state, or that their guard turns down, are
+# rejected to the sender and change nothing
+_rosterEvents = {'team': ('checkTeam', 'changeTeam'),
+                 'hub': ('checkHub', 'toggleHub'),
+                 'leave': (None, 'dropPlayer')}
+gameTransitions = {
+    GameState.WAITING_PLAYERS: dict(_rosterEvents),
+    GameState.WAITING_START: dict(_rosterEvents,
+                                  ready=('checkReady', 'readyHub')),
+    GameState.GAME_START: {'timeout': (None, 'timeout'),
+                           'leave': (None, 'dropPlayer')},
+    GameState.HINT_SUBMISSION: {'hint': ('checkHint', 'giveHint'),
+                                'timeout': (None, 'timeout'),
+                                'leave': (None, 'dropPlayer')},
+    GameState.HINT_RESPONSE: {'hint-response': ('checkHintResponse', 'answerHint'),
+                              'leave': (None, 'dropPlayer')},
+    GameState.GUESS_SUBMISSION: {'guess': ('checkGuess', 'openWord'),
+                                 'timeout': (None, 'timeout'),
+                                 'leave': (None, 'dropPlayer')},
+    GameState.GAME_OVER: dict(_rosterEvents,
+                              replay=('checkReplay', 'requestReplay')),
+}
+
+_gamesStarted = or_metrics.counter('orbitals_games_started_total',
+                                   'Games started, by sector', ('sector',))
+_gamesFinished = or_metrics.counter('orbitals_games_finished_total',
+                                    'Games won, by sector and winning team',
+                                    ('sector', 'winner'))
+_timeouts = or_metrics.counter('orbitals_timer_timeouts_total',
+                               'Turn timers that ran out, by sector', ('sector',))
+
+
 class OrbitalsSector:
     """ Top level class """
-
-    def __init__(self, wordCount, turnTimeout, name, symbol):
-        self._gameInfo = {'state': 'waiting-players',
-                          'hint': {'hintWord': '',
-                                   'count': 0,
-                                   'sender': '',
-                                   'team': ''},
-                          'turn': 'N',
-                          'guesses': 0,
-                          'winner': '',
-                          'orange-hub': False,
-                          'blue-hub': False,
-                          'enough-players': False}
-        self._users = set()
-        self._gameWords = OrbitalsWords(wordCount)
-        self._orbTimer = OrbitalsTimer(turnTimeout)
-        self._players = OrbitalsPlayers()
+    __slots__ = ('_gameInfo', '_topics', '_sectorTopic', '_hubsTopic', '_wordCount', '_turnTimeout', '_gameWords',
+                 '_orbTimer', '_stateCache', '_boardCache', '_timerWheel', '_tickDeadline',
+                 '_players', '_sectorName', '_sectorSymbol', '_log', '_dirty', '_journal',
+                 '_journaledGame', '_journaledPlayers', '_seats')
+
+    def __init__(self, wordCount, turnTimeout, name, symbol, timerWheel, journal=None,
+                 topics=None, directory=None):
+        self._gameInfo = newGameInfo()
+        # audiences: everyone in the sector, and its hubs
+        self._topics = topics if topics is not None else OrbitalsTopics()
+        self._sectorTopic = sectorTopic(name)
+        self._hubsTopic = hubsTopic(name)
+        self._wordCount = wordCount
+        self._turnTimeout = turnTimeout
+        # board, timer and packet caches only exist while the sector is awake
+        self._gameWords = None
+        self._orbTimer = None
+        self._stateCache = None
+        self._boardCache = None
+        self._timerWheel = timerWheel
+        self._tickDeadline = 0
+        # players are the records of the cluster's directory
+        self._players = OrbitalsPlayers(directory)
         self._sectorName = name
         self._sectorSymbol = symbol
+        self._log = or_log.getSectorLogger('sector', name)
+        # set when the lobby details change, cleared once published
+        self._dirty = True
+        # state changes are recorded in the journal, if the cluster keeps one
+        self._journal = journal
+        self._journaledGame = None
+        self._journaledPlayers = None
+        # seats of a game recovered from the journal, by player name,
+        # until the players rejoin or the cluster releases them
+        self._seats = dict()
+
+
+    def wake(self):
+        """ allocates the board, timer and packet caches of an idle sector """
+        if self._gameWords is None:
+            self._gameWords = OrbitalsWords(self._wordCount)
+            self._orbTimer = OrbitalsTimer(self._turnTimeout)
+            self._stateCache = orbComms.OrbitalsStateCache()
+            self._boardCache = orbComms.OrbitalsBoardCache()
+
+    def hibernate(self):
+        """
+        releases the board, timer and packet caches of an empty sector:
+        the next player to join starts from a fresh game
+        """
+        if self._gameWords is not None:
+            self.stopTimer()
+            self.record('reset')
+        self._journaledGame = None
+        self._journaledPlayers = None
+        self._gameWords = None
+        self._orbTimer = None
+        self._stateCache = None
+        self._boardCache = None
+        self._gameInfo = newGameInfo()
+
+    def isHibernating(self):
+        """ Returns True if the sector has released its game state """
+        return self._gameWords is None
+
+    def isPlaying(self):
+        """ Returns True if a game is in progress """
+        return self._gameInfo.isPlaying()
+
+    def isEmpty(self):
+        """ Returns True if nobody is in the sector and no seats are held """
+        return not self._topics.count(self._sectorTopic) and not self._seats
+
+    def isOpen(self):
+        """ Returns True if the teams have room for another player """
+        heldSeats = sum(1 for seat in self._seats.values() if seat['team'] != 'N')
+        return (self._players.getBlueTeamCount()
+                + self._players.getOrangeTeamCount() + heldSeats) < 8
+
+    def getAudience(self):
+        """ Returns the websockets of everyone in the sector """
+        return self._topics.getSubscribers(self._sectorTopic)
+
+    def subscribe(self, player):
+        """ moves a player in or out of the hubs topic, as their role changed """
+        websocket = player.getWebSocket()
+        if player.isHub():
+            self._topics.subscribe(websocket, self._hubsTopic)
+        else:
+            self._topics.unsubscribe(websocket, self._hubsTopic)
+
+    def unsubscribe(self, websocket):
+        """ drops a player who left from the sector's topics """
+        self._topics.unsubscribe(websocket, self._sectorTopic)
+        self._topics.unsubscribe(websocket, self._hubsTopic)
+
+    def getName(self):
+        return self._sectorName
 
+    def isDirty(self):
+        """ Returns True if the lobby details changed since they were published """
+        return self._dirty
+
+    def markDirty(self):
+        self._dirty = True
+
+    def clearDirty(self):
+        self._dirty = False
 
     async def newMessage(self, websocket, data):
         """ handles incoming message from players """
-        if data['type'] == 'name-request':
-            await self.newPlayer(data['name'], websocket)
-        elif data['type'] == 'team-request':
-            await self.teamRequest(websocket, data['team'])
-        elif data['type'] == 'hub-request':
-            await self.hubRequest(websocket)
-        elif data['type'] == 'ready':
-            await self.startRequest(websocket)
-        elif data['type'] == 'message':
-            await self.processMessage(websocket, data['message'])
-        elif data['type'] == 'hint':
-            await self.processHint(websocket, data['hint'], int(data['guesses']))
-        elif data['type'] == 'hint-response':
-            await self.processHintResponse(websocket, data['response'])
-        elif data['type'] == 'guess':
-            await self.processGuess(websocket, data['guess'])
-        elif data['type'] == 'replay':
-            await self.processReplayRequest(websocket)
+        if not await sectorMessages.dispatch(self, websocket, data):
+            rejectMessage(websocket, data['type'], 'unknown message type')
+        self.journalChanges()
+
+    def record(self, event, **fields):
+        """ appends a record to the journal, if there is one """
+        if self._journal is not None:
+            self._journal.record(self._sectorName, event, **fields)
+
+    def journalChanges(self):
+        """
+        records the game info and the roster, if they changed since they
+        were last recorded: called once every event has been handled
+        """
+        if self._journal is None or self._gameWords is None:
+            return
+        game = self._gameInfo.toDict()
+        if game != self._journaledGame:
+            self.record('game', game=game)
+            self._journaledGame = game
+        players = self._players.getPlayerData() + list(self._seats.values())
+        if players != self._journaledPlayers:
+            self.record('players', players=players)
+            self._journaledPlayers = players
+
+    def setJournal(self, journal):
+        """ starts recording state changes in journal """
+        self._journal = journal
+
+    def rejournal(self):
+        """
+        records the sector's whole state again, replacing whatever the
+        journal held for it
+        """
+        self.record('reset')
+        self._journaledGame = None
+        self._journaledPlayers = None
+        if self._gameWords is None:
+            return
+        keywords = self._gameWords.getKeywords()
+        if keywords:
+            self.record('board', keys=keywords, first=self._gameWords.getFirstTurn())
+            for entry in self._gameWords.getWords():
+                if entry['team'] != '-':
+                    self.record('open', word=entry['word'])
+        self.journalChanges()
+
+    def restore(self, state):
+        """
+        brings back a game recovered from the journal:
+        players get their seats back when they rejoin under the same name
+        """
+        self.wake()
+        if state['game']:
+            self._gameInfo = OrbitalsGameInfo.fromDict(state['game'])
+        if state['keys']:
+            self._gameWords.restore(state['keys'], state['opened'], state['first'])
+        self._seats = {seat['name']: seat for seat in state['players']}
+        self.markDirty()
+
+    def releaseSeats(self):
+        """ gives up the seats of the players who did not come back """
+        if self._seats:
+            self._log.info("Releasing %d seats", len(self._seats))
+            self._seats = dict()
+            self.markDirty()
+            self.journalChanges()
+
+    def startTimer(self, seconds=None, delay=0):
+        """
+        starts the turn timer and arms the sector's deadline in the
+        cluster's timer wheel, replacing any countdown already running
+        """
+        self._log.debug("Starting countdown")
+        self._orbTimer.start(seconds)
+        self._tickDeadline = self._timerWheel.now() + delay + 1
+        self._timerWheel.schedule(self, self._tickDeadline, self.countdown)
+        orbComms.publishClock(self.getDeadline(), self._orbTimer.getTime(),
+                              self.getAudience())
+
+    def stopTimer(self):
+        """ stops the turn timer and drops the sector's deadline """
+        running = self._timerWheel.pending(self)
+        self._orbTimer.stop()
+        self._timerWheel.cancel(self)
+        if running:
+            orbComms.publishClock(None, 0, self.getAudience())
+
+    def getDeadline(self):
+        """
+        Returns the wall clock time the running turn times out at:
+        the last tick is due time remaining - 1 seconds after the next one
+        """
+        remaining = self._tickDeadline + self._orbTimer.getTime() - 1 - self._timerWheel.now()
+        return round(time.time() + remaining, 3)
 
     async def countdown(self):
-        """ limits turns to a set amount of time """
-        print("Starting countdown")
-        while self._orbTimer.getTime() > 0:
-            await asyncio.sleep(1)
+        """
+        limits turns to a set amount of time:
+        called by the timer wheel once per second while the timer runs,
+        a tick is an event of its own: its packets go out as one batch
+        """
+        with orbComms.batched():
             self._orbTimer.tick()
-            await orbComms.publishTime(self._orbTimer.getTime(), self._players.getPlayers())
+            await orbComms.publishTime(self._orbTimer.getTime(), self.getAudience())
             if self._orbTimer.getTime() == 0 and self._orbTimer.isActive():
                 # timeout!
+                _timeouts.inc(self._sectorName)
                 self._orbTimer.stop()
-                self.timeout()
-                await orbComms.publishState(self._gameInfo, players=self._players.getPlayers())
-                print(
-                    f"After the timeout, it's team {self._gameInfo['turn']}'s turn")
-                state = self._gameInfo['state']
-                if state == 'hint-submission' or state == 'guess-submission':
-                    print("Restarting timer")
-                    self._orbTimer.start()
-        return True
+                try:
+                    changed = self.transition('timeout')
+                except OrbitalsRejection as rejection:
+                    self._log.debug("Timeout ignored: %s", rejection)
+                    return
+                await self.publishTransition(changed)
+                self._log.info("Turn timed out, it's team %s's turn",
+                               teamLabels[self._gameInfo.turn])
+                state = self._gameInfo.state
+                if state == GameState.HINT_SUBMISSION or state == GameState.GUESS_SUBMISSION:
+                    self._log.debug("Restarting timer")
+                    self.startTimer()
+                self.journalChanges()
+            elif self._orbTimer.getTime() > 0:
+                # next second, measured from the previous deadline so ticks don't drift
+                self._tickDeadline += 1
+                self._timerWheel.schedule(self, self._tickDeadline, self.countdown)
 
     async def deleteConnection(self, websocket):
         """
@@ -86,251 +312,190 @@ class OrbitalsSector:
         - change state to 'waiting-players'
         - stop timer
         """
-        self._users.remove(websocket)
+        self._stateCache.forget(websocket)
         player = self._players.playerId(websocket)
        
         messageDict = {'msg': '[LEFT THE SECTOR]', 'msgSender': player.getName(),
-                           'msgTeam': player.getTeam()}
+                           'msgTeam': teamLabels[player.getTeam()]}
         
-        if not self._players.removePlayer(websocket):
-            self._gameInfo['state'] = 'waiting-players'
-            self._orbTimer.stop()
-
-        self._gameInfo['blue-hub'] = self._players.haveBlueHub()
-        self._gameInfo['orange-hub'] = self._players.haveOrangeHub()
-        print(f"gameInfo: {self._gameInfo}")
+        if player.getTeam() != Team.N:
+            self.markDirty()
+        changed = self.transition('leave', websocket)
         
-        await orbComms.publishMessage(messageDict, self._players.getPlayers())
+        await orbComms.publishMessage(messageDict, self.getAudience())
         await orbComms.publishPlayers(self._players.getPlayerData(),
-                                      self._players.enoughPlayers(), self._users)
-        await orbComms.publishState(self._gameInfo, self._players.getPlayers())
+                                      self._players.enoughPlayers(), self.getAudience())
+        await self.publishTransition(changed)
+        self.journalChanges()
+
+    def replaceConnection(self, oldWebsocket, websocket):
+        """ hands a resumed player's place over to their new connection """
+        self._stateCache.forget(oldWebsocket)
+        self._players.replaceWebSocket(oldWebsocket, websocket)
 
     async def newPlayer(self, name, websocket):
         """ tries to register a new player in sector """
-        self._users.add(websocket)
+        self.wake()
+        self._topics.subscribe(websocket, self._sectorTopic)
         self._players.addPlayer(name, websocket)
+        seat = self._seats.pop(name, None)
+        if seat:
+            # back in a game recovered from the journal
+            self._players.joinTeam(websocket, teamFromLabel(seat['team']))
+            if seat['hub']:
+                self._players.requestHub(websocket)
+            self.subscribe(self._players.playerId(websocket))
 
         sectorPacket = {'type': 'response',
                         'msg': 'joined-sector',
                         'sector': self._sectorName}
-        msg = json.dumps(sectorPacket)
-        await websocket.send(msg)
+        orbComms.send(websocket, sectorPacket)
         # issue state
         playerId = self._players.playerId(websocket)
 
-        gameState = self._gameInfo['state']
-        await orbComms.publishState(self._gameInfo, [playerId])
+        gameState = self._gameInfo.state
+        await orbComms.publishState(self._gameInfo, [playerId],
+                                    self._stateCache)
 
         player = self._players.playerId(websocket)
         await orbComms.publishPlayers(self._players.getPlayerData(),
-                                      self._players.enoughPlayers(), self._users)
+                                      self._players.enoughPlayers(), self.getAudience())
         messageDict = {'msg': '[JOINED THE SECTOR]', 'msgSender': player.getName(),
-                       'msgTeam': player.getTeam()}
-        await orbComms.publishMessage(messageDict, self._players.getPlayers())
+                       'msgTeam': teamLabels[player.getTeam()]}
+        await orbComms.publishMessage(messageDict, self.getAudience())
 
         # has the game started  already?
-        if (gameState == 'hint-submission' or gameState == 'hint-response'
-           or gameState == 'guess-submission' or gameState == 'game-start'):
-            # Send word info
-            packet = {'type': 'words', 'words': self._gameWords.getWords()}
-            msg = json.dumps(packet)
-            await websocket.send(msg)        
+        if (gameState == GameState.HINT_SUBMISSION or gameState == GameState.HINT_RESPONSE
+           or gameState == GameState.GUESS_SUBMISSION or gameState == GameState.GAME_START):
+            # Send word info, and the keys to a hub back in a recovered game
+            orbComms.send(websocket, self._boardCache.getWordsMessage(self._gameWords))
+            if player.isHub():
+                orbComms.send(websocket, self._boardCache.getKeysMessage(self._gameWords))
+            if (gameState != GameState.HINT_RESPONSE and not self._timerWheel.pending(self)
+                    and self._players.enoughPlayers()):
+                # a recovered game has its players back: resume the turn timer
+                self.startTimer()
+            elif self._timerWheel.pending(self):
+                orbComms.publishClock(self.getDeadline(), self._orbTimer.getTime(), [websocket])
+        self.journalChanges()
 
         
+    @sectorMessages.handles('team-request', ('team', text))
     async def teamRequest(self, websocket, team):
         """ assigns player to requested team """
         player = self._players.playerId(websocket)
-        current_state = self._gameInfo['state']
-
-        if current_state == 'waiting-players' or current_state == 'waiting-start' or current_state == 'game-over':
-            if player.getTeam() is not team:
-                success, response = self._players.joinTeam(websocket, team)
-                if success:
-                    packet = {'type': 'response', 'msg': response, "team": team}
-                    msg = json.dumps(packet)
-                    await websocket.send(msg)
-                    self._gameInfo['orange-hub'] = self._players.haveOrangeHub()
-                    self._gameInfo['blue-hub'] = self._players.haveBlueHub()
-                    if self._players.enoughPlayers():
-                        if self._gameInfo['state'] == 'waiting-players':
-                            self._gameInfo['state'] = 'waiting-start'
-                    else:
-                        self._gameInfo['state'] = 'waiting-players'
-                    await orbComms.publishState(self._gameInfo, self._players.getPlayers())
-                    await orbComms.publishPlayers(self._players.getPlayerData(),
-                                                  self._players.enoughPlayers(), self._users)
-                    teamString = 'N'
-                    if player.getTeam() == 'O':
-                        teamString = 'ORANGE'
-                    elif player.getTeam() == 'B':
-                        teamString = 'BLUE'
-                    messageDict = {'msg': f'[JOINED TEAM {teamString}]', 'msgSender': player.getName(),
-                                   'msgTeam': player.getTeam()}
-                    await orbComms.publishMessage(messageDict, self._players.getPlayers())
-
-                    if self._gameInfo['state'] == 'game-over':
-                        self._players.requestReplay(websocket)
-
-                else:
-                    packet = {'type': 'response', 'msg': 'team-rejected', "reason": response}
-                    msg = json.dumps(packet)
-                    await websocket.send(msg)
-
+        try:
+            changed = self.transition('team', websocket, teamFromLabel(team))
+        except OrbitalsRejection as rejection:
+            packet = {'type': 'response', 'msg': 'team-rejected', "reason": str(rejection)}
+            orbComms.send(websocket, packet)
+            return
+        self.markDirty()
+        packet = {'type': 'response', 'msg': 'team-accepted', "team": team}
+        orbComms.send(websocket, packet)
+        await self.publishTransition(changed, player)
+        await orbComms.publishPlayers(self._players.getPlayerData(),
+                                      self._players.enoughPlayers(), self.getAudience())
+        teamString = 'N'
+        if player.getTeam() == Team.O:
+            teamString = 'ORANGE'
+        elif player.getTeam() == Team.B:
+            teamString = 'BLUE'
+        messageDict = {'msg': f'[JOINED TEAM {teamString}]', 'msgSender': player.getName(),
+                       'msgTeam': teamLabels[player.getTeam()]}
+        await orbComms.publishMessage(messageDict, self.getAudience())
+
+    @sectorMessages.handles('hub-request')
     async def hubRequest(self, websocket):
         """
         tries to assign hub role to player
         """
-        success, response = self._players.requestHub(websocket)
-        team = self._players.playerId(websocket).getTeam()
-        if success:
-            player = self._players.playerId(websocket)
-            packet = {'type': 'response', 'msg': response, 'team': team}
-            msg = json.dumps(packet)
-            await websocket.send(msg)
-            self._gameInfo['orange-hub'] = self._players.haveOrangeHub()
-            self._gameInfo['blue-hub'] = self._players.haveBlueHub()
-            if self._players.enoughPlayers():
-                if self._gameInfo['state'] == 'waiting-players':
-                    self._gameInfo['state'] = 'waiting-start'
-            else:
-                self._gameInfo['state'] = 'waiting-players'
-            await orbComms.publishPlayers(self._players.getPlayerData(),
-                                          self._players.enoughPlayers(), self._users)
-            await orbComms.publishState(self._gameInfo, self._players.getPlayers())
-            messageDict = {'msg': f'[ROLE CHANGED]', 'msgSender': player.getName(),
-                           'msgTeam': player.getTeam()}
-            await orbComms.publishMessage(messageDict, self._players.getPlayers())
-        else:
-            packet = {'type': 'response', 'msg': 'hub-rejected', 'reason': response}
-            msg = json.dumps(packet)
-            await websocket.send(msg)
+        player = self._players.playerId(websocket)
+        try:
+            changed = self.transition('hub', websocket)
+        except OrbitalsRejection as rejection:
+            packet = {'type': 'response', 'msg': 'hub-rejected', 'reason': str(rejection)}
+            orbComms.send(websocket, packet)
+            return
+        self.markDirty()
+        packet = {'type': 'response', 'msg': 'hub-on' if player.isHub() else 'hub-off',
+                  'team': teamLabels[player.getTeam()]}
+        orbComms.send(websocket, packet)
+        await orbComms.publishPlayers(self._players.getPlayerData(),
+                                      self._players.enoughPlayers(), self.getAudience())
+        await self.publishTransition(changed, player)
+        messageDict = {'msg': f'[ROLE CHANGED]', 'msgSender': player.getName(),
+                       'msgTeam': teamLabels[player.getTeam()]}
+        await orbComms.publishMessage(messageDict, self.getAudience())
 
+    @sectorMessages.handles('ready')
     async def startRequest(self, websocket):
         """
         sets the team to "ready" status
         """
-        if self._players.requestStart(websocket):
-            self._gameInfo['state'] = 'game-start'
-            self.clearBoard()
-            self.setupBoard()
-
-        packet = {'type': 'response', 'msg': "start-accepted"}
-        msg = json.dumps(packet)
-        await websocket.send(msg)
+        changed = self.transition('ready', websocket)
+        orbComms.send(websocket, orbComms.startAcceptedMsg)
 
         await orbComms.publishPlayers(self._players.getPlayerData(),
-                                      self._players.enoughPlayers(), self._users)
-        await orbComms.publishState(self._gameInfo, self._players.getPlayers())
+                                      self._players.enoughPlayers(), self.getAudience())
+        await self.publishTransition(changed, self._players.playerId(websocket))
 
-        if self._gameInfo['state'] == 'game-start':
+        if self._gameInfo.state == GameState.GAME_START:
             await self.startNewGame()
 
+    @sectorMessages.handles('hint', ('hint', text), ('guesses', positive))
     async def processHint(self, websocket, hint, count):
         """ hint is published and sent for aproval """
+        changed = self.transition('hint', websocket, hint, count)
         # stop countdown
-        self._orbTimer.stop()
-
-        player = self._players.playerId(websocket)
-        if player.getTeam() == self._gameInfo['turn'] and player.isHub():
-            # Limit guess count to 4
-            if count > 4:
-                count = 4
-            # Limit guess count to the amount of words left
-            wordsLeft = self._gameWords.wordsLeft(self._gameInfo['turn'])
-            if count > wordsLeft:
-                count = wordsLeft
-
-            self._gameInfo['guesses'] = count
-            self._gameInfo['state'] = 'hint-response'
-            self._gameInfo['hint']['hintWord'] = hint
-            self._gameInfo['hint']['count'] = count
-            self._gameInfo['hint']['sender'] = self._players.playerName(
-                websocket)
-            self._gameInfo['hint']['team'] = self._gameInfo['turn']
-
-            print(f"Team {self._gameInfo['turn']} has submitted hint '{hint}',"
-                  f" guesses: {count}.")
-            await orbComms.publishState(self._gameInfo, self._players.getPlayers())
-        else:
-            name = player.getName()
-            print(f"{name} is not allowed to submit hints at this point.")
+        self.stopTimer()
+        self._log.info("Team %s has submitted hint '%s', guesses: %d",
+                       teamLabels[self._gameInfo.turn], hint, self._gameInfo.hintCount)
+        await self.publishTransition(changed)
 
+    @sectorMessages.handles('hint-response', ('response', flag))
     async def processHintResponse(self, websocket, response):
         """ process hint approval / rejection """
-        # respond to hint:
-        player = self._players.playerId(websocket)
-        if player.getTeam() != self._gameInfo['turn'] and player.isHub():
-            if response:
-                self._gameInfo['state'] = 'guess-submission'
-                print(f"Hint has been approved.")
-            else:
-                self._gameInfo['state'] = 'hint-submission'
-                print(f"Hint has been rejected.")
-                messageDict = {'msg': '[HINT REJECTED]', 'msgSender': player.getName(),
-                               'msgTeam': player.getTeam()}
-                await orbComms.publishMessage(messageDict, self._players.getPlayers())
-
-            await orbComms.publishState(self._gameInfo, self._players.getPlayers())
-            # restart timer
-            self._orbTimer.start()
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.countdown())
-
+        changed = self.transition('hint-response', websocket, response)
+        if response:
+            self._log.info("Hint has been approved")
         else:
-            name = self._players.playerName(websocket)
-            print(f"{name} is not allowed to respond to hints at this point.")
+            self._log.info("Hint has been rejected")
+            player = self._players.playerId(websocket)
+            messageDict = {'msg': '[HINT REJECTED]', 'msgSender': player.getName(),
+                           'msgTeam': teamLabels[player.getTeam()]}
+            await orbComms.publishMessage(messageDict, self.getAudience())
 
+        await self.publishTransition(changed)
+        # restart timer
+        self.startTimer()
+
+    @sectorMessages.handles('guess', ('guess', text))
     async def processGuess(self, websocket, guess):
         """ publishes guess from non-hub players """
-        # need to check that the right team is submitting guesses!
         player = self._players.playerId(websocket)
-        currentTurn = self._gameInfo['turn']
-        # is the guesser in the right team and not a hub?
-        if player.getTeam() == currentTurn and not player.isHub():
-            # update words
-            response = self._gameWords.newGuess(guess, currentTurn)
-            print(response)
-        # TODO: response for people submitting guesses when they shouldn't
-        else:
-            return
-
-        # has this word been guessed before?
-        if response["newGuess"]:
-            # game over?
-            if response["gameOver"]:
-                print(f"{response['winner']} team wins.")
-                self._gameInfo['guesses'] = 0
-                self._gameInfo['winner'] = response["winner"]
-                self._gameInfo['state'] = 'game-over'
-
-            else:
-                self._gameInfo['guesses'] -= 1
-                if response["switch"]:
-                    self._gameInfo['guesses'] = 0
-
-                if not self._gameInfo['guesses']:
-                    print("Switching teams")
-                    self._gameInfo['state'] = 'hint-submission'
-                    self.switchTurns()
-
-            guessDict = {'word': guess,
-                         'wordTeam': self._gameWords.getTeam(guess),
-                         'guesser': player.getName(),
-                         'guesserTeam': player.getTeam(),
-                         'guessesLeft': self._gameInfo['guesses']}
-            print(f"Guesses left: {self._gameInfo['guesses']}")
-            await orbComms.publishGuess(guessDict, self._players.getPlayers())
-
-            if self._gameInfo['guesses'] == 0:
-                self._orbTimer.stop()
-                await orbComms.publishState(self._gameInfo, self._players.getPlayers())
-                await asyncio.sleep(1)
-            if self._gameInfo['state'] == 'hint-submission':
-                # restart timer
-                self._orbTimer.start()
-                loop = asyncio.get_event_loop()
-                loop.create_task(self.countdown())
-
+        guesserTeam = teamLabels[player.getTeam()]
+        changed = self.transition('guess', websocket, guess)
+
+        guessDict = {'word': guess,
+                     'wordTeam': self._gameWords.getTeam(guess),
+                     'guesser': player.getName(),
+                     'guesserTeam': guesserTeam,
+                     'guessesLeft': self._gameInfo.guesses,
+                     'version': self._gameWords.getVersion()}
+        self._log.debug("Guesses left: %d", self._gameInfo.guesses)
+        await orbComms.publishGuess(guessDict, self.getAudience())
+
+        # the guess packet carries the guesses left: the state only goes
+        # out once the turn is over
+        if 'state' in changed:
+            self.stopTimer()
+            await self.publishTransition(changed)
+        if self._gameInfo.state == GameState.HINT_SUBMISSION:
+            # restart timer after a one second pause
+            self.startTimer(delay=1)
+
+    @sectorMessages.handles('message', ('message', text))
     async def processMessage(self, websocket, message):
         """
         Handles requests to publish messages
@@ -340,32 +505,228 @@ class OrbitalsSector:
         - only non-hub players can send messages
         """
         player = self._players.playerId(websocket)
-        state = self._gameInfo['state']
+        state = self._gameInfo.state
         if player:
-            if not player.isHub() or state == 'waiting-players' or state == 'waiting-start' or state == 'game-over':
+            if not player.isHub() or state == GameState.WAITING_PLAYERS or state == GameState.WAITING_START or state == GameState.GAME_OVER:
                 messageDict = {'msg': message, 'msgSender': player.getName(),
-                               'msgTeam': player.getTeam()}
-                await orbComms.publishMessage(messageDict, self._players.getPlayers())
+                               'msgTeam': teamLabels[player.getTeam()]}
+                await orbComms.publishMessage(messageDict, self.getAudience())
+
+    @sectorMessages.handles('sync', ('version', integer))
+    async def processSync(self, websocket, version):
+        """
+        brings a player's board up to date from the version they hold:
+        the words opened since, or the whole board if that version is
+        not one of the current board's
+        """
+        opened = self._gameWords.openedSince(version)
+        if opened is None:
+            orbComms.send(websocket, self._boardCache.getWordsMessage(self._gameWords))
+            return
+        packet = {'type': 'board-diff', 'from': version,
+                  'version': self._gameWords.getVersion(),
+                  'opened': [dict(entry) for entry in opened]}
+        orbComms.send(websocket, packet)
 
+    @sectorMessages.handles('replay')
     async def processReplayRequest(self, websocket):
         """ captures all players' signal to start another game """
+        changed = self.transition('replay', websocket)
+        orbComms.send(websocket, orbComms.replayAckMsg)
+        await self.publishTransition(changed, self._players.playerId(websocket))
+
+    def transition(self, event, *args):
+        """
+        Applies an event to the game: raises OrbitalsRejection if the
+        current state does not allow it or its guard turns it down,
+        otherwise returns the names of the game info fields it changed
+        """
+        state = self._gameInfo.state
+        try:
+            guard, apply = gameTransitions[state][event]
+        except KeyError:
+            raise OrbitalsRejection(f'not allowed during {stateLabels[state]}') from None
+        if guard is not None:
+            reason = getattr(self, guard)(*args)
+            if reason is not None:
+                raise OrbitalsRejection(reason)
+        snapshot = self._gameInfo.snapshot()
+        getattr(self, apply)(*args)
+        changed = self._gameInfo.changedSince(snapshot)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("%s: %s changed", event, ', '.join(sorted(changed)) or 'nothing')
+        return changed
+
+    async def publishTransition(self, changed, player=None):
+        """
+        publishes the game state after a transition: to every player if
+        the game info changed, otherwise only to the player whose own
+        role or flags did, if any
+        """
+        if changed:
+            await orbComms.publishState(self._gameInfo, self._players.getPlayers(),
+                                        self._stateCache)
+        elif player is not None:
+            await orbComms.publishState(self._gameInfo, [player], self._stateCache)
+
+    def updateRoster(self):
+        """ brings the hubs and the waiting states in line with the roster """
+        self._gameInfo.orangeHub = self._players.haveOrangeHub()
+        self._gameInfo.blueHub = self._players.haveBlueHub()
+        if self._players.enoughPlayers():
+            if self._gameInfo.state == GameState.WAITING_PLAYERS:
+                self._gameInfo.state = GameState.WAITING_START
+        else:
+            self._gameInfo.state = GameState.WAITING_PLAYERS
+
+    def checkTeam(self, websocket, team):
+        player = self._players.playerId(websocket)
+        if team == Team.N:
+            return 'not a team'
+        if player.getTeam() == team:
+            return 'already in that team'
+        return None
+
+    def changeTeam(self, websocket, team):
+        """ moves a player to another team, as a guesser who wants a replay after a game """
+        success, response = self._players.joinTeam(websocket, team)
+        if not success:
+            raise OrbitalsRejection(response)
+        if self._gameInfo.state == GameState.GAME_OVER and self._players.requestReplay(websocket):
+            self._gameInfo.state = GameState.WAITING_START
+        self.subscribe(self._players.playerId(websocket))
+        self.updateRoster()
+
+    def checkHub(self, websocket):
+        player = self._players.playerId(websocket)
+        if player.getTeam() == Team.N:
+            return 'join a team first'
+        if not player.isHub() and not self._players.hubAvailable(player.getTeam()):
+            return 'Hub role not available'
+        return None
+
+    def toggleHub(self, websocket):
+        self._players.requestHub(websocket)
+        self.subscribe(self._players.playerId(websocket))
+        self.updateRoster()
+
+    def dropPlayer(self, websocket):
+        """ removes a player: with too few left, the game waits for players again """
+        self.unsubscribe(websocket)
+        if not self._players.removePlayer(websocket):
+            self._gameInfo.state = GameState.WAITING_PLAYERS
+            self.stopTimer()
+        self._gameInfo.blueHub = self._players.haveBlueHub()
+        self._gameInfo.orangeHub = self._players.haveOrangeHub()
+
+    def checkReady(self, websocket):
+        player = self._players.playerId(websocket)
+        if not player.isHub():
+            return 'only hubs can start the game'
+        if player.isReady():
+            return 'already ready'
+        return None
+
+    def readyHub(self, websocket):
+        """ marks a hub ready: once both are, the game starts on a new board """
+        if self._players.requestStart(websocket):
+            self._gameInfo.state = GameState.GAME_START
+            self.clearBoard()
+            self.setupBoard()
+
+    def checkHint(self, websocket, hint, count):
+        player = self._players.playerId(websocket)
+        if player.getTeam() != self._gameInfo.turn or not player.isHub():
+            return 'only the hub of the team in turn can give hints'
+        return None
+
+    def giveHint(self, websocket, hint, count):
+        """ records a hint and sends it to the other hub for approval """
+        # Limit guess count to 4
+        if count > 4:
+            count = 4
+        # Limit guess count to the amount of words left
+        wordsLeft = self._gameWords.wordsLeft(teamLabels[self._gameInfo.turn])
+        if count > wordsLeft:
+            count = wordsLeft
+
+        self._gameInfo.guesses = count
+        self._gameInfo.state = GameState.HINT_RESPONSE
+        self._gameInfo.hintWord = hint
+        self._gameInfo.hintCount = count
+        self._gameInfo.hintSender = self._players.playerName(websocket)
+        self._gameInfo.hintTeam = self._gameInfo.turn
+
+    def checkHintResponse(self, websocket, response):
+        player = self._players.playerId(websocket)
+        if player.getTeam() == self._gameInfo.turn or not player.isHub():
+            return 'only the hub of the other team can answer hints'
+        return None
+
+    def answerHint(self, websocket, response):
+        """ an approved hint opens the guesses, a rejected one asks for another """
+        if response:
+            self._gameInfo.state = GameState.GUESS_SUBMISSION
+        else:
+            self._gameInfo.state = GameState.HINT_SUBMISSION
+
+    def checkGuess(self, websocket, guess):
+        if not self._gameWords.hasWord(guess):
+            return 'not a word on the board'
+        player = self._players.playerId(websocket)
+        # is the guesser in the right team and not a hub?
+        if player.getTeam() != self._gameInfo.turn or player.isHub():
+            return 'only guessers of the team in turn can guess'
+        if self._gameWords.isOpened(guess):
+            return 'word already guessed'
+        return None
+
+    def openWord(self, websocket, guess):
+        """ opens a guessed word: the turn ends on a miss or the last guess """
+        currentTurn = self._gameInfo.turn
+        response = self._gameWords.newGuess(guess, teamLabels[currentTurn])
+        self._log.debug("Guess '%s': %s", guess, response)
+        self.record('open', word=guess)
+        # game over?
+        if response["gameOver"]:
+            self._log.info("%s team wins", response['winner'])
+            _gamesFinished.inc(self._sectorName, response['winner'])
+            self._gameInfo.guesses = 0
+            self._gameInfo.winner = teamFromLabel(response["winner"])
+            self._gameInfo.state = GameState.GAME_OVER
 
-        packet = {'type': 'replay-ack'}
-        msg = json.dumps(packet)
-        await websocket.send(msg)
+        else:
+            self._gameInfo.guesses -= 1
+            if response["switch"]:
+                self._gameInfo.guesses = 0
+
+            if not self._gameInfo.guesses:
+                self._log.debug("Switching teams")
+                self._gameInfo.state = GameState.HINT_SUBMISSION
+                self.switchTurns()
+
+    def checkReplay(self, websocket):
+        player = self._players.playerId(websocket)
+        if player.getTeam() == Team.N:
+            return 'join a team first'
+        if player.wantsReplay():
+            return 'already asked for a replay'
+        return None
+
+    def requestReplay(self, websocket):
+        """ once every player in a team has asked for a replay, a new game can start """
         if self._players.requestReplay(websocket):
-            self._gameInfo['state'] = 'waiting-start'
-            await orbComms.publishState(self._gameInfo, self._players.getPlayers())
+            self._gameInfo.state = GameState.WAITING_START
 
     async def startNewGame(self):
         """ publishes words and starts the counter for the first turn """
-        await orbComms.publishWords(self._gameWords.getWords(),
-                                    self._gameWords.getKeywords(),
-                                    self._players.getPlayers())
-        self._orbTimer.start(5)
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.countdown())
-        print(f"{self._gameInfo['turn']} team goes first")
+        await orbComms.publishWords(self._boardCache.getWordsMessage(self._gameWords),
+                                    self._boardCache.getKeysMessage(self._gameWords),
+                                    self.getAudience(),
+                                    self._topics.getSubscribers(self._hubsTopic))
+        self.startTimer(5)
+        self._log.info("%s team goes first", teamLabels[self._gameInfo.turn])
+        _gamesStarted.inc(self._sectorName)
 
     def clearBoard(self):
         """
@@ -376,42 +737,41 @@ class OrbitalsSector:
         - words remaining by either team are cleared
         - guesses left are cleared
         """
-        self._gameInfo['hint']['hintWord'] = ''
-        self._gameInfo['hint']['count'] = 0
-        self._gameInfo['hint']['sender'] = ''
-        self._gameInfo['hint']['team'] = ''
-        self._gameInfo['turn'] = ''
-        self._gameInfo['guesses'] = 0
-        self._gameInfo['winner'] = ''
+        self._gameInfo.clearHint()
+        self._gameInfo.turn = Team.N
+        self._gameInfo.guesses = 0
+        self._gameInfo.winner = Team.N
         self._gameWords.reset()
 
     def switchTurns(self):
         """ Toggles _currentTurn between teams """
-        if self._gameInfo['turn'] == 'B':
-            self._gameInfo['turn'] = 'O'
+        if self._gameInfo.turn == Team.B:
+            self._gameInfo.turn = Team.O
         else:
-            self._gameInfo['turn'] = 'B'
+            self._gameInfo.turn = Team.B
 
     def timeout(self):
         """ Changes states after the time runs out """
-        if self._gameInfo['state'] == 'game-start':
-            self._gameInfo['state'] = 'hint-submission'
-        elif self._gameInfo['state'] == 'hint-submission':
+        if self._gameInfo.state == GameState.GAME_START:
+            self._gameInfo.state = GameState.HINT_SUBMISSION
+        elif self._gameInfo.state == GameState.HINT_SUBMISSION:
             self.switchTurns()
-        elif self._gameInfo['state'] == 'guess-submission':
-            self._gameInfo['state'] = 'hint-submission'
+        elif self._gameInfo.state == GameState.GUESS_SUBMISSION:
+            self._gameInfo.state = GameState.HINT_SUBMISSION
             self.switchTurns()
 
     def setupBoard(self):
         """ Shuffles the deck and assigns keywords """
         self._gameWords.shuffleDeck()
         self._gameWords.assignKeys()
-        self._gameInfo['turn'] = self._gameWords.getFirstTurn()
+        self._gameInfo.turn = teamFromLabel(self._gameWords.getFirstTurn())
+        self.record('board', keys=self._gameWords.getKeywords(),
+                    first=self._gameWords.getFirstTurn())
 
     def startSimulation(self):
         """ Utility function for development """
         self._gameWords.setSimulationWords()
-        self._gameInfo['turn'] = 'O'
+        self._gameInfo.turn = Team.O
 
     def getSectorDetails(self):
         # return player count for both teams and sector name
@@ -430,8 +790,5 @@ class OrbitalsSector:
             blueOrbitals -= 1
         sectorDetails['orangeOrbitals'] = orangeOrbitals
         sectorDetails['blueOrbitals'] = blueOrbitals
-        if (self._players.getBlueTeamCount() + self._players.getOrangeTeamCount()) < 8:
-            sectorDetails['open'] = True
-        else:
-            sectorDetails['open'] = False
+        sectorDetails['open'] = self.isOpen()
         return sectorDetails
\ No newline at end of file
@@ -3,63 +3,134 @@ Orbitals WebSockets Server
 """
 import argparse
 import functools
-from pprint import pprint
 import asyncio
-import json
+import signal
 import ssl
 import websockets
+import or_codec
+import or_comms as orbComms
+import or_dispatch
+import or_journal
+import or_log
+import or_metrics
+import or_shard
 from or_cluster import OrbitalsCluster
 
-orCluster = OrbitalsCluster(sectorCount=8)
+log = or_log.getLogger('server')
+
+
+class OrbitalsServerProtocol(websockets.WebSocketServerProtocol):
+    """
+    Offers permessage-deflate to JSON clients only: binary frames are
+    deflated per packet type by or_codec, deflating them again is wasted work
+    """
+    def process_extensions(self, headers, available_extensions):
+        subprotocol = self.process_subprotocol(headers, self.available_subprotocols)
+        if subprotocol == or_codec.msgpackSubprotocol:
+            available_extensions = None
+        return super().process_extensions(headers, available_extensions)
 
 def main(args):
     """ starts the game loop """
-    print("State set to 'waiting-players'")
-    print("Initialized sectors:")
-    print("Sectors:")
-    pprint(orCluster.getClusterStatus())
+    logListener = or_log.setupLogging(args.verbose)
+    orbComms.setSendBudget(args.send_budget, args.send_grace)
+    journal = None
+    if args.workers > 1:
+        log.info("Starting %d worker processes", args.workers)
+        orCluster = or_shard.startWorkers(args.workers, args.sectors,
+                                          args.idle_grace, handler, args.verbose,
+                                          args.journal, args.resume_grace,
+                                          args.drain_timeout)
+    else:
+        if args.journal:
+            journal = or_journal.OrbitalsJournal(args.journal)
+        orCluster = OrbitalsCluster(sectorCount=args.sectors,
+                                    idleGrace=args.idle_grace,
+                                    journal=journal,
+                                    resumeGrace=args.resume_grace)
+        log.info("Initialized %d sectors", len(orCluster.getClusterStatus()))
+        log.debug("Sectors: %s", orCluster.getClusterStatus())
 
     port = args.port
-    print(f"Opening websocket server on port {port}...")
-    
-    bound_handler = functools.partial(handler)
+    log.info("Opening websocket server on port %d", port)
+
+    bound_handler = functools.partial(handler, cluster=orCluster)
     # Set up async routines
     loop = asyncio.get_event_loop()
 
+    ssl_context = None
     if args.secure:
         chainFileName = args.secure[0]
         keyFileName = args.secure[1]
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ssl_context.load_cert_chain(chainFileName, keyFileName)
-        start_server = websockets.serve(bound_handler, '0.0.0.0', port, ssl=ssl_context)
-        try:
-            loop.run_until_complete(start_server)
-            loop.run_forever()
-        finally:
-            loop.close()
-    else:
-        start_server = websockets.serve(bound_handler, '0.0.0.0', port)
-        try:
-            loop.run_until_complete(start_server)
-            loop.run_forever()
-        finally:
-            loop.close()
 
-async def handle_message(websocket, data):
+    start_server = websockets.serve(bound_handler, '0.0.0.0', port, ssl=ssl_context,
+                                    subprotocols=or_codec.getSubprotocols(),
+                                    process_request=or_metrics.processRequest,
+                                    reuse_port=args.reuse_port,
+                                    create_protocol=OrbitalsServerProtocol)
+    try:
+        server = loop.run_until_complete(start_server)
+        loop.add_signal_handler(signal.SIGTERM, functools.partial(
+            startDrain, loop, server, orCluster, args.drain_timeout))
+        loop.run_forever()
+    finally:
+        loop.close()
+        if journal:
+            journal.close()
+        logListener.stop()
+
+def startDrain(loop, server, cluster, timeout):
+    """ SIGTERM: drains the server, a second SIGTERM exits straight away """
+    loop.remove_signal_handler(signal.SIGTERM)
+    loop.create_task(drain(loop, server, cluster, timeout))
+
+async def drain(loop, server, cluster, timeout):
+    """
+    stops accepting connections, leaving the open ones be, lets the
+    games in progress finish and stops the loop once clients were told
+    to reconnect
+    """
+    log.info("Draining for up to %d seconds", timeout)
+    server.server.close()
+    await cluster.drain(timeout)
+    server.close()
+    await server.wait_closed()
+    cluster.getTimerWheel().stop()
+    await orbComms.flush()
+    # let the wheel's coroutine wind down before the loop stops
+    await asyncio.sleep(0)
+    log.info("Drained")
+    loop.stop()
+
+async def handle_message(cluster, websocket, data):
     """ handles incoming message from players """
-    await orCluster.newMessage(websocket, data)
+    await cluster.newMessage(websocket, data)
 
-async def handler(websocket, _):
+async def handler(websocket, _, cluster):
     """ register(websocket) sends user_event() to websocket """
-    await orCluster.newConnection(websocket)
+    codec = or_codec.forSubprotocol(websocket.subprotocol)
+    orbComms.setCodec(websocket, codec)
+    with orbComms.batched():
+        await cluster.newConnection(websocket)
     try:
         async for message in websocket:
-            data = json.loads(message)
-            print(data)
-            await handle_message(websocket, data)
+            if await cluster.relayFrame(websocket, message):
+                continue
+            try:
+                data = or_dispatch.decodeMessage(codec, message)
+            except or_dispatch.OrbitalsRejection as rejection:
+                or_dispatch.rejectMessage(websocket, None, str(rejection))
+                continue
+            log.debug("Received %s", data)
+            # everything sent while handling one message goes out together
+            with orbComms.batched():
+                await handle_message(cluster, websocket, data)
     finally:
         # pass
-        await orCluster.deleteConnection(websocket)
+        with orbComms.batched():
+            await cluster.deleteConnection(websocket)
 
 if __name__ == "__main__":
     # program entry point
@@ -73,8 +144,41 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--secure",
                         help="use secure websockets: [full-chain] [private-key]",
                         nargs=2)
+    parser.add_argument("--sectors",
+                        help="minimum number of sectors kept open",
+                        type=int,
+                        default=8)
+    parser.add_argument("--idle-grace",
+                        help="seconds an empty sector is kept before it is reclaimed",
+                        type=float,
+                        default=300)
+    parser.add_argument("-w", "--workers",
+                        help="number of worker processes to spread sectors across",
+                        type=int,
+                        default=1)
+    parser.add_argument("--resume-grace",
+                        help="seconds a dropped player's place is held for them to resume",
+                        type=float,
+                        default=30)
+    parser.add_argument("--drain-timeout",
+                        help="seconds games in progress get to finish after SIGTERM",
+                        type=float,
+                        default=600)
+    parser.add_argument("--reuse-port",
+                        help="let a replacement server listen on the port while this one drains",
+                        action="store_true")
+    parser.add_argument("--send-budget",
+                        help="frames a client may have waiting to be sent to it",
+                        type=int,
+                        default=256)
+    parser.add_argument("--send-grace",
+                        help="seconds a client may stay over its send budget before it is dropped",
+                        type=float,
+                        default=5)
+    parser.add_argument("--journal",
+                        help="directory to journal game state to, recovered on startup")
     parser.add_argument("-v", "--verbose",
-                        help="show progress", action="store_true")
+                        help="log every message and game event", action="store_true")
     para = parser.parse_args()
     main(para)
     
\ No newline at end of file
@@ -0,0 +1,63 @@
+"""
+or_session.py
+Orbitals sessions
+Every named connection gets a session with a resume token. The frames
+sent on it are numbered from 1, the frame carrying the token, and the
+latest ones are kept: a client whose connection drops can reconnect
+within the grace period, present its token and the number of the last
+frame it received, and get only the frames it missed.
+"""
+import collections
+import secrets
+
+
+class OrbitalsSession:
+    """ Resume token, frame count and replay buffer of one connection """
+    __slots__ = ('_token', '_websocket', '_attached', '_sent', '_frames')
+
+    def __init__(self, websocket, replayLimit=128):
+        self._token = secrets.token_urlsafe(16)
+        self._websocket = websocket
+        self._attached = True
+        self._sent = 0
+        self._frames = collections.deque(maxlen=replayLimit)
+
+    def getToken(self):
+        return self._token
+
+    def getWebSocket(self):
+        """ Returns the connection the session is on, or was last on """
+        return self._websocket
+
+    def isAttached(self):
+        """ Returns False while the connection is down and the session is held """
+        return self._attached
+
+    def getSent(self):
+        """ Returns the number of frames sent on the session """
+        return self._sent
+
+    def record(self, msg):
+        """ numbers a frame sent on the session and keeps it for replays """
+        self._sent += 1
+        self._frames.append(msg)
+
+    def detach(self):
+        self._attached = False
+
+    def attach(self, websocket):
+        """ moves the session over to a new connection """
+        self._websocket = websocket
+        self._attached = True
+
+    def missedSince(self, sequence):
+        """
+        Returns the frames sent after frame number sequence,
+        None if some of them are no longer kept
+        """
+        missed = self._sent - sequence
+        if missed < 0 or missed > len(self._frames):
+            return None
+        if not missed:
+            return []
+        return list(self._frames)[-missed:]
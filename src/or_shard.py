@@ -0,0 +1,438 @@
+"""
+or_shard.py
+Orbitals sharding module
+Runs the cluster across several worker processes:
+- every worker process runs its own OrbitalsCluster, owning a disjoint
+  set of sector ids, on a local port
+- the lobby router accepts all client connections, serves the lobby and
+  forwards the connections of players who join a sector to the worker
+  that owns it
+- workers report their sector status to the router over a local IPC
+  queue, so the lobby lists the sectors of every worker
+"""
+import asyncio
+import functools
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import websockets
+import or_codec
+import or_comms as orbComms
+import or_journal
+import or_log
+import or_metrics
+from or_cluster import OrbitalsCluster
+from or_dispatch import OrbitalsRejection
+from or_pubsub import lobbyTopic
+
+log = or_log.getLogger('shard')
+
+
+class OrbitalsRemoteSector:
+    """
+    Stands in for a sector owned by a worker process:
+    each player in the sector gets an upstream connection to the worker,
+    and the worker's frames are relayed to the player without being decoded
+    """
+
+    def __init__(self, details, workerIndex):
+        self._details = details
+        self._workerIndex = workerIndex
+        self._dirty = True
+        # as last reported by the worker
+        self._playing = False
+        self._upstreams = dict()
+        self._relays = dict()
+
+    def getName(self):
+        return self._details['name']
+
+    def getSymbol(self):
+        return int(self._details['symbol'])
+
+    def getWorkerIndex(self):
+        return self._workerIndex
+
+    def getSectorDetails(self):
+        return self._details
+
+    def setSectorDetails(self, details):
+        self._details = details
+        self._dirty = True
+
+    def isDirty(self):
+        return self._dirty
+
+    def clearDirty(self):
+        self._dirty = False
+
+    def isEmpty(self):
+        return not self._upstreams
+
+    def isPlaying(self):
+        """ Returns True if the worker last reported a game in progress here """
+        return self._playing
+
+    def setPlaying(self, playing):
+        self._playing = playing
+
+    @staticmethod
+    def optionsPacket(websocket):
+        """ Returns the options packet carrying the player's client options """
+        return {'type': 'options', 'batch': orbComms.isBatching(websocket),
+                'diffs': orbComms.isDiffing(websocket), 'clock': orbComms.isClock(websocket)}
+
+    async def newPlayer(self, name, websocket, workerUrl, timeout=5):
+        """
+        opens the player's upstream connection:
+        replays the name request and the join on the worker, then relays
+        everything from the frame carrying 'joined-sector' on back to the player.
+        Returns True once the worker has accepted the player
+        """
+        # the worker talks to the player's codec, its frames are relayed as is
+        codec = orbComms.getCodec(websocket)
+        try:
+            # the router deflates for the player, not over the loopback
+            upstream = await websockets.connect(workerUrl,
+                                                subprotocols=[codec.subprotocol],
+                                                compression=None)
+        except OSError:
+            return False
+        try:
+            options = self.optionsPacket(websocket)
+            if options['batch'] or options['diffs'] or options['clock']:
+                # the worker batches, diffs and clocks for us, its frames are relayed as is
+                await upstream.send(codec.encode(options))
+            await upstream.send(codec.encode({'type': 'name-request', 'name': name}))
+            await upstream.send(codec.encode({'type': 'join-sector',
+                                              'sector': self.getName()}))
+            # drop the worker's welcome, name response and lobby updates
+            while True:
+                msg = await asyncio.wait_for(upstream.recv(), timeout)
+                packet = codec.decode(msg)
+                if packet['type'] == 'batch':
+                    responses = packet['packets']
+                else:
+                    responses = [packet]
+                joined = False
+                for packet in responses:
+                    if packet['type'] == 'response':
+                        if packet['msg'] == 'joined-sector':
+                            joined = True
+                        elif packet['msg'] == 'name-not-accepted':
+                            raise ValueError(packet['reason'])
+                if joined:
+                    break
+        except (asyncio.TimeoutError, ValueError, websockets.ConnectionClosed):
+            await upstream.close()
+            return False
+
+        orbComms.send(websocket, msg)
+        self._upstreams[websocket] = upstream
+        self._relays[websocket] = asyncio.ensure_future(self.relay(websocket, upstream))
+        return True
+
+    def replaceConnection(self, oldWebsocket, websocket):
+        """ relays the worker's frames to the player's new connection """
+        upstream = self._upstreams.pop(oldWebsocket, None)
+        relay = self._relays.pop(oldWebsocket, None)
+        if relay:
+            relay.cancel()
+        if upstream:
+            self._upstreams[websocket] = upstream
+            self._relays[websocket] = asyncio.ensure_future(self.relay(websocket, upstream))
+
+    async def relay(self, websocket, upstream):
+        """ forwards worker frames to the player until either side closes """
+        try:
+            async for msg in upstream:
+                orbComms.send(websocket, msg)
+        except websockets.ConnectionClosed:
+            pass
+        if self._upstreams.get(websocket) is upstream:
+            # the worker went away: drop the player so they can reconnect
+            await websocket.close(1011, 'sector unavailable')
+
+    async def relayFrame(self, websocket, frame):
+        """ forwards a player frame to the worker as it is, Returns False if there is no upstream """
+        upstream = self._upstreams.get(websocket)
+        if upstream is None:
+            return False
+        try:
+            await upstream.send(frame)
+        except websockets.ConnectionClosed:
+            # the relay task closes the player's connection
+            pass
+        return True
+
+    async def newMessage(self, websocket, data):
+        """ forwards a player message the router had to decode to the worker """
+        upstream = self._upstreams.get(websocket)
+        if upstream:
+            await upstream.send(orbComms.getCodec(websocket).encode(data))
+
+    async def setOptions(self, websocket):
+        """ passes the player's new client options on to the worker """
+        upstream = self._upstreams.get(websocket)
+        if upstream:
+            codec = orbComms.getCodec(websocket)
+            await upstream.send(codec.encode(self.optionsPacket(websocket)))
+
+    async def closeUpstreams(self):
+        """ closes every upstream, leaving the players connected to the router """
+        for websocket in list(self._upstreams):
+            await self.deleteConnection(websocket)
+
+    async def deleteConnection(self, websocket):
+        """ closes the player's upstream: the worker sees them leave """
+        upstream = self._upstreams.pop(websocket, None)
+        relay = self._relays.pop(websocket, None)
+        if upstream:
+            await upstream.close()
+        if relay:
+            relay.cancel()
+
+
+class OrbitalsShardRouter(OrbitalsCluster):
+    """
+    Lobby router: a cluster with no local sectors
+    Its sectors are OrbitalsRemoteSector stand-ins, kept up to date
+    from the status reports of the workers
+    """
+
+    def __init__(self, resumeGrace=30, workers=()):
+        super().__init__(sectorCount=0, resumeGrace=resumeGrace)
+        self._workers = list(workers)
+        self._workerUrls = dict()
+        # frames of players in a sector are relayed undecoded, except these
+        self._routerTypes = self.memberMessages.getTypes()
+
+    def updateSector(self, sector):
+        """ remote sectors are opened, hibernated and reclaimed by their worker """
+
+    async def relayFrame(self, websocket, frame):
+        """
+        passes a player's frame on to the worker owning their sector, undecoded:
+        only frames that may be for the router itself are decoded here
+        """
+        sector = self._directory.getSector(websocket)
+        if sector is None or orbComms.getCodec(websocket).mayHoldType(frame, self._routerTypes):
+            return False
+        return await sector.relayFrame(websocket, frame)
+
+    async def setOptions(self, websocket, batch, diffs, clock):
+        """ client options are kept here, and by the worker for the player's sector """
+        await super().setOptions(websocket, batch, diffs, clock)
+        sector = self._directory.getSector(websocket)
+        if sector:
+            await sector.setOptions(websocket)
+
+    def setWorkerUrl(self, workerIndex, url):
+        self._workerUrls[workerIndex] = url
+
+    def updateWorkerStatus(self, workerIndex, changed, removed):
+        """ applies a worker's lobby update to the remote sectors """
+        added = False
+        for details in changed:
+            sector = self._sectorDict.get(details['name'])
+            if sector:
+                sector.setSectorDetails(details)
+            else:
+                sector = OrbitalsRemoteSector(details, workerIndex)
+                self._sectorDict[details['name']] = sector
+                added = True
+            self._dirtySectors.add(sector)
+        for name in removed:
+            sector = self._sectorDict.pop(name, None)
+            if sector:
+                self._dirtySectors.discard(sector)
+                self._removedSectors.append(name)
+
+        if added:
+            # keep the lobby list in sector id order across workers
+            allSectors = sorted(self._sectorDict.values(),
+                                key=lambda sector: sector.getSymbol())
+            self._sectorDict = {sector.getName(): sector for sector in allSectors}
+        self.scheduleClusterStatus()
+
+    async def joinSector(self, websocket, requestedSector):
+        """ joins are forwarded to the worker owning the sector """
+        if not self._directory.isNamed(websocket):
+            raise OrbitalsRejection('choose a name first')
+        if self._draining:
+            raise OrbitalsRejection('server is restarting')
+        sector = self._sectorDict.get(requestedSector)
+        if sector is None:
+            raise OrbitalsRejection('no such sector')
+        workerUrl = self._workerUrls.get(sector.getWorkerIndex())
+        if not workerUrl or not await sector.newPlayer(self._directory.getName(websocket),
+                                                       websocket, workerUrl):
+            log.warning("Sector %s is not available", requestedSector)
+            raise OrbitalsRejection('sector unavailable')
+        self._directory.setSector(websocket, sector)
+        self._topics.unsubscribe(websocket, lobbyTopic)
+        log.info("Player has joined the sector on worker %d", sector.getWorkerIndex(),
+                 extra={'sector': requestedSector})
+
+    async def drain(self, timeout, reconnectSpread=10, workerGrace=15):
+        """
+        drains the workers along with the router: the workers keep their
+        games going while the router hints the players, then close their
+        journals and exit once the router lets go of their connections
+        """
+        for worker in self._workers:
+            worker.terminate()
+        await super().drain(timeout, reconnectSpread)
+        for sector in self._sectorDict.values():
+            await sector.closeUpstreams()
+        loop = asyncio.get_event_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.join, workerGrace)
+
+    def updateWorkerPlaying(self, workerIndex, playing):
+        """ applies a worker's report of its sectors with a game in progress """
+        playing = set(playing)
+        for name, sector in self._sectorDict.items():
+            if sector.getWorkerIndex() == workerIndex:
+                sector.setPlaying(name in playing)
+
+    def readWorkerReports(self, loop, reportQueue):
+        """ runs in a thread: hands worker reports over to the event loop """
+        while True:
+            kind, workerIndex, payload = reportQueue.get()
+            if kind == 'ready':
+                url = f"ws://127.0.0.1:{payload}"
+                loop.call_soon_threadsafe(self.setWorkerUrl, workerIndex, url)
+            elif kind == 'status':
+                changed, removed = payload
+                loop.call_soon_threadsafe(self.updateWorkerStatus,
+                                          workerIndex, changed, removed)
+            elif kind == 'playing':
+                loop.call_soon_threadsafe(self.updateWorkerPlaying, workerIndex, payload)
+
+
+async def reportPlaying(workerIndex, cluster, reportQueue, interval=1):
+    """ runs in a worker: tells the router which sectors are in play whenever that changes """
+    reported = None
+    while True:
+        playing = cluster.getPlayingSectors()
+        if playing != reported:
+            reportQueue.put(('playing', workerIndex, playing))
+            reported = playing
+        await asyncio.sleep(interval)
+
+
+def stopWithParent(parent, loop):
+    """
+    runs in a thread: stops the worker when the router process dies,
+    so it still closes its journal on the way out
+    """
+    parent.join()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def startWorkerDrain(workerIndex, loop, server, cluster, timeout):
+    """ SIGTERM in a worker: drains it, later SIGTERMs are ignored """
+    loop.add_signal_handler(signal.SIGTERM, lambda: None)
+    loop.create_task(drainWorker(workerIndex, loop, server, cluster, timeout))
+
+
+async def drainWorker(workerIndex, loop, server, cluster, timeout, grace=10):
+    """
+    lets the games in progress finish, with the router told which are
+    still on, closes the journal, and stops the loop once the router
+    closed the connections of the players it hinted
+    """
+    await cluster.drain(timeout, hint=False)
+    deadline = time.monotonic() + grace
+    while cluster.getConnectionCount() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+    cluster.getTimerWheel().stop()
+    await orbComms.flush()
+    await asyncio.sleep(0)
+    log.info("Worker %d drained", workerIndex)
+    loop.stop()
+
+
+def runWorker(workerIndex, workerCount, sectorCount, idleGrace, reportQueue, handler,
+              verbose=False, journalDirectory=None, drainTimeout=600):
+    """
+    worker process: serves its share of the sectors on a local port
+    each worker keeps its own journal, in a subdirectory of journalDirectory
+    """
+    logListener = or_log.setupLogging(verbose)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    watchdog = threading.Thread(target=stopWithParent,
+                                args=(multiprocessing.parent_process(), loop), daemon=True)
+    watchdog.start()
+    journal = None
+    if journalDirectory:
+        journal = or_journal.OrbitalsJournal(os.path.join(journalDirectory,
+                                                          f"worker-{workerIndex}"))
+    # players resume their session with the router, which keeps the
+    # upstream connection open meanwhile: workers drop connections at once
+    cluster = OrbitalsCluster(sectorCount=max(1, math.ceil(sectorCount / workerCount)),
+                              idleGrace=idleGrace,
+                              firstSectorId=workerIndex + 1,
+                              sectorIdStride=workerCount,
+                              journal=journal,
+                              resumeGrace=0)
+    cluster.addStatusListener(
+        lambda changed, removed: reportQueue.put(('status', workerIndex,
+                                                  (changed, removed))))
+
+    boundHandler = functools.partial(handler, cluster=cluster)
+    server = loop.run_until_complete(
+        websockets.serve(boundHandler, '127.0.0.1', 0,
+                         subprotocols=or_codec.getSubprotocols(),
+                         process_request=or_metrics.processRequest,
+                         compression=None))
+    port = server.sockets[0].getsockname()[1]
+    reportQueue.put(('ready', workerIndex, port))
+    reportQueue.put(('status', workerIndex, (cluster.getClusterStatus(), [])))
+    log.info("Worker %d serving on port %d", workerIndex, port)
+    reporter = loop.create_task(reportPlaying(workerIndex, cluster, reportQueue))
+    loop.add_signal_handler(signal.SIGTERM, functools.partial(
+        startWorkerDrain, workerIndex, loop, server, cluster, drainTimeout))
+    try:
+        loop.run_forever()
+    finally:
+        reporter.cancel()
+        loop.run_until_complete(asyncio.gather(reporter, return_exceptions=True))
+        loop.close()
+        if journal:
+            journal.close()
+        logListener.stop()
+
+
+def startWorkers(workerCount, sectorCount, idleGrace, handler, verbose=False,
+                 journalDirectory=None, resumeGrace=30, drainTimeout=600):
+    """
+    Starts the worker processes and a router listening to their reports
+    Returns the router
+    """
+    context = multiprocessing.get_context('spawn')
+    reportQueue = context.Queue()
+    workers = []
+    for workerIndex in range(workerCount):
+        worker = context.Process(target=runWorker,
+                                 name=f"worker-{workerIndex}",
+                                 args=(workerIndex, workerCount, sectorCount,
+                                       idleGrace, reportQueue, handler, verbose,
+                                       journalDirectory, drainTimeout),
+                                 daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    router = OrbitalsShardRouter(resumeGrace, workers)
+    loop = asyncio.get_event_loop()
+    reader = threading.Thread(target=router.readWorkerReports,
+                              args=(loop, reportQueue), daemon=True)
+    reader.start()
+    return router
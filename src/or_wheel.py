@@ -0,0 +1,175 @@
+"""
+or_wheel.py
+Orbitals timer wheel
+Drives the deadlines of every sector in a cluster from a single coroutine:
+- deadlines are monotonic timestamps, hashed into slots by tick number
+- each key holds at most one live deadline
+- schedule and cancel are O(1)
+"""
+import asyncio
+import math
+import time
+import or_metrics
+
+_tickSeconds = or_metrics.histogram('orbitals_timer_tick_seconds',
+                                    'Time spent firing the deadlines of one wheel tick')
+_driftSeconds = or_metrics.histogram('orbitals_timer_drift_seconds',
+                                     'Lateness of deadlines when they fire, turn timers included')
+
+
+class OrbitalsTimerWheel:
+    """ Hashed timer wheel keyed on monotonic deadlines """
+
+    def __init__(self, resolution=0.05, slotCount=512):
+        self._resolution = resolution
+        self._slotCount = slotCount
+        self._slots = [dict() for _ in range(slotCount)]
+        self._entries = dict()
+        self._origin = time.monotonic()
+        self._currentTick = 0
+        self._task = None
+        self._startPending = False
+        self._stats = {'ticks': 0,
+                       'fired': 0,
+                       'tickTime': 0.0,
+                       'maxTickTime': 0.0,
+                       'drift': 0.0,
+                       'maxDrift': 0.0}
+
+    def now(self):
+        """ Returns the clock used for deadlines """
+        return time.monotonic()
+
+    def schedule(self, key, deadline, callback):
+        """
+        Sets the live deadline for key, replacing any previous one.
+        callback() is called once the deadline passes; if it returns
+        a coroutine, the coroutine is run as a task.
+        """
+        self.cancel(key)
+        if not self._entries:
+            # the wheel was idle: skip the empty ticks since it last ran
+            idleTick = int((time.monotonic() - self._origin) / self._resolution)
+            self._currentTick = max(self._currentTick, idleTick)
+        tick = math.ceil((deadline - self._origin) / self._resolution)
+        if tick <= self._currentTick:
+            tick = self._currentTick + 1
+        self._slots[tick % self._slotCount][key] = (tick, deadline, callback)
+        self._entries[key] = tick
+        self._ensureRunning()
+
+    def cancel(self, key):
+        """ Drops the live deadline for key, returns True if there was one """
+        tick = self._entries.pop(key, None)
+        if tick is None:
+            return False
+        del self._slots[tick % self._slotCount][key]
+        return True
+
+    def stop(self):
+        """ drops every live deadline and stops the driving coroutine """
+        for slot in self._slots:
+            slot.clear()
+        self._entries.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+    def pending(self, key):
+        """ Returns True if key has a live deadline """
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def advance(self, now=None):
+        """
+        Fires every deadline up to now, one slot per elapsed tick
+        Returns the number of callbacks fired
+        """
+        if now is None:
+            now = time.monotonic()
+        targetTick = int((now - self._origin) / self._resolution)
+        fired = 0
+        while self._currentTick < targetTick:
+            self._currentTick += 1
+            if not self._entries:
+                # nothing scheduled: jump straight to the target tick
+                self._currentTick = targetTick
+                break
+            slot = self._slots[self._currentTick % self._slotCount]
+            if not slot:
+                continue
+            started = time.perf_counter()
+            due = [(key, entry) for key, entry in slot.items()
+                   if entry[0] <= self._currentTick]
+            for key, entry in due:
+                if slot.get(key) is not entry:
+                    # cancelled or rescheduled by an earlier callback
+                    continue
+                _, deadline, callback = entry
+                del slot[key]
+                del self._entries[key]
+                self._recordDrift(now - deadline)
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            fired += len(due)
+            self._recordTick(time.perf_counter() - started, len(due))
+        return fired
+
+    def getStats(self):
+        """ Returns tick cost and drift figures in seconds """
+        stats = dict(self._stats)
+        stats['live'] = len(self._entries)
+        if stats['ticks']:
+            stats['meanTickTime'] = stats['tickTime'] / stats['ticks']
+        else:
+            stats['meanTickTime'] = 0.0
+        if stats['fired']:
+            stats['meanDrift'] = stats['drift'] / stats['fired']
+        else:
+            stats['meanDrift'] = 0.0
+        return stats
+
+    def _recordTick(self, cost, fired):
+        self._stats['ticks'] += 1
+        self._stats['fired'] += fired
+        self._stats['tickTime'] += cost
+        if cost > self._stats['maxTickTime']:
+            self._stats['maxTickTime'] = cost
+        _tickSeconds.observe(cost)
+
+    def _recordDrift(self, drift):
+        self._stats['drift'] += drift
+        if drift > self._stats['maxDrift']:
+            self._stats['maxDrift'] = drift
+        _driftSeconds.observe(drift)
+
+    def _ensureRunning(self):
+        """ starts the driving coroutine if there is a loop to run it on """
+        if self._task is not None:
+            return
+        loop = asyncio.get_event_loop()
+        if loop.is_running():
+            self._task = loop.create_task(self._run())
+        elif not self._startPending:
+            # scheduled before the loop runs: start driving it once it does
+            self._startPending = True
+            loop.call_soon(self._startLater)
+
+    def _startLater(self):
+        self._startPending = False
+        if self._entries:
+            self._ensureRunning()
+
+    async def _run(self):
+        """ wakes up once per tick while there are live deadlines """
+        try:
+            while self._entries:
+                wake = self._origin + (self._currentTick + 1) * self._resolution
+                delay = wake - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.advance()
+        finally:
+            self._task = None
@@ -1,48 +1,89 @@
 """
 or_words.py
 Orbitals words class
+The word deck is read once per process and shared by every sector
+Each board carries a version, bumped when a board is dealt and whenever
+a word is opened, so clients can catch up from the version they hold.
 """
+import os
 import random
 
+deckFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'assets', 'or_words.txt')
+_deck = None
+
+
+def loadDeck():
+    """
+    Returns the immutable word deck, reading it on first use:
+    a tuple, so boards can be sampled from it without copying
+    """
+    global _deck
+    if _deck is None:
+        with open(deckFileName, 'r') as orWordFile:
+            words = {line.strip() for line in orWordFile}
+        words.discard('')
+        _deck = tuple(sorted(words))
+    return _deck
+
+
 class OrbitalsWords:
     """ Provides the game words """
     def __init__(self, wordCount):
-        self._fullDeck = set()
+        self._fullDeck = ()
         self._orbWords = dict()
         self._openedWords = dict()
         self._wordCount = wordCount
         self._oWordsLeft = 0
         self._bWordsLeft = 0
         self._firstTurn = ''
+        # public board, built on first use and updated in place as words are opened
+        self._wordList = None
+        self._wordEntries = None
+        self._keyList = None
+        self._version = 0
+        self._boardVersion = 0
+        self._openOrder = []
         self.readWords()
 
     def readWords(self):
         """
-        Reads words form a text file and assigns them to _fullDeck set
+        Points _fullDeck at the shared word deck
         """
-        orWordFile = open('assets/or_words.txt', 'r')
-        self._fullDeck = {line.strip() for line in orWordFile.readlines()}
+        self._fullDeck = loadDeck()
 
     def shuffleDeck(self):
         """ Generate new set of words """
-        self._orbWords.clear()
-        self._openedWords.clear()
-
-        # get a shuffled deck
-        tempDeck = list(self._fullDeck)
-        for _ in range(self._wordCount):
-            print(f"deck has {len(tempDeck)} words")
-            pick = random.randint(0, len(tempDeck)-1)
-            print(f"pick: {pick}")
-            self._orbWords[tempDeck[pick]] = 'N'
-            self._openedWords[tempDeck[pick]] = '-'
-            tempDeck.remove(tempDeck[pick])
+        # sample the board straight from the shared deck: O(wordCount)
+        picks = random.sample(self._fullDeck, self._wordCount)
+        self._orbWords = dict.fromkeys(picks, 'N')
+        self._openedWords = dict.fromkeys(picks, '-')
+        self.newBoard()
+
+    def newBoard(self):
+        """ starts a new board version, the board lists are rebuilt on first use """
+        self._wordList = None
+        self._wordEntries = None
+        self._keyList = None
+        self._version += 1
+        self._boardVersion = self._version
+        self._openOrder = []
+
+    def buildLists(self):
+        """ builds the public and key lists of the board, once per board """
+        if self._wordList is None:
+            self._wordList = [{'word': word, 'team': team}
+                              for word, team in self._openedWords.items()]
+            self._wordEntries = {entry['word']: entry for entry in self._wordList}
+            self._keyList = [{'word': word, 'team': team}
+                             for word, team in self._orbWords.items()]
 
     def assignKeys(self):
         """
         Randomly assign teams to words
         """
         tempDeck = list(self._orbWords.keys())
+        random.shuffle(tempDeck)
 
         # Flip a coin to decide who goes first
         first = random.randint(0, 1)
@@ -53,18 +94,16 @@ class OrbitalsWords:
             blue = False
             self._firstTurn = 'O'
 
-        for _ in range(len(self._orbWords)):
-            pick = random.randint(0, len(tempDeck)-1)
-            # Stop assigning keys when there are three words left
-            if len(tempDeck) > 3:
-                if blue:
-                    self._orbWords[tempDeck[pick]] = 'B'
-                    self._bWordsLeft += 1
-                else:
-                    self._orbWords[tempDeck[pick]] = 'O'
-                    self._oWordsLeft += 1
+        # Stop assigning keys when there are three words left
+        for word in tempDeck[:-3]:
+            if blue:
+                self._orbWords[word] = 'B'
+                self._bWordsLeft += 1
+            else:
+                self._orbWords[word] = 'O'
+                self._oWordsLeft += 1
             blue = not blue
-            tempDeck.remove(tempDeck[pick])
+        self.newBoard()
 
     def getFirstTurn(self):
         """ Returns starting team """
@@ -73,22 +112,46 @@ class OrbitalsWords:
     def getWords(self):
         """
         Returns list of dictionaries with 'word' and 'team' keys
-        Uses the _openedWords dictionary: includes guessed words
+        Includes guessed words: the list is updated in place as words
+        are opened and must not be changed by callers
         """
-        wordList = []
-        for word, team in self._openedWords.items():
-            wordList.append({'word': word, 'team': team})
-        return wordList
+        self.buildLists()
+        return self._wordList
 
     def getKeywords(self):
         """
         Returns list of dictionaries with 'word' and 'team' keys
-        Uses the _orbWords dictionary
+        The team of every word: must not be changed by callers
         """
-        keyWordList = []
-        for word, team in self._orbWords.items():
-            keyWordList.append({'word': word, 'team': team})
-        return keyWordList
+        self.buildLists()
+        return self._keyList
+
+    def getVersion(self):
+        """ Returns the board version """
+        return self._version
+
+    def getBoardVersion(self):
+        """ Returns the version the current board was dealt at """
+        return self._boardVersion
+
+    def openedSince(self, version):
+        """
+        Returns the entries of the words opened after version,
+        None if version is not one of the current board's
+        """
+        if version < self._boardVersion or version > self._version:
+            return None
+        self.buildLists()
+        return [self._wordEntries[word]
+                for word in self._openOrder[version - self._boardVersion:]]
+
+    def hasWord(self, word):
+        """ Returns True if word is on the board """
+        return word in self._orbWords
+
+    def isOpened(self, word):
+        """ Returns True if the word has been guessed """
+        return self._openedWords[word] != '-'
 
     def getTeam(self, word):
         """ Returns the team the word belongs to """
@@ -106,6 +169,29 @@ class OrbitalsWords:
         self._openedWords = dict()
         self._bWordsLeft = 0
         self._oWordsLeft = 0
+        self.newBoard()
+
+    def restore(self, keywords, openedWords, firstTurn):
+        """
+        Rebuilds a board recovered from the journal:
+        keywords as returned by getKeywords, openedWords the words guessed
+        """
+        self._orbWords = {entry['word']: entry['team'] for entry in keywords}
+        self._openedWords = dict.fromkeys(self._orbWords, '-')
+        for word in openedWords:
+            self._openedWords[word] = self._orbWords[word]
+        self.newBoard()
+        self._openOrder = list(openedWords)
+        self._version += len(self._openOrder)
+        self._firstTurn = firstTurn
+        self._oWordsLeft = 0
+        self._bWordsLeft = 0
+        for word, team in self._orbWords.items():
+            if self._openedWords[word] == '-':
+                if team == 'O':
+                    self._oWordsLeft += 1
+                elif team == 'B':
+                    self._bWordsLeft += 1
 
     def newGuess(self, guess, team):
         """ Process new guess """
@@ -118,6 +204,10 @@ class OrbitalsWords:
         if self._openedWords[guess] == '-':  # no
             res["newGuess"] = True
             self._openedWords[guess] = self._orbWords[guess]
+            if self._wordEntries is not None:
+                self._wordEntries[guess]['team'] = self._orbWords[guess]
+            self._openOrder.append(guess)
+            self._version += 1
             if self._orbWords[guess] == 'O':
                 self._oWordsLeft -= 1
                 if self._oWordsLeft == 0:
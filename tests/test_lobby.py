@@ -0,0 +1,47 @@
+"""
+test_lobby.py
+Lobby requests that cannot be served are answered, never left waiting.
+
+Usage: python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_comms as orbComms
+from or_cluster import OrbitalsCluster
+
+
+class FakeSocket:
+    """ stands in for a websocket: keeps the packets it was sent """
+    def __init__(self):
+        self.packets = []
+        self.open = True
+
+    async def send(self, frame):
+        self.packets.append(json.loads(frame))
+
+
+class LobbyTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.cluster = OrbitalsCluster(sectorCount=1)
+
+    async def asyncTearDown(self):
+        self.cluster.getTimerWheel().stop()
+
+    async def testJoinUnknownSector(self):
+        websocket = FakeSocket()
+        await self.cluster.newConnection(websocket)
+        await self.cluster.newMessage(websocket, {'type': 'name-request', 'name': 'alice'})
+        await self.cluster.newMessage(websocket, {'type': 'join-sector', 'sector': 'SECTOR-99'})
+        await orbComms.flush()
+        self.assertEqual(websocket.packets[-1], {'type': 'response', 'msg': 'rejected',
+                                                 'request': 'join-sector',
+                                                 'reason': 'no such sector'})
+
+
+if __name__ == '__main__':
+    unittest.main()
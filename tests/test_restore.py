@@ -0,0 +1,36 @@
+"""
+test_restore.py
+Sectors recovered from a journal: new sectors are numbered past the
+highest recovered id, on the cluster's own id sequence.
+
+Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from or_cluster import OrbitalsCluster
+from or_journal import newSectorState
+
+
+class RestoreTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncTearDown(self):
+        self.cluster.getTimerWheel().stop()
+
+    async def testNumberingPastRecoveredSectors(self):
+        self.cluster = OrbitalsCluster(sectorCount=1)
+        self.cluster.restoreSectors({'SECTOR-3': newSectorState(),
+                                     'SECTOR-7': newSectorState()})
+        self.assertEqual(self.cluster.newSector().getName(), 'SECTOR-8')
+
+    async def testNumberingKeepsStride(self):
+        # the second of two workers, recovering a journal written by a single server
+        self.cluster = OrbitalsCluster(sectorCount=1, firstSectorId=2, sectorIdStride=2)
+        self.cluster.restoreSectors({'SECTOR-5': newSectorState()})
+        self.assertEqual(self.cluster.newSector().getName(), 'SECTOR-6')
+
+
+if __name__ == '__main__':
+    unittest.main()
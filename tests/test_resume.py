@@ -0,0 +1,86 @@
+"""
+test_resume.py
+Resuming a session while frames for the dropped connection are still
+queued: the new connection gets every frame the client missed, once.
+
+Usage: python -m unittest discover tests
+"""
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import or_comms as orbComms
+from or_cluster import OrbitalsCluster
+
+
+class FakeSocket:
+    """ stands in for a websocket: keeps the packets it was sent, stalls while gated """
+    def __init__(self):
+        self.packets = []
+        self.open = True
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send(self, frame):
+        await self.gate.wait()
+        self.packets.append(json.loads(frame))
+
+    async def close(self, code, reason):
+        self.open = False
+
+    def chat(self):
+        return [packet['msg'] for packet in self.packets if packet['type'] == 'msg']
+
+
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.cluster = OrbitalsCluster(sectorCount=1)
+
+    async def asyncTearDown(self):
+        self.cluster.getTimerWheel().stop()
+
+    async def connect(self, name):
+        websocket = FakeSocket()
+        await self.cluster.newConnection(websocket)
+        await self.cluster.newMessage(websocket, {'type': 'name-request', 'name': name})
+        await self.cluster.newMessage(websocket, {'type': 'join-sector', 'sector': 'SECTOR-1'})
+        await orbComms.flush()
+        return websocket
+
+    async def testResumeWithFramesQueued(self):
+        alice = await self.connect('alice')
+        bob = await self.connect('bob')
+        token = next(packet['token'] for packet in alice.packets
+                     if packet.get('msg') == 'name-accepted')
+        # every frame but the welcome is numbered
+        sequence = len(alice.packets) - 1
+
+        # alice's connection stalls: one chat frame is being written, the others wait
+        alice.gate.clear()
+        for text in ('one', 'two', 'three'):
+            await self.cluster.newMessage(bob, {'type': 'message', 'message': text})
+        await asyncio.sleep(0)
+
+        # she resumes before the server sees the old connection drop
+        resumed = FakeSocket()
+        await self.cluster.newConnection(resumed)
+        await self.cluster.newMessage(resumed, {'type': 'resume', 'token': token,
+                                                'sequence': sequence})
+        alice.gate.set()
+        await orbComms.flush()
+
+        self.assertIn('resumed', [packet.get('msg') for packet in resumed.packets])
+        self.assertEqual(resumed.chat(), ['one', 'two', 'three'])
+
+        # frames sent from then on carry on from the replayed ones
+        await self.cluster.newMessage(bob, {'type': 'message', 'message': 'four'})
+        await orbComms.flush()
+        self.assertEqual(resumed.chat(), ['one', 'two', 'three', 'four'])
+
+
+if __name__ == '__main__':
+    unittest.main()